@@ -4,10 +4,13 @@ Flask app factory for PKI Cash — one actor per process, RNS transport.
 Usage: called from run.py, not directly.
 """
 
+import atexit
 import json
 import os
 import queue
 import threading
+import time
+import uuid
 from datetime import datetime
 
 from flask import (
@@ -15,10 +18,18 @@ from flask import (
     flash, jsonify, session, Response,
 )
 
+from src.admission import IngressQueue, busy_reply, priority
+from src.delivery_coalescer import PACK_TYPE, DeliveryCoalescer, unpack_deliveries
+from src.coin_status import (
+    STATUS_BATCH_MAX, decode_request, decode_status, encode_request, encode_status, fingerprint,
+)
 from src.issuer import Issuer
 from src.engine import StateEngine, InvalidSignatureError, UntrustedIssuerError, UnknownCoinError
+from src.engine_pipeline import EnginePipeline, MESSAGE_TYPES as PIPELINE_MESSAGE_TYPES
+from src.replica import ShardedReplica, serve_pull
+from src.sharded_engine import ShardedStateEngine, count_coins
+from src.verifier import VerificationExecutor
 from src.wallet import Wallet
-from src.coin import Coin
 
 
 def _load_json(path, default):
@@ -211,7 +222,9 @@ def create_app(role, transport, data_dir, wallet_id=None):
 
     # ── role-specific routes ────────────────────────────────
 
-    if role == "engine":
+    if role == "engine" and REPLICA_OF:
+        _register_replica_routes(app, transport, data_dir, notify_local)
+    elif role == "engine":
         _register_engine_routes(app, transport, data_dir, notify_local)
     elif role == "bank":
         _register_bank_routes(app, transport, data_dir, notify_local)
@@ -227,9 +240,13 @@ def create_app(role, transport, data_dir, wallet_id=None):
         from_role = msg.get("from_role", "")
         print(f"[RNS MSG] role={role} type={msg_type} from={from_role}", flush=True)
 
-        if role == "engine":
-            _engine_handle_message(app, transport, data_dir, notify_local,
-                                   msg_type, payload, from_hash, from_role)
+        if role == "engine" and REPLICA_OF:
+            _replica_handle_message(transport, data_dir, msg_type, payload, from_hash, from_role)
+        elif role == "engine":
+            if "ingress_seq" in msg:
+                # Acknowledged in the ingress log once the engine is done with it
+                msg["ack_deferred"] = True
+            _get_ingress(app, transport, data_dir, notify_local).offer(msg)
         elif role == "bank":
             _bank_handle_message(app, transport, data_dir, notify_local,
                                   msg_type, payload, from_hash, from_role)
@@ -238,6 +255,8 @@ def create_app(role, transport, data_dir, wallet_id=None):
                                     msg_type, payload, from_hash, from_role)
 
     transport.on_message(handle_rns_message)
+    transport.start_consumer()
+    atexit.register(transport.close)
     transport.on_announce(lambda info: notify_local({"type": "announce", **info}))
 
     return app
@@ -247,14 +266,254 @@ def create_app(role, transport, data_dir, wallet_id=None):
 #  ENGINE
 # ════════════════════════════════════════════════════════════
 
+# One StateEngine per data_dir for the whole actor process, shared by the
+# HTTP routes and the RNS message handlers.
+_engines: dict[str, StateEngine | ShardedStateEngine] = {}
+_engine_startup_hooks: dict[str, list] = {}
+_engines_lock = threading.Lock()
+
+DELIVERY_RETENTION_S = float(os.environ.get("PKICASH_DELIVERY_RETENTION_S", 7 * 24 * 3600))
+DELIVERY_COMPACT_INTERVAL_S = 600
+ENGINE_SHARDS = int(os.environ.get("PKICASH_ENGINE_SHARDS", 1))
+# Every shard in its own process, so shards use separate cores
+SHARD_PROCESSES = os.environ.get("PKICASH_SHARD_PROCESSES", "1") == "1"
+VERIFY_WORKERS = int(os.environ.get("PKICASH_VERIFY_WORKERS", 0))
+VERIFY_BATCH_SIZE = int(os.environ.get("PKICASH_VERIFY_BATCH_SIZE", 64))
+VERIFY_MAX_LATENCY_MS = float(os.environ.get("PKICASH_VERIFY_MAX_LATENCY_MS", 2.0))
+MERKLE_CONFIRMATIONS = os.environ.get("PKICASH_MERKLE_CONFIRMATIONS", "0") == "1"
+JOURNAL = os.environ.get("PKICASH_JOURNAL", "0") == "1"
+JOURNAL_SNAPSHOT_EVERY = int(os.environ.get("PKICASH_JOURNAL_SNAPSHOT_EVERY", 10000))
+JOURNAL_FSYNC = os.environ.get("PKICASH_JOURNAL_FSYNC", "0") == "1"
+JOURNAL_RECOVER = os.environ.get("PKICASH_JOURNAL_RECOVER", "0") == "1"
+SPENT_FILTER_FP = float(os.environ.get("PKICASH_SPENT_FILTER_FP", 0))
+ENGINE_COINS_PAGE = 100
+REPLICA_OF = os.environ.get("PKICASH_REPLICA_OF", "")
+REPLICA_POLL_S = float(os.environ.get("PKICASH_REPLICA_POLL_S", 2.0))
+_verifier: list = [None]
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PKICASH_PIPELINE_QUEUE_SIZE", 256))
+PIPELINE_VERIFY_WORKERS = int(os.environ.get("PKICASH_PIPELINE_VERIFY_WORKERS", 4))
+PIPELINE_DELIVER_WORKERS = int(os.environ.get("PKICASH_PIPELINE_DELIVER_WORKERS", 8))
+PIPELINE_SUBMIT_WAIT_S = float(os.environ.get("PKICASH_PIPELINE_SUBMIT_WAIT_S", 5.0))
+_pipelines: dict[str, EnginePipeline] = {}
+INGRESS_QUEUE_SIZE = int(os.environ.get("PKICASH_INGRESS_QUEUE_SIZE", 1024))
+INGRESS_RATE = float(os.environ.get("PKICASH_INGRESS_RATE", 10))
+INGRESS_BURST = float(os.environ.get("PKICASH_INGRESS_BURST", 50))
+INGRESS_WORKERS = int(os.environ.get("PKICASH_INGRESS_WORKERS", 1))
+BUSY_REPLY_INTERVAL_S = 1.0
+BUSY_REPLY_QUEUE_SIZE = 256
+BUSY_REPLY_WORKERS = 2
+_busy_replies: queue.Queue = queue.Queue(maxsize=BUSY_REPLY_QUEUE_SIZE)
+_busy_workers: list[threading.Thread] = []
+_busy_lock = threading.Lock()
+_ingress: dict[str, IngressQueue] = {}
+DELIVERY_WINDOW_S = float(os.environ.get("PKICASH_DELIVERY_WINDOW_MS", 50)) / 1000
+_coalescers: dict[str, DeliveryCoalescer] = {}
+
+
 def _get_engine(data_dir):
-    db_path = os.path.join(data_dir, "engine.db")
-    key_path = os.path.join(data_dir, "engine.key")
-    if os.path.exists(key_path):
-        return StateEngine.load_key(key_path, db_path=db_path)
-    eng = StateEngine(db_path=db_path)
-    eng.save_key(key_path)
-    return eng
+    with _engines_lock:
+        e = _engines.get(data_dir)
+        if e is not None:
+            return e
+        db_path = os.path.join(data_dir, "engine.db")
+        key_path = os.path.join(data_dir, "engine.key")
+        if VERIFY_WORKERS > 0 and _verifier[0] is None:
+            _verifier[0] = VerificationExecutor(
+                workers=VERIFY_WORKERS, batch_size=VERIFY_BATCH_SIZE,
+                max_latency_ms=VERIFY_MAX_LATENCY_MS,
+            )
+        kwargs = {"verifier": _verifier[0], "merkle_confirmations": MERKLE_CONFIRMATIONS,
+                  "spent_filter_fp": SPENT_FILTER_FP}
+        if JOURNAL:
+            kwargs.update(journal_dir=os.path.join(data_dir, "journal"),
+                          snapshot_every=JOURNAL_SNAPSHOT_EVERY, journal_fsync=JOURNAL_FSYNC,
+                          journal_recover=JOURNAL_RECOVER)
+        if ENGINE_SHARDS > 1:
+            if os.path.exists(key_path):
+                e = ShardedStateEngine.load_key(key_path, data_dir, n_shards=ENGINE_SHARDS,
+                                                processes=SHARD_PROCESSES, **kwargs)
+            else:
+                e = ShardedStateEngine(data_dir, n_shards=ENGINE_SHARDS, processes=SHARD_PROCESSES, **kwargs)
+                e.save_key(key_path)
+        elif count_coins(os.path.join(data_dir, "engine-shard-0.db")):
+            raise ValueError(f"{data_dir} hoort bij een engine met shards; start met --shards")
+        elif os.path.exists(key_path):
+            e = StateEngine.load_key(key_path, db_path=db_path, **kwargs)
+        else:
+            e = StateEngine(db_path=db_path, **kwargs)
+            e.save_key(key_path)
+        e.delivery_retention_s = DELIVERY_RETENTION_S
+        if JOURNAL and JOURNAL_RECOVER:
+            e.rebuild_from_journal()
+        _engines[data_dir] = e
+        hooks = list(_engine_startup_hooks.get(data_dir, []))
+    for hook in hooks:
+        hook(e)
+    return e
+
+
+def _on_engine_start(data_dir, hook):
+    """Run hook(engine) once the engine for data_dir exists (now or later)."""
+    with _engines_lock:
+        _engine_startup_hooks.setdefault(data_dir, []).append(hook)
+        e = _engines.get(data_dir)
+    if e is not None:
+        hook(e)
+
+
+def _start_engine(data_dir):
+    """Open the engine at startup if it already has a key, and start the
+    background job that compacts delivered rows out of pending_deliveries."""
+    if os.path.exists(os.path.join(data_dir, "engine.key")):
+        _get_engine(data_dir)
+
+    def _compact_loop():
+        while True:
+            time.sleep(DELIVERY_COMPACT_INTERVAL_S)
+            with _engines_lock:
+                e = _engines.get(data_dir)
+            if e is None:
+                continue
+            try:
+                removed = e.compact_deliveries()
+                if removed:
+                    print(f"[ENGINE] {removed} afgeleverde deliveries opgeruimd", flush=True)
+            except Exception as exc:
+                print(f"[ENGINE] compactie MISLUKT: {exc}", flush=True)
+
+    threading.Thread(target=_compact_loop, daemon=True).start()
+
+
+def _get_coalescer(data_dir, transport):
+    """Per-recipient delivery coalescer for the engine in data_dir."""
+    e = _get_engine(data_dir)
+    with _engines_lock:
+        c = _coalescers.get(data_dir)
+        if c is None:
+            c = DeliveryCoalescer(e, transport.send, window_s=DELIVERY_WINDOW_S)
+            _coalescers[data_dir] = c
+        return c
+
+
+def _get_pipeline(data_dir, transport, notify_local):
+    """The staged message pipeline in front of the engine for data_dir."""
+    e = _get_engine(data_dir)
+    coalescer = _get_coalescer(data_dir, transport)
+    with _engines_lock:
+        p = _pipelines.get(data_dir)
+        if p is None:
+            p = EnginePipeline(
+                e, transport.send, coalescer, notify_local,
+                queue_size=PIPELINE_QUEUE_SIZE,
+                verify_workers=PIPELINE_VERIFY_WORKERS,
+                deliver_workers=PIPELINE_DELIVER_WORKERS,
+            )
+            _pipelines[data_dir] = p
+        return p
+
+
+def _get_ingress(app, transport, data_dir, notify_local):
+    """Bounded, rate-limited ingress queue in front of the engine's message handler."""
+    with _engines_lock:
+        q = _ingress.get(data_dir)
+        if q is not None:
+            return q
+        last_busy: dict[str, float] = {}
+
+        def handle(msg):
+            handed_off = False
+            try:
+                handed_off = _engine_handle_message(
+                    app, transport, data_dir, notify_local,
+                    msg.get("type", ""), msg.get("payload", {}),
+                    msg.get("from_hash", ""), msg.get("from_role", ""),
+                    on_done=lambda: transport.ack(msg))
+            finally:
+                if not handed_off:
+                    transport.ack(msg)
+
+        def shed(msg, reason):
+            transport.ack(msg)
+            from_hash = msg.get("from_hash", "")
+            print(f"[ENGINE] {msg.get('type', '?')} van {from_hash[:16]} GEWEIGERD - {reason}", flush=True)
+            if not from_hash:
+                return
+            # At most one busy reply per sender per interval, so a flood is not echoed
+            # back. Refused coin messages always get one: the wallet holds their coins
+            # until it hears back.
+            if priority(msg.get("type", "")) > 0:
+                now = time.monotonic()
+                if now - last_busy.get(from_hash, 0) < BUSY_REPLY_INTERVAL_S:
+                    return
+                if len(last_busy) > 4096:
+                    last_busy.clear()
+                last_busy[from_hash] = now
+            _queue_busy(transport, msg, reason, q.retry_after_s(from_hash) if reason == "rate" else 1.0)
+
+        q = IngressQueue(handle, shed, max_size=INGRESS_QUEUE_SIZE, rate=INGRESS_RATE,
+                         burst=INGRESS_BURST, workers=INGRESS_WORKERS)
+        _ingress[data_dir] = q
+        return q
+
+
+def _queue_busy(transport, msg, reason, retry_after_s):
+    """Hand a busy reply to the reply threads. transport.send can block for
+    seconds on a path request to an unknown sender, so it never runs on the
+    RNS callback thread or an ingress worker. Dropped when the threads are
+    backed up."""
+    with _busy_lock:
+        while len(_busy_workers) < BUSY_REPLY_WORKERS:
+            t = threading.Thread(target=_busy_reply_loop, daemon=True,
+                                 name=f"busy-reply-{len(_busy_workers)}")
+            t.start()
+            _busy_workers.append(t)
+    try:
+        _busy_replies.put_nowait((transport, msg, reason, retry_after_s))
+    except queue.Full:
+        print(f"[ENGINE] busy antwoord aan {msg.get('from_hash', '')[:16]} overgeslagen - wachtrij vol",
+              flush=True)
+
+
+def _busy_reply_loop():
+    while True:
+        transport, msg, reason, retry_after_s = _busy_replies.get()
+        try:
+            _send_busy(transport, msg, reason, retry_after_s)
+        except Exception as exc:
+            print(f"[ENGINE] busy antwoord MISLUKT: {exc}", flush=True)
+
+
+def _send_busy(transport, msg, reason, retry_after_s):
+    transport.send(msg.get("from_hash", ""), msg.get("from_role", ""), "busy",
+                   busy_reply(msg, reason, retry_after_s))
+
+
+def _shutdown_engines():
+    with _engines_lock:
+        for q in _ingress.values():
+            q.shutdown()
+        _ingress.clear()
+        for p in _pipelines.values():
+            p.shutdown()
+        _pipelines.clear()
+        for c in _coalescers.values():
+            c.close()
+        _coalescers.clear()
+        for r in _replicas.values():
+            r.close()
+        _replicas.clear()
+        for e in _engines.values():
+            try:
+                e.close()
+            except Exception:
+                pass
+        _engines.clear()
+        if _verifier[0] is not None:
+            _verifier[0].shutdown()
+            _verifier[0] = None
+
+
+atexit.register(_shutdown_engines)
 
 
 def _get_engine_data(data_dir):
@@ -269,12 +528,16 @@ def _save_engine_data(data_dir, data):
 
 
 def _register_engine_routes(app, transport, data_dir, notify_local):
-    engine_instance = [None]
+    def _watch_issuers(e):
+        e.on_issuer_change(
+            lambda event, pk: notify_local({"type": "issuer_registered", "pk": pk[:16]})
+        )
+
+    _on_engine_start(data_dir, _watch_issuers)
+    _start_engine(data_dir)
 
     def eng():
-        if engine_instance[0] is None:
-            engine_instance[0] = _get_engine(data_dir)
-        return engine_instance[0]
+        return _get_engine(data_dir)
 
     @app.route("/")
     def engine_page():
@@ -282,6 +545,8 @@ def _register_engine_routes(app, transport, data_dir, notify_local):
         pk = None
         issuers = []
         coins = []
+        coin_count = 0
+        delivery_stats = None
         edata = _get_engine_data(data_dir)
 
         if os.path.exists(key_path):
@@ -290,7 +555,9 @@ def _register_engine_routes(app, transport, data_dir, notify_local):
             raw_issuers = e.list_issuers()
             names = edata.get("issuer_names", {})
             issuers = [{"pk": p, "name": names.get(p, "")} for p in raw_issuers]
-            coins = e.list_coins()
+            coins = e.list_coins(limit=ENGINE_COINS_PAGE)
+            coin_count = e.count_coins()
+            delivery_stats = e.delivery_queue_stats()
 
         inline_msg = session.pop("engine_msg", None)
         all_requests = edata.get("incoming_requests", [])
@@ -305,6 +572,9 @@ def _register_engine_routes(app, transport, data_dir, notify_local):
             engine_contact=f"{transport.dest_hash_hex}|{pk}" if pk else "",
             issuers=issuers,
             coins=coins,
+            coin_count=coin_count,
+            coins_page=ENGINE_COINS_PAGE,
+            delivery_stats=delivery_stats,
             contacts=edata.get("contacts", []),
             inline_msg=inline_msg,
             dest_hash=transport.dest_hash_hex,
@@ -317,6 +587,84 @@ def _register_engine_routes(app, transport, data_dir, notify_local):
             role=app.config["ACTOR_ROLE"],
         )
 
+    @app.route("/engine/api/coins")
+    def engine_api_coins():
+        """Coins as JSON, streamed. ?limit=N gives one page after ?after=<coin_id>
+        plus the cursor for the next page; without limit every coin is streamed.
+        The first page also carries the unfiltered total.
+        Filters: ?issuer=<64 hex pk> and ?owner=<hex prefix of the owner key>."""
+        if not os.path.exists(os.path.join(data_dir, "engine.key")):
+            return jsonify({"coins": [], "next": None})
+        filters = {
+            "after": request.args.get("after") or None,
+            "issuer": request.args.get("issuer", "").strip().lower() or None,
+            "owner_prefix": request.args.get("owner", "").strip().lower() or None,
+        }
+        limit = request.args.get("limit", type=int)
+        try:
+            if filters["after"]:
+                uuid.UUID(filters["after"])
+            # A full issuer key or an owner key prefix, checked before streaming starts
+            for value, lengths in ((filters["issuer"], (64,)), (filters["owner_prefix"], range(1, 65))):
+                if value and (len(value) not in lengths or value.strip("0123456789abcdef")):
+                    raise ValueError(value)
+        except ValueError:
+            return jsonify({"error": "ongeldige cursor of filter"}), 400
+
+        e = eng()
+        if limit is not None:
+            limit = max(1, min(limit, 1000))
+            coins = e.list_coins(limit=limit, **filters)
+            cursor = coins[-1]["coin_id"] if len(coins) == limit else None
+        else:
+            coins = e.iter_coins(**filters)
+            cursor = None
+
+        def generate():
+            yield '{"coins":['
+            for i, c in enumerate(coins):
+                yield ("," if i else "") + json.dumps(c)
+            yield '],"next":' + json.dumps(cursor)
+            if not filters["after"]:
+                yield ',"total":' + str(e.count_coins())
+            yield "}"
+
+        return Response(generate(), mimetype="application/json")
+
+    @app.route("/engine/stats")
+    def engine_stats():
+        if not os.path.exists(os.path.join(data_dir, "engine.key")):
+            return jsonify({"coins": 0})
+        return jsonify(eng().stats())
+
+    @app.route("/engine/connection-stats")
+    def engine_connection_stats():
+        if not os.path.exists(os.path.join(data_dir, "engine.key")):
+            return jsonify({"open": False})
+        return jsonify(eng().connection_stats())
+
+    @app.route("/engine/ingress-stats")
+    def engine_ingress_stats():
+        with _engines_lock:
+            q = _ingress.get(data_dir)
+        return jsonify(q.stats() if q is not None else {"running": False})
+
+    @app.route("/engine/delivery-stats")
+    def engine_delivery_stats():
+        with _engines_lock:
+            c = _coalescers.get(data_dir)
+        return jsonify(c.stats() if c is not None else {"running": False})
+
+    @app.route("/engine/ingress-log-stats")
+    def engine_ingress_log_stats():
+        return jsonify(transport.ingress_stats() or {"enabled": False})
+
+    @app.route("/engine/pipeline-stats")
+    def engine_pipeline_stats():
+        with _engines_lock:
+            p = _pipelines.get(data_dir)
+        return jsonify(p.stats() if p is not None else {"running": False})
+
     @app.route("/engine/generate-key", methods=["POST"])
     def engine_generate_key():
         e = eng()
@@ -343,7 +691,6 @@ def _register_engine_routes(app, transport, data_dir, notify_local):
                     })
             _save_engine_data(data_dir, edata)
 
-            notify_local({"type": "issuer_registered", "pk": pk_issuer[:16]})
 
             if address:
                 try:
@@ -428,7 +775,6 @@ def _register_engine_routes(app, transport, data_dir, notify_local):
 
         req["status"] = "approved"
         _save_engine_data(data_dir, edata)
-        notify_local({"type": "issuer_registered", "pk": pk_issuer[:16]})
 
         try:
             transport.send(req["from_hash"], req["from_role"], "issuer_confirmed", {
@@ -485,9 +831,42 @@ def _register_engine_routes(app, transport, data_dir, notify_local):
 
 
 def _engine_handle_message(app, transport, data_dir, notify_local,
-                            msg_type, payload, from_hash, from_role):
-    """Process incoming RNS messages for engine."""
-    if msg_type == "register_issuer":
+                            msg_type, payload, from_hash, from_role, on_done=None):
+    """Process incoming RNS messages for engine. Returns True when the message
+    was handed to the pipeline, which then calls on_done() when it is finished."""
+    if msg_type in PIPELINE_MESSAGE_TYPES:
+        # Called on an ingress worker: waiting for room keeps the backlog in the
+        # ingress queue, where transactions go before registrations
+        if _get_pipeline(data_dir, transport, notify_local).submit(
+                msg_type, payload, from_hash, from_role, on_done=on_done,
+                wait_s=PIPELINE_SUBMIT_WAIT_S):
+            return True
+        print(f"[ENGINE] {msg_type} van {from_hash[:16]} GEWEIGERD - pipeline vol", flush=True)
+        _queue_busy(transport, {"type": msg_type, "payload": payload,
+                                "from_hash": from_hash, "from_role": from_role}, "full", 1.0)
+        return False
+
+    if msg_type == "replica_pull":
+        try:
+            reply = serve_pull(_get_engine(data_dir), payload)
+        except Exception as exc:
+            print(f"[ENGINE] replica_pull van {from_hash[:16]} MISLUKT: {exc}", flush=True)
+            # Tell the replica, so it does not wait for records that never come
+            reply = {"kind": "error", "error": str(exc)}
+        try:
+            transport.send(from_hash, from_role, "replica_batch", reply)
+        except Exception as exc:
+            print(f"[ENGINE] replica_batch MISLUKT: {exc}", flush=True)
+
+    elif msg_type == "coin_status":
+        _send_coin_status(transport, from_hash, from_role, payload,
+                          _get_engine(data_dir).get_coin_state)
+
+    elif msg_type == "coin_status_batch":
+        _send_coin_status_batch(transport, from_hash, from_role, payload,
+                                _get_engine(data_dir).coin_owners)
+
+    elif msg_type == "register_issuer":
         pk_issuer = payload.get("pk_issuer", "")
         if not pk_issuer:
             return
@@ -525,98 +904,146 @@ def _engine_handle_message(app, transport, data_dir, notify_local,
                 "pk": pk_issuer,
             })
         _save_engine_data(data_dir, edata)
-        notify_local({"type": "issuer_registered", "pk": pk_issuer[:16]})
 
     elif msg_type == "bank_register_declined":
         notify_local({"type": "request_declined", "reason": payload.get("reason", "")})
 
-    elif msg_type == "register_coin":
-        print(f"[ENGINE] register_coin ONTVANGEN van {from_hash[:16]}", flush=True)
-        coin_data = payload.get("coin")
+    elif msg_type == "coin_reissue":
+        inputs = payload.get("inputs", [])
+        outputs = payload.get("outputs", [])
         recipient_dest = payload.get("recipient_dest", "")
-        description = payload.get("description")
-        pk_next = payload.get("pk_next", "")
-        transfer_signature = payload.get("transfer_signature", "")
-        print(f"[ENGINE] data check: coin={bool(coin_data)}, recipient={recipient_dest[:16] if recipient_dest else 'LEEG'}, pk_next={bool(pk_next)}, sig={bool(transfer_signature)}", flush=True)
-        if not coin_data or not pk_next or not transfer_signature:
-            print("[ENGINE] AFGEBROKEN - ontbrekende data!", flush=True)
+        coin_ids = [i.get("coin_id", "") for i in inputs]
+        if not inputs or not outputs or not recipient_dest:
             return
 
         e = _get_engine(data_dir)
-        coin = Coin.from_dict(coin_data)
-        print(f"[ENGINE] coin parsed: {coin.coin_id[:16]}... issuer={coin.pk_issuer[:16]}...", flush=True)
-        print(f"[ENGINE] trusted issuers: {e.list_issuers()}", flush=True)
         try:
-            e.register_coin(coin, recipient_dest, pk_next, transfer_signature)
-            print(f"[ENGINE] register_coin GELUKT!", flush=True)
+            confirmations = e.process_reissue({
+                "inputs": inputs, "outputs": outputs, "recipient_address": recipient_dest,
+            })
+            reply = {"coin_ids": coin_ids, "status": "confirmed",
+                     "new_coin_ids": [c["coin_id"] for c in confirmations]}
+            print(f"[ENGINE] coin_reissue: {len(inputs)} coins omgewisseld in {len(outputs)}", flush=True)
         except Exception as exc:
-            print(f"[ENGINE] register_coin MISLUKT: {exc}", flush=True)
-            import traceback
-            print(traceback.format_exc(), flush=True)
+            print(f"[ENGINE] coin_reissue van {from_hash[:16]} MISLUKT: {exc}", flush=True)
+            reply = {"coin_ids": coin_ids, "status": "rejected", "error": str(exc)}
+        try:
+            transport.send(from_hash, from_role, "reissue_confirmed", reply)
+        except Exception as exc:
+            print(f"[ENGINE] reissue_confirmed MISLUKT: {exc}", flush=True)
+        if reply["status"] != "confirmed":
             return
+        coins_for: dict[str, list[str]] = {}
+        for o, coin_id in zip(outputs, reply["new_coin_ids"]):
+            notify_local({"type": "coin_registered", "coin_id": coin_id})
+            coins_for.setdefault(o.get("recipient_address") or recipient_dest, []).append(coin_id)
+        coalescer = _get_coalescer(data_dir, transport)
+        for dest, coin_ids in coins_for.items():
+            coalescer.schedule(dest, coin_ids, None, from_hash)
+
+
+def _send_coin_status(transport, from_hash, from_role, payload, lookup):
+    coin_id = payload.get("coin_id", "")
+    state = lookup(coin_id) if coin_id else None
+    try:
+        transport.send(from_hash, from_role, "coin_status_result", {
+            "coin_id": coin_id,
+            "found": state is not None,
+            "pk_current": state["pk_current"] if state else None,
+        })
+    except Exception as exc:
+        print(f"[ENGINE] coin_status_result MISLUKT: {exc}", flush=True)
+
+
+def _send_coin_status_batch(transport, from_hash, from_role, payload, owners):
+    try:
+        keys = decode_request(payload.get("coins", ""))
+        status = encode_status(keys, owners(keys))
+    except Exception as exc:
+        print(f"[ENGINE] coin_status_batch van {from_hash[:16]} MISLUKT: {exc}", flush=True)
+        return
+    try:
+        transport.send(from_hash, from_role, "coin_status_batch_result", {
+            "request_id": payload.get("request_id", ""),
+            "status": status,
+        })
+    except Exception as exc:
+        print(f"[ENGINE] coin_status_batch_result MISLUKT: {exc}", flush=True)
+
+
+# ════════════════════════════════════════════════════════════
+#  ENGINE REPLICA
+# ════════════════════════════════════════════════════════════
 
-        notify_local({"type": "coin_registered", "coin_id": coin.coin_id})
+# Read-only follower of a primary engine (run.py --replica-of). One per process.
+_replicas: dict[str, ShardedReplica] = {}
+_replica_wakeups: dict[str, threading.Event] = {}
 
-        deliveries = e.get_pending_deliveries(recipient_dest)
-        print(f"[ENGINE] {len(deliveries)} pending deliveries voor {recipient_dest[:16]}", flush=True)
 
-        def _deliver_coins(deliveries, recipient_dest, description, from_hash):
-            for d in deliveries:
-                if description:
-                    d["description"] = description
-                d["sender_dest"] = from_hash
+def _get_replica(data_dir):
+    with _engines_lock:
+        r = _replicas.get(data_dir)
+        if r is None:
+            r = ShardedReplica(data_dir, n_shards=ENGINE_SHARDS)
+            _replicas[data_dir] = r
+            _replica_wakeups[data_dir] = threading.Event()
+        return r
+
+
+def _register_replica_routes(app, transport, data_dir, notify_local):
+    replica = _get_replica(data_dir)
+    wakeup = _replica_wakeups[data_dir]
+
+    def _follow_loop():
+        while True:
+            for pull in replica.pull_requests():
                 try:
-                    print(f"[ENGINE] coin_delivery sturen naar {recipient_dest[:16]}...", flush=True)
-                    transport.send(recipient_dest, "wallet", "coin_delivery", d)
-                    print(f"[ENGINE] coin_delivery VERSTUURD!", flush=True)
+                    transport.send(REPLICA_OF, "engine", "replica_pull", pull)
                 except Exception as exc:
-                    print(f"[ENGINE] coin_delivery MISLUKT: {exc}", flush=True)
-
-        import threading
-        threading.Thread(
-            target=_deliver_coins,
-            args=(deliveries, recipient_dest, description, from_hash),
-            daemon=True,
-        ).start()
-
-    elif msg_type == "transaction":
-        coin_id = payload.get("coin_id", "")
-        pk_next = payload.get("pk_next", "")
-        recipient_dest = payload.get("recipient_dest", "")
-        signature = payload.get("signature", "")
-        description = payload.get("description")
-        if not coin_id:
-            return
+                    print(f"[REPLICA] replica_pull MISLUKT: {exc}", flush=True)
+            wakeup.wait(REPLICA_POLL_S)
+            wakeup.clear()
 
-        e = _get_engine(data_dir)
+    threading.Thread(target=_follow_loop, daemon=True).start()
+
+    @app.route("/")
+    def replica_page():
+        return jsonify({"primary": REPLICA_OF, **replica.status()})
+
+    @app.route("/replica/status")
+    def replica_status():
+        return jsonify({"primary": REPLICA_OF, **replica.status()})
+
+    @app.route("/replica/coin/<coin_id>")
+    def replica_coin(coin_id):
+        state = replica.coin_state(coin_id)
+        if state is None:
+            return jsonify({"coin_id": coin_id, "found": False}), 404
+        return jsonify({"found": True, **state})
+
+
+def _replica_handle_message(transport, data_dir, msg_type, payload, from_hash, from_role):
+    """Process incoming RNS messages for an engine replica."""
+    replica = _get_replica(data_dir)
+    if msg_type == "replica_batch":
+        if from_hash != REPLICA_OF:
+            return
         try:
-            confirmation = e.process_transaction({
-                "coin_id": coin_id,
-                "pk_next": pk_next,
-                "recipient_address": recipient_dest,
-                "signature": signature,
-            })
-        except Exception:
+            more = replica.apply(payload)
+        except Exception as exc:
+            print(f"[REPLICA] replica_batch MISLUKT: {exc}", flush=True)
             return
+        if more:
+            _replica_wakeups[data_dir].set()
 
-        notify_local({"type": "transaction", "coin_id": coin_id})
+    elif msg_type == "coin_status":
+        _send_coin_status(transport, from_hash, from_role, payload, replica.coin_state)
 
-        try:
-            transport.send(from_hash, from_role, "tx_confirmed", {
-                "coin_id": coin_id, "status": "confirmed",
-            })
-        except Exception:
-            pass
+    elif msg_type == "coin_status_batch":
+        _send_coin_status_batch(transport, from_hash, from_role, payload, replica.coin_owners)
 
-        deliveries = e.get_pending_deliveries(recipient_dest)
-        for d in deliveries:
-            if description:
-                d["description"] = description
-            d["sender_dest"] = from_hash
-            try:
-                transport.send(recipient_dest, "wallet", "coin_transfer", d)
-            except Exception:
-                pass
+    else:
+        print(f"[REPLICA] {msg_type} genegeerd - replica is alleen-lezen", flush=True)
 
 
 # ════════════════════════════════════════════════════════════
@@ -870,6 +1297,7 @@ def _register_bank_routes(app, transport, data_dir, notify_local):
             if approve_amount > len(public_keys):
                 flash(f"Wallet stuurde {len(public_keys)} PK(s), {actual_amount} coin(s) uitgegeven", "info")
 
+            batch_coins = []
             for pk_owner in selected_pks:
                 coin, transfer_info = i.issue_coin(1, pk_owner, engine_dest, engine_pk)
                 bdata["issued_coins"].append({
@@ -879,18 +1307,22 @@ def _register_bank_routes(app, transport, data_dir, notify_local):
                     "recipient": wallet_dest,
                     "coin_json": coin.to_dict(),
                 })
-                reg_payload = {
+                batch_coins.append({
                     "coin": coin.to_dict(),
-                    "recipient_dest": wallet_dest,
                     "pk_next": transfer_info["pk_next"],
                     "transfer_signature": transfer_info["transfer_signature"],
-                }
-                if coin_description:
-                    reg_payload["description"] = coin_description
-                try:
-                    transport.send(engine_dest, "engine", "register_coin", reg_payload)
-                except Exception as exc:
-                    flash(f"Fout bij registreren coin: {exc}", "error")
+                })
+
+            reg_payload = {
+                "coins": batch_coins,
+                "recipient_dest": wallet_dest,
+            }
+            if coin_description:
+                reg_payload["description"] = coin_description
+            try:
+                transport.send(engine_dest, "engine", "register_coin_batch", reg_payload)
+            except Exception as exc:
+                flash(f"Fout bij registreren coins: {exc}", "error")
 
             req["status"] = "approved"
             _save_bank_data(data_dir, bdata)
@@ -992,6 +1424,49 @@ def _get_wallet(data_dir):
     return Wallet(os.path.join(data_dir, "wallet.json"))
 
 
+# Outstanding coin_status_batch queries by request_id, and the latest
+# result per coin for each wallet data_dir
+_status_queries: dict[str, dict] = {}
+_coin_status: dict[str, dict[str, str]] = {}
+_status_lock = threading.Lock()
+STATUS_QUERY_TIMEOUT_S = 300
+
+
+def _engine_dest_for(transport, coin_data):
+    engine_dest = coin_data.get("state_engine_endpoint", "")
+    if engine_dest.startswith("http"):
+        for dh, info in transport.get_announces().items():
+            if info.get("role", "").startswith("engine"):
+                return dh
+    return engine_dest
+
+
+def _wallet_apply_coin_status(data_dir, payload, notify_local):
+    with _status_lock:
+        query = _status_queries.pop(payload.get("request_id", ""), None)
+    if query is None:
+        return
+    try:
+        prints = decode_status(payload.get("status", ""), query["coin_ids"])
+    except Exception as exc:
+        print(f"[WALLET] coin_status_batch_result MISLUKT: {exc}", flush=True)
+        return
+    result = {}
+    for coin_id, found in prints.items():
+        if found is None:
+            result[coin_id] = "unknown"
+        elif found == fingerprint(bytes.fromhex(query["expected"][coin_id])):
+            result[coin_id] = "ok"
+        else:
+            result[coin_id] = "moved"
+    with _status_lock:
+        _coin_status.setdefault(data_dir, {}).update(result)
+    counts = {state: sum(1 for v in result.values() if v == state) for state in ("ok", "moved", "unknown")}
+    if counts["moved"] or counts["unknown"]:
+        print(f"[WALLET] coin status: {counts['moved']} verplaatst, {counts['unknown']} onbekend", flush=True)
+    notify_local({"type": "coin_status", **counts})
+
+
 def _register_wallet_routes(app, transport, data_dir, wallet_id, notify_local):
 
     @app.route("/")
@@ -1073,6 +1548,7 @@ def _register_wallet_routes(app, transport, data_dir, wallet_id, notify_local):
 
             tx_payload = {
                 "coin_id": coin_id,
+                "pk_current": tx["pk_current"],
                 "pk_next": pk_next,
                 "recipient_dest": recipient_dest,
                 "signature": tx["signature"],
@@ -1081,9 +1557,15 @@ def _register_wallet_routes(app, transport, data_dir, wallet_id, notify_local):
                 tx_payload["description"] = description
 
             if engine_dest:
-                transport.send(engine_dest, "engine", "transaction", tx_payload)
-
-            w.confirm_send(coin_id, recipient_dest, description=description)
+                # The coin stays parked until tx_confirmed; a rejection or busy reply restores it
+                w.hold_for_send([coin_id], recipient_dest, description)
+                try:
+                    transport.send(engine_dest, "engine", "transaction", tx_payload)
+                except Exception:
+                    w.cancel_send([coin_id])
+                    raise
+            else:
+                w.confirm_send(coin_id, recipient_dest, description=description)
 
             for req in w._data.get("incoming_requests", []):
                 if req.get("status") == "pending" and req.get("from_hash") == recipient_dest:
@@ -1134,7 +1616,9 @@ def _register_wallet_routes(app, transport, data_dir, wallet_id, notify_local):
         selected_coins = available_coins[:actual_amount]
         selected_pks = public_keys[:actual_amount]
 
-        sent = 0
+        # Group signed transactions per engine so each engine gets a
+        # single transaction_batch message instead of one per coin.
+        batches: dict[str, list[dict]] = {}
         for (coin_id, coin_entry), pk_next in zip(selected_coins, selected_pks):
             coin_data = coin_entry["coin"]
             engine_dest = coin_data.get("state_engine_endpoint", "")
@@ -1146,20 +1630,36 @@ def _register_wallet_routes(app, transport, data_dir, wallet_id, notify_local):
 
             try:
                 tx = w.create_transaction(coin_id, pk_next, recipient_dest)
-                tx_payload = {
-                    "coin_id": coin_id,
-                    "pk_next": pk_next,
-                    "recipient_dest": recipient_dest,
-                    "signature": tx["signature"],
-                }
-                if description:
-                    tx_payload["description"] = description
-                if engine_dest:
-                    transport.send(engine_dest, "engine", "transaction", tx_payload)
-                w.confirm_send(coin_id, recipient_dest, description=description)
-                sent += 1
             except Exception as exc:
                 flash(f"Fout bij coin {coin_id[:8]}: {exc}", "error")
+                continue
+            batches.setdefault(engine_dest, []).append({
+                "coin_id": coin_id,
+                "pk_current": tx["pk_current"],
+                "pk_next": pk_next,
+                "recipient_dest": recipient_dest,
+                "signature": tx["signature"],
+            })
+
+        sent = 0
+        for engine_dest, transactions in batches.items():
+            batch_payload = {"transactions": transactions}
+            if description:
+                batch_payload["description"] = description
+            coin_ids = [t["coin_id"] for t in transactions]
+            if not engine_dest:
+                for coin_id in coin_ids:
+                    w.confirm_send(coin_id, recipient_dest, description=description)
+                sent += len(coin_ids)
+                continue
+            w.hold_for_send(coin_ids, recipient_dest, description)
+            try:
+                transport.send(engine_dest, "engine", "transaction_batch", batch_payload)
+            except Exception as exc:
+                w.cancel_send(coin_ids)
+                flash(f"Fout bij versturen naar engine {engine_dest[:8]}: {exc}", "error")
+                continue
+            sent += len(coin_ids)
 
         req["status"] = "paid"
         w._save()
@@ -1169,6 +1669,97 @@ def _register_wallet_routes(app, transport, data_dir, wallet_id, notify_local):
         session["wallet_msg"] = f"{sent} coin(s) verstuurd"
         return redirect(url_for("wallet_page"))
 
+    def _send_reissue(w, coin_ids, make_request):
+        engines = {_engine_dest_for(transport, w._data["coins"][c]["coin"])
+                   for c in coin_ids if c in w._data["coins"]}
+        if len(engines) != 1 or not next(iter(engines)):
+            raise ValueError("Coins moeten bij een en dezelfde engine horen")
+        reissue = make_request(transport.dest_hash_hex)
+        # Inputs stay parked until reissue_confirmed; a rejection or busy reply restores them
+        w.hold_for_reissue(coin_ids, reissue["outputs"])
+        try:
+            transport.send(next(iter(engines)), "engine", "coin_reissue", {
+                "inputs": reissue["inputs"],
+                "outputs": reissue["outputs"],
+                "recipient_dest": reissue["recipient_address"],
+            })
+        except Exception:
+            w.cancel_reissue(coin_ids)
+            raise
+
+    @app.route("/wallet/<wallet_id>/split", methods=["POST"])
+    def wallet_split(wallet_id):
+        """Exchange one coin for coins of the given denominations ("5,3,2")."""
+        w = _get_wallet(data_dir)
+        try:
+            coin_id = request.form["coin_id"]
+            denominations = [int(d) for d in request.form["denominations"].replace(" ", "").split(",") if d]
+            _send_reissue(w, [coin_id], lambda dest: w.create_split(coin_id, denominations, dest))
+            session["wallet_msg"] = f"Coin gesplitst in {len(denominations)} coins"
+        except Exception as exc:
+            flash(f"Fout: {exc}", "error")
+        return redirect(url_for("wallet_page"))
+
+    @app.route("/wallet/<wallet_id>/merge", methods=["POST"])
+    def wallet_merge(wallet_id):
+        """Exchange the selected coins for one coin of their total value."""
+        w = _get_wallet(data_dir)
+        try:
+            coin_ids = request.form.getlist("coin_ids")
+            if len(coin_ids) < 2:
+                raise ValueError("Kies minstens twee coins om samen te voegen")
+            _send_reissue(w, coin_ids, lambda dest: w.create_merge(coin_ids, dest))
+            session["wallet_msg"] = f"{len(coin_ids)} coins samengevoegd"
+        except Exception as exc:
+            flash(f"Fout: {exc}", "error")
+        return redirect(url_for("wallet_page"))
+
+    @app.route("/wallet/<wallet_id>/check-coins", methods=["POST"])
+    def wallet_check_coins(wallet_id):
+        """Ask the engines for the current owner of the wallet's coins, one
+        coin_status_batch per engine and per STATUS_BATCH_MAX coins."""
+        w = _get_wallet(data_dir)
+        wanted = (request.get_json(silent=True) or {}).get("coin_ids")
+        per_engine: dict[str, dict[str, str]] = {}
+        for coin_id, entry in w._data.get("coins", {}).items():
+            if wanted is not None and coin_id not in wanted:
+                continue
+            engine_dest = _engine_dest_for(transport, entry["coin"])
+            if engine_dest:
+                per_engine.setdefault(engine_dest, {})[coin_id] = entry["coin"]["pk_current"]
+
+        request_ids = []
+        for engine_dest, expected in per_engine.items():
+            coin_ids = list(expected)
+            for i in range(0, len(coin_ids), STATUS_BATCH_MAX):
+                chunk = coin_ids[i:i + STATUS_BATCH_MAX]
+                request_id = uuid.uuid4().hex
+                with _status_lock:
+                    now = time.time()
+                    for rid in [r for r, q in _status_queries.items()
+                                if now - q["ts"] > STATUS_QUERY_TIMEOUT_S]:
+                        del _status_queries[rid]
+                    _status_queries[request_id] = {
+                        "coin_ids": chunk,
+                        "expected": {c: expected[c] for c in chunk},
+                        "ts": now,
+                    }
+                try:
+                    transport.send(engine_dest, "engine", "coin_status_batch", {
+                        "request_id": request_id, "coins": encode_request(chunk),
+                    })
+                except Exception as exc:
+                    with _status_lock:
+                        _status_queries.pop(request_id, None)
+                    return jsonify({"ok": False, "error": str(exc)}), 502
+                request_ids.append(request_id)
+        return jsonify({"ok": True, "request_ids": request_ids})
+
+    @app.route("/wallet/<wallet_id>/coin-status")
+    def wallet_coin_status(wallet_id):
+        with _status_lock:
+            return jsonify(dict(_coin_status.get(data_dir, {})))
+
     @app.route("/wallet/<wallet_id>/add-contact", methods=["POST"])
     def wallet_add_contact(wallet_id):
         w = _get_wallet(data_dir)
@@ -1370,63 +1961,168 @@ def _register_wallet_routes(app, transport, data_dir, wallet_id, notify_local):
         return redirect(url_for("wallet_page"))
 
 
+def _wallet_receive_delivery(w, payload, notify_local):
+    """Apply one engine delivery (coin + confirmation) to the wallet."""
+    w.receive_from_engine(payload, lambda d: _match_outgoing_request(w, d["coin"]["pk_current"]))
+    _notify_coin_received(payload, notify_local)
+
+
+def _wallet_receive_deliveries(w, deliveries, notify_local):
+    """Apply a multi-coin delivery with a single wallet write."""
+    errors = w.receive_batch_from_engine(
+        deliveries, lambda d: _match_outgoing_request(w, d["coin"]["pk_current"]))
+    received = [d for d, error in zip(deliveries, errors) if error is None]
+    for d, error in zip(deliveries, errors):
+        if error is not None:
+            print(f"[WALLET] delivery {d.get('coin', {}).get('coin_id', '?')[:16]} GEWEIGERD: {error}",
+                  flush=True)
+    for d in received:
+        _notify_coin_received(d, notify_local)
+
+
+def _match_outgoing_request(w, pk_current):
+    """Count a received coin against the outgoing request that asked for
+    its key. Runs before the wallet write of the delivery, which saves it.
+    Returns True when a request changed."""
+    if not pk_current:
+        return False
+    for req in w._data.get("outgoing_coin_requests", []):
+        if req.get("status") not in ("pending", "partial"):
+            continue
+        pks = req.get("public_keys", [])
+        if pk_current in pks:
+            pks.remove(pk_current)
+            req["received"] = req.get("received", 0) + 1
+            req["status"] = "approved" if not pks else "partial"
+            return True
+
+    for req in w._data.get("outgoing_payment_requests", []):
+        if req.get("status") not in ("pending", "partial"):
+            continue
+        req_pks = req.get("public_keys", [])
+        if pk_current in req_pks:
+            req_pks.remove(pk_current)
+            req["received"] = req.get("received", 0) + 1
+            req["status"] = "paid" if not req_pks else "partial"
+            return True
+        if req.get("pk") == pk_current and not req_pks:
+            req["received"] = req.get("received", 0) + 1
+            req["status"] = "paid"
+            return True
+    return False
+
+
+def _from_coin_engine(transport, w, coin_ids, from_hash):
+    """The parked coins among coin_ids whose engine is from_hash. Answers
+    about coins from anyone else are ignored."""
+    held = w.held_coins(coin_ids)
+    ours = [c for c, coin in held.items() if _engine_dest_for(transport, coin) == from_hash]
+    if len(ours) < len(held):
+        print(f"[WALLET] antwoord van {from_hash[:16]} over {len(held) - len(ours)} coins "
+              f"van een andere engine GENEGEERD", flush=True)
+    return ours
+
+
+def _wallet_settle_sends(w, results):
+    """Log the confirmed transfers and put the coins of rejected ones back."""
+    confirmed = [r.get("coin_id", "") for r in results if r.get("status") == "confirmed"]
+    rejected = [r.get("coin_id", "") for r in results if r.get("status") != "confirmed"]
+    if confirmed:
+        w.confirm_sent(confirmed)
+    restored = w.cancel_send(rejected) if rejected else 0
+    if restored:
+        print(f"[WALLET] {restored} betaling(en) GEWEIGERD, coins teruggezet", flush=True)
+
+
+def _notify_coin_received(delivery, notify_local):
+    coin_data = delivery.get("coin", {})
+    notify_local({
+        "type": "coin_received",
+        "coin_id": coin_data.get("coin_id", ""),
+        "waarde": coin_data.get("waarde", "?"),
+        "status": delivery.get("confirmation", {}).get("status", ""),
+    })
+
+
 def _wallet_handle_message(app, transport, data_dir, wallet_id, notify_local,
                             msg_type, payload, from_hash, from_role):
     """Process incoming RNS messages for wallet."""
     if msg_type in ("coin_delivery", "coin_transfer"):
         w = _get_wallet(data_dir)
         try:
-            w.receive_from_engine(payload)
-            coin_data = payload.get("coin", {})
-            pk_current = coin_data.get("pk_current", "")
-
-            if pk_current:
-                matched = False
-                for req in w._data.get("outgoing_coin_requests", []):
-                    if req.get("status") not in ("pending", "partial"):
-                        continue
-                    pks = req.get("public_keys", [])
-                    if pk_current in pks:
-                        pks.remove(pk_current)
-                        req["received"] = req.get("received", 0) + 1
-                        req["status"] = "approved" if not pks else "partial"
-                        w._save()
-                        matched = True
-                        break
-
-                if not matched:
-                    for req in w._data.get("outgoing_payment_requests", []):
-                        if req.get("status") not in ("pending", "partial"):
-                            continue
-                        req_pks = req.get("public_keys", [])
-                        if pk_current in req_pks:
-                            req_pks.remove(pk_current)
-                            req["received"] = req.get("received", 0) + 1
-                            req["status"] = "paid" if not req_pks else "partial"
-                            w._save()
-                            break
-                        if req.get("pk") == pk_current and not req_pks:
-                            req["received"] = req.get("received", 0) + 1
-                            req["status"] = "paid"
-                            w._save()
-                            break
-
-            notify_local({
-                "type": "coin_received",
-                "coin_id": coin_data.get("coin_id", ""),
-                "waarde": coin_data.get("waarde", "?"),
-                "status": payload.get("confirmation", {}).get("status", ""),
-            })
+            _wallet_receive_delivery(w, payload, notify_local)
         except Exception:
             pass
 
+    elif msg_type in ("coin_delivery_batch", PACK_TYPE):
+        try:
+            deliveries = (unpack_deliveries(payload) if msg_type == PACK_TYPE
+                          else payload.get("deliveries", []))
+            _wallet_receive_deliveries(_get_wallet(data_dir), deliveries, notify_local)
+        except Exception as exc:
+            print(f"[WALLET] {msg_type} MISLUKT: {exc}", flush=True)
+
     elif msg_type == "tx_confirmed":
+        w = _get_wallet(data_dir)
+        if not _from_coin_engine(transport, w, [payload.get("coin_id", "")], from_hash):
+            return
+        _wallet_settle_sends(w, [payload])
         notify_local({
             "type": "tx_confirmed",
             "coin_id": payload.get("coin_id", ""),
             "status": payload.get("status", ""),
         })
 
+    elif msg_type == "tx_batch_confirmed":
+        w = _get_wallet(data_dir)
+        results = payload.get("results", [])
+        ours = set(_from_coin_engine(transport, w, [r.get("coin_id", "") for r in results], from_hash))
+        _wallet_settle_sends(w, [r for r in results if r.get("coin_id", "") in ours])
+        for r in payload.get("results", []):
+            notify_local({
+                "type": "tx_confirmed",
+                "coin_id": r.get("coin_id", ""),
+                "status": r.get("status", ""),
+            })
+
+    elif msg_type == "reissue_confirmed":
+        w = _get_wallet(data_dir)
+        coin_ids = _from_coin_engine(transport, w, payload.get("coin_ids", []), from_hash)
+        if not coin_ids:
+            return
+        if payload.get("status") == "confirmed":
+            w.confirm_reissue(coin_ids)
+        else:
+            restored = w.cancel_reissue(coin_ids)
+            print(f"[WALLET] omwisselen van {len(payload.get('coin_ids', []))} coins GEWEIGERD: "
+                  f"{payload.get('error', '?')} ({restored} coins teruggezet)", flush=True)
+        notify_local({
+            "type": "reissue_confirmed",
+            "coin_ids": payload.get("coin_ids", []),
+            "new_coin_ids": payload.get("new_coin_ids", []),
+            "status": payload.get("status", ""),
+            "error": payload.get("error", ""),
+        })
+
+    elif msg_type == "coin_status_batch_result":
+        _wallet_apply_coin_status(data_dir, payload, notify_local)
+
+    elif msg_type == "busy":
+        w = _get_wallet(data_dir)
+        coin_ids = _from_coin_engine(transport, w, payload.get("coin_ids", []), from_hash)
+        if payload.get("refused_type") == "coin_reissue":
+            w.cancel_reissue(coin_ids)
+        elif payload.get("refused_type") in ("transaction", "transaction_batch"):
+            w.cancel_send(coin_ids)
+        print(f"[WALLET] engine {from_hash[:16]} is druk ({payload.get('reason', '?')}), "
+              f"{payload.get('refused_type', '?')} niet verwerkt", flush=True)
+        notify_local({
+            "type": "engine_busy",
+            "refused_type": payload.get("refused_type", ""),
+            "coin_ids": payload.get("coin_ids", []),
+            "retry_after_s": payload.get("retry_after_s"),
+        })
+
     elif msg_type == "payment_request":
         w = _get_wallet(data_dir)
         w._data.setdefault("incoming_requests", []).append({
@@ -0,0 +1,96 @@
+"""
+Read/write contention benchmark for the StateEngine connection layer.
+
+Compares the old layout (every read and write through one shared connection,
+max_readers=0) against the pooled WAL layout. Reader threads hammer
+get_coin_state/list_issuers while one writer keeps rotating coin ownership.
+
+Usage:
+    python -m benchmarks.bench_contention [--coins 200] [--readers 8] [--seconds 3]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from src.crypto_utils import generate_keypair, pk_to_hex, sign, build_payload
+from src.engine import StateEngine
+from src.issuer import Issuer
+
+
+def _setup(db_path, n_coins, max_readers):
+    # No ownership cache, so every read reaches the connection layer
+    engine = StateEngine(db_path=db_path, max_readers=max_readers, cache_max_bytes=0)
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    owners = {}
+    for _ in range(n_coins):
+        sk, pk = generate_keypair()
+        coin, info = issuer.issue_coin(1, pk_to_hex(pk), "bench", engine.pk_hex)
+        engine.register_coin(coin, "bench", info["pk_next"], info["transfer_signature"])
+        owners[coin.coin_id] = sk
+    engine.get_pending_deliveries("bench")
+    return engine, owners
+
+
+def run(max_readers, n_coins, n_readers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, owners = _setup(os.path.join(tmp, "engine.db"), n_coins, max_readers)
+        coin_ids = list(owners)
+        stop = threading.Event()
+        counts = {"reads": 0, "writes": 0}
+        lock = threading.Lock()
+
+        def reader():
+            n = 0
+            while not stop.is_set():
+                engine.get_coin_state(random.choice(coin_ids))
+                if n % 10 == 0:
+                    engine.list_issuers()
+                n += 1
+            with lock:
+                counts["reads"] += n
+
+        def writer():
+            n = 0
+            while not stop.is_set():
+                coin_id = random.choice(coin_ids)
+                sk_next, pk_next = generate_keypair()
+                pk_next_hex = pk_to_hex(pk_next)
+                sig = sign(owners[coin_id], build_payload(coin_id, pk_next_hex))
+                engine.process_transaction({
+                    "coin_id": coin_id, "pk_current": pk_to_hex(owners[coin_id].verify_key),
+                    "pk_next": pk_next_hex,
+                    "recipient_address": "bench", "signature": sig.hex(),
+                })
+                owners[coin_id] = sk_next
+                n += 1
+            with lock:
+                counts["writes"] += n
+
+        threads = [threading.Thread(target=reader) for _ in range(n_readers)]
+        threads.append(threading.Thread(target=writer))
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        engine.close()
+    return counts["reads"] / seconds, counts["writes"] / seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--coins", type=int, default=200)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    # One connection more than there are reader threads, for the writer's own reads
+    for label, max_readers in (("single connection", 0), ("pooled + WAL", args.readers + 1)):
+        reads, writes = run(max_readers, args.coins, args.readers, args.seconds)
+        print(f"{label:18s}  reads/s {reads:10.0f}   writes/s {writes:8.0f}")
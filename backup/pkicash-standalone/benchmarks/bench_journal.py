@@ -0,0 +1,68 @@
+"""
+Journal append and recovery rates.
+
+Writes a journal of synthetic issuance and transfer records (no signing,
+so only journal I/O and encoding are measured), optionally snapshots halfway,
+and times recover() over the result.
+
+Usage:
+    python -m benchmarks.bench_journal [--coins 10000] [--transfers 200000] [--snapshot]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from src.journal import ISSUE, TRANSFER, Journal, recover
+
+
+def run(n_coins, n_transfers, snapshot, batch=64):
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = Journal(tmp)
+        owners = {os.urandom(16): os.urandom(32) for _ in range(n_coins)}
+        meta = (1, os.urandom(32), os.urandom(64), os.urandom(32), "bench")
+
+        t0 = time.perf_counter()
+        coin_ids = list(owners)
+        for i in range(0, n_coins, batch):
+            journal.append([(ISSUE, (k, owners[k], *meta)) for k in coin_ids[i:i + batch]])
+
+        pending = []
+        for i in range(n_transfers):
+            k = random.choice(coin_ids)
+            pk_next = os.urandom(32)
+            pending.append((TRANSFER, (k, owners[k], pk_next)))
+            owners[k] = pk_next
+            if len(pending) == batch:
+                journal.append(pending)
+                pending = []
+            if snapshot and i == n_transfers // 2:
+                journal.append(pending)
+                pending = []
+                journal.write_snapshot((k, pk, *meta) for k, pk in owners.items())
+        journal.append(pending)
+        write_s = time.perf_counter() - t0
+        records = journal.seq
+        size = sum(f.stat().st_size for f in os.scandir(tmp))
+        journal.close()
+
+        t0 = time.perf_counter()
+        seq, coins = recover(tmp)
+        replay_s = time.perf_counter() - t0
+        assert seq == records and {k: c[0] for k, c in coins.items()} == owners
+    return records, size, write_s, replay_s
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--coins", type=int, default=10000)
+    parser.add_argument("--transfers", type=int, default=200000)
+    parser.add_argument("--snapshot", action="store_true", help="snapshot halfway through")
+    args = parser.parse_args()
+
+    records, size, write_s, replay_s = run(args.coins, args.transfers, args.snapshot)
+    print(f"records {records}   journal {size / 1e6:.1f} MB")
+    print(f"append   {records / write_s:10.0f} records/s")
+    print(f"recover  {records / replay_s:10.0f} records/s ({replay_s * 1000:.0f} ms)")
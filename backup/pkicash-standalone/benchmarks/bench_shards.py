@@ -0,0 +1,97 @@
+"""
+Transaction throughput of the sharded engine versus shard count.
+
+Submitter threads keep rotating ownership of random coins through
+ShardedStateEngine.process_transaction on file-backed shards. With
+--processes every shard runs in its own process; without it the shards
+share this interpreter and cannot scale past one core. The "in shards"
+column is the share of all CPU time spent in the shard processes: work
+that runs on other cores when there are any.
+
+Usage:
+    python -m benchmarks.bench_shards [--shards 1 2 4] [--coins 400] [--threads 8] [--seconds 3] [--processes]
+"""
+
+import argparse
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+
+from src.crypto_utils import generate_keypair, pk_to_hex, sign, build_payload
+from src.issuer import Issuer
+from src.sharded_engine import ShardedStateEngine
+
+
+def _cpu_s(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(n_shards, n_coins, n_threads, seconds, processes=False):
+    children_before = _cpu_s(resource.RUSAGE_CHILDREN)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = ShardedStateEngine(tmp, n_shards=n_shards, processes=processes)
+        issuer = Issuer()
+        engine.register_issuer(issuer.pk_hex)
+        items, owners = [], {}
+        for _ in range(n_coins):
+            sk, pk = generate_keypair()
+            coin, info = issuer.issue_coin(1, pk_to_hex(pk), "bench", engine.pk_hex)
+            items.append({"coin": coin, **info})
+            owners[coin.coin_id] = sk
+        engine.register_coins(items, "bench")
+        engine.get_pending_deliveries("bench")
+
+        # Each thread owns a disjoint slice of coins, so there are no double spends
+        coin_ids = list(owners)
+        slices = [coin_ids[t::n_threads] for t in range(n_threads)]
+        stop = threading.Event()
+        done = [0] * n_threads
+
+        def submit(t):
+            while not stop.is_set():
+                coin_id = random.choice(slices[t])
+                sk_next, pk_next = generate_keypair()
+                pk_next_hex = pk_to_hex(pk_next)
+                sig = sign(owners[coin_id], build_payload(coin_id, pk_next_hex))
+                engine.process_transaction({
+                    "coin_id": coin_id, "pk_current": pk_to_hex(owners[coin_id].verify_key),
+                    "pk_next": pk_next_hex,
+                    "recipient_address": "bench", "signature": sig.hex(),
+                })
+                owners[coin_id] = sk_next
+                done[t] += 1
+
+        threads = [threading.Thread(target=submit, args=(t,)) for t in range(n_threads)]
+        self_before = _cpu_s(resource.RUSAGE_SELF)
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        self_cpu = _cpu_s(resource.RUSAGE_SELF) - self_before
+        engine.close()
+    # Shard processes are only counted once they have exited
+    shard_cpu = _cpu_s(resource.RUSAGE_CHILDREN) - children_before
+    return sum(done) / seconds, shard_cpu / (shard_cpu + self_cpu)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--coins", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--processes", action="store_true", help="one process per shard")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, shards in {'processes' if args.processes else 'threads'}")
+    base = None
+    for n in args.shards:
+        tps, in_shards = run(n, args.coins, args.threads, args.seconds, args.processes)
+        base = base or tps
+        print(f"shards={n:2d}  tx/s {tps:8.0f}   x{tps / base:.2f}   in shards {in_shards:4.0%}")
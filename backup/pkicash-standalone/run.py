@@ -3,6 +3,11 @@ PKI Cash Launcher — start actors with Reticulum transport.
 
 Usage:
     python run.py --role engine --port 5000
+    python run.py --role engine --port 5000 --shards 4   # coin-id sharded engine
+    python run.py --role engine --port 5000 --journal    # with transition journal
+    python run.py --role engine --port 5010 --replica-of <primary dest hash>
+    python run.py --role engine --port 5010 --replica-of <primary dest hash> --shards 4
+    python run.py --role engine --port 5000 --ingress-log    # durable incoming messages
     python run.py --role bank   --port 5001
     python run.py --role wallet --id a --port 5002
     python run.py --role wallet --id b --port 5003
@@ -18,13 +23,21 @@ import time
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
-def launch_single(role: str, port: int, wallet_id: str = None):
+def launch_single(role: str, port: int, wallet_id: str = None, shards: int = 1,
+                  verify_workers: int = 0, merkle_confirmations: bool = False,
+                  journal: bool = False, recover: bool = False, replica_of: str = None,
+                  rns_config: str = None, ingress_log: bool = False):
     """Start a single actor process (Flask + RNS)."""
     if role == "wallet" and not wallet_id:
         print("Error: --id is required for wallet role")
         sys.exit(1)
 
-    data_dir = os.path.join(BASE_DIR, "data", role if role != "wallet" else f"wallet_{wallet_id}")
+    if role == "wallet":
+        data_dir = os.path.join(BASE_DIR, "data", f"wallet_{wallet_id}")
+    elif role == "engine" and replica_of:
+        data_dir = os.path.join(BASE_DIR, "data", "engine_replica")
+    else:
+        data_dir = os.path.join(BASE_DIR, "data", role)
     os.makedirs(data_dir, exist_ok=True)
 
     os.environ["PKICASH_ROLE"] = role
@@ -32,11 +45,21 @@ def launch_single(role: str, port: int, wallet_id: str = None):
     os.environ["PKICASH_DATA_DIR"] = data_dir
     if wallet_id:
         os.environ["PKICASH_WALLET_ID"] = wallet_id
+    if role == "engine":
+        os.environ["PKICASH_ENGINE_SHARDS"] = str(shards)
+        os.environ["PKICASH_VERIFY_WORKERS"] = str(verify_workers)
+        os.environ["PKICASH_MERKLE_CONFIRMATIONS"] = "1" if merkle_confirmations else "0"
+        os.environ["PKICASH_JOURNAL"] = "1" if journal or recover else "0"
+        os.environ["PKICASH_JOURNAL_RECOVER"] = "1" if recover else "0"
+        os.environ["PKICASH_REPLICA_OF"] = replica_of or ""
 
     from src.transport import PKICashTransport
     transport = PKICashTransport(
         role=role,
         data_dir=data_dir,
+        config_path=rns_config,
+        ingress_log=ingress_log,
+        ingress_fsync=os.environ.get("PKICASH_INGRESS_FSYNC", "0") == "1",
     )
 
     from app_actor import create_app
@@ -91,12 +114,29 @@ if __name__ == "__main__":
     parser.add_argument("--role", choices=["engine", "bank", "wallet"])
     parser.add_argument("--port", type=int, default=5000)
     parser.add_argument("--id", dest="wallet_id", help="wallet identifier (a, b, ...)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="engine: number of SQLite shards (with --replica-of: those of the primary)")
+    parser.add_argument("--verify-workers", type=int, default=0,
+                        help="engine: signature verification processes (0 = inline)")
+    parser.add_argument("--merkle-confirmations", action="store_true",
+                        help="engine: sign one Merkle root per commit batch")
+    parser.add_argument("--journal", action="store_true",
+                        help="engine: append transitions to data/engine/journal")
+    parser.add_argument("--recover", action="store_true",
+                        help="engine: rebuild coin ownership from the journal at startup")
+    parser.add_argument("--replica-of", metavar="DEST_HASH",
+                        help="engine: run as read replica of this primary (needs --journal there)")
+    parser.add_argument("--rns-config", help="Reticulum config directory")
+    parser.add_argument("--ingress-log", action="store_true",
+                        help="log incoming messages to <data dir>/ingress before handling them")
     parser.add_argument("--demo", action="store_true", help="start all four actors")
     args = parser.parse_args()
 
     if args.demo:
         launch_demo()
     elif args.role:
-        launch_single(args.role, args.port, args.wallet_id)
+        launch_single(args.role, args.port, args.wallet_id, args.shards, args.verify_workers,
+                      args.merkle_confirmations, args.journal, args.recover,
+                      args.replica_of, args.rns_config, args.ingress_log)
     else:
         parser.print_help()
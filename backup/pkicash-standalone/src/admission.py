@@ -0,0 +1,201 @@
+"""
+Admission control for the engine's incoming messages.
+
+The transport hands every message to IngressQueue.offer() on its own thread.
+offer() only decides, it never runs a handler:
+
+- every sender has a token bucket; a sender that is out of tokens is refused
+  with reason "rate";
+- accepted messages wait in a bounded queue with three priority classes:
+  transactions, then coin registrations, then everything else;
+- when the queue is full, a message of a higher class pushes out the newest
+  waiting message of the lowest class below it; otherwise the new message is
+  refused with reason "full".
+
+Refused and pushed-out messages go to on_shed(message, reason), which the
+actor uses to send a "busy" reply (busy_reply()). Worker threads take messages from the
+queue, highest class first, and call the handler.
+"""
+
+import threading
+import time
+from collections import deque
+
+PRIORITIES = {
+    "transaction": 0,
+    "transaction_batch": 0,
+    "coin_reissue": 0,
+    "register_coin": 1,
+    "register_coin_batch": 1,
+}
+LOWEST = 2
+# Idle senders whose bucket is full again are forgotten past this many
+MAX_SENDERS = 4096
+
+
+def priority(msg_type: str) -> int:
+    return PRIORITIES.get(msg_type, LOWEST)
+
+
+def busy_reply(message: dict, reason: str, retry_after_s: float) -> dict:
+    """Payload of the "busy" reply to a refused message. It lists the coins
+    the message carried, so the sender can put them back."""
+    payload = message.get("payload", {})
+    coin_ids = [t.get("coin_id", "") for t in payload.get("transactions", []) + payload.get("inputs", [])]
+    if payload.get("coin_id"):
+        coin_ids.append(payload["coin_id"])
+    return {
+        "refused_type": message.get("type", ""),
+        "reason": reason,
+        "retry_after_s": retry_after_s,
+        "coin_ids": coin_ids,
+    }
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait_s(self) -> float:
+        """Seconds until the next token."""
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else float("inf")
+
+
+class IngressQueue:
+    def __init__(self, handler, on_shed=None, max_size: int = 1024,
+                 rate: float = 10.0, burst: float = 50.0, workers: int = 1):
+        """
+        handler(message): processes one accepted message on a worker thread.
+        on_shed(message, reason): called for refused or pushed-out messages.
+        rate/burst: per-sender token bucket (messages/s, bucket size);
+        rate 0 turns rate limiting off.
+        """
+        self._handler = handler
+        self._on_shed = on_shed or (lambda message, reason: None)
+        self.max_size = max(1, max_size)
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._buckets: dict[str, TokenBucket] = {}
+        self._queues = [deque() for _ in range(LOWEST + 1)]
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {"accepted": 0, "processed": 0, "errors": 0,
+                       "shed_rate": 0, "shed_full": 0, "evicted": 0}
+        self._threads = [threading.Thread(target=self._work, daemon=True,
+                                          name=f"engine-ingress-{i}")
+                         for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    def offer(self, message: dict) -> bool:
+        """Admit or refuse one message; never blocks on the handler.
+        Returns False when the message itself was refused."""
+        level = priority(message.get("type", ""))
+        sender = message.get("from_hash", "")
+        shed = None
+        with self._cond:
+            if self._closed:
+                return False
+            if self.rate > 0 and not self._bucket(sender).take():
+                self._stats["shed_rate"] += 1
+                shed = (message, "rate")
+            elif self._size >= self.max_size:
+                victim = self._evict_below(level)
+                if victim is None:
+                    self._stats["shed_full"] += 1
+                    shed = (message, "full")
+                else:
+                    self._stats["evicted"] += 1
+                    shed = (victim, "full")
+            accepted = shed is None or shed[0] is not message
+            if accepted:
+                self._queues[level].append(message)
+                self._size += 1
+                self._stats["accepted"] += 1
+                self._cond.notify()
+        if shed is not None:
+            self._shed(*shed)
+        return accepted
+
+    def retry_after_s(self, sender: str) -> float:
+        with self._cond:
+            bucket = self._buckets.get(sender)
+            return round(bucket.wait_s(), 1) if bucket is not None else 0.0
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                **self._stats,
+                "queued": self._size,
+                "queued_by_class": [len(q) for q in self._queues],
+                "max_size": self.max_size,
+                "senders": len(self._buckets),
+                "rate": self.rate,
+                "burst": self.burst,
+            }
+
+    def shutdown(self):
+        """Stop the workers. Messages still queued are dropped."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join()
+
+    def _bucket(self, sender: str) -> TokenBucket:
+        bucket = self._buckets.get(sender)
+        if bucket is None:
+            if len(self._buckets) >= MAX_SENDERS:
+                self._forget_idle()
+            bucket = self._buckets[sender] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _forget_idle(self):
+        now = time.monotonic()
+        for sender, bucket in list(self._buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * self.rate >= self.burst:
+                del self._buckets[sender]
+
+    def _evict_below(self, level: int) -> dict | None:
+        for lower in range(LOWEST, level, -1):
+            if self._queues[lower]:
+                self._size -= 1
+                return self._queues[lower].pop()
+        return None
+
+    def _shed(self, message: dict, reason: str):
+        try:
+            self._on_shed(message, reason)
+        except Exception as exc:
+            print(f"[INGRESS] busy antwoord MISLUKT: {exc}", flush=True)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._size and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                message = next(q for q in self._queues if q).popleft()
+                self._size -= 1
+            outcome = "processed"
+            try:
+                self._handler(message)
+            except Exception as exc:
+                outcome = "errors"
+                print(f"[INGRESS] {message.get('type', '?')} MISLUKT: {exc}", flush=True)
+            with self._cond:
+                self._stats[outcome] += 1
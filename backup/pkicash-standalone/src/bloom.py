@@ -0,0 +1,51 @@
+"""
+Bloom filter over byte strings.
+
+Sized from an expected item count and a target false-positive rate. The k
+bit positions come from one keyed blake2b digest by double hashing. The key
+is random per filter, so a false positive for some input does not repeat
+after a rebuild.
+"""
+
+import hashlib
+import math
+import os
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float = 1e-4):
+        if not 0 < fp_rate < 1:
+            raise ValueError("fp_rate moet tussen 0 en 1 liggen")
+        self.capacity = max(1, capacity)
+        self.fp_rate = fp_rate
+        self.n_bits = max(8, math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.n_hashes = max(1, round(self.n_bits / self.capacity * math.log(2)))
+        self._bits = bytearray((self.n_bits + 7) // 8)
+        self._key = os.urandom(16)
+        self.count = 0
+
+    def _positions(self, item: bytes):
+        digest = hashlib.blake2b(item, digest_size=16, key=self._key).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.n_hashes):
+            yield (h1 + i * h2) % self.n_bits
+
+    def add(self, item: bytes):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: bytes) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def stats(self) -> dict:
+        return {
+            "items": self.count,
+            "capacity": self.capacity,
+            "fp_rate": self.fp_rate,
+            "bits": self.n_bits,
+            "hashes": self.n_hashes,
+            "bytes": len(self._bits),
+        }
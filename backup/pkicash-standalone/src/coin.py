@@ -1,5 +1,16 @@
+import hashlib
+import json
 from dataclasses import dataclass
-from src.crypto_utils import verify, pk_from_hex, build_payload
+from src.crypto_utils import verify_hex, build_payload
+
+
+def reissue_digest(input_ids: list[str], outputs: list[dict]) -> str:
+    """Hex digest that every input owner signs for a split or merge:
+    the input coin ids and the (waarde, pk_owner) of each output, in order."""
+    body = json.dumps({"inputs": list(input_ids),
+                       "outputs": [[o["waarde"], o["pk_owner"]] for o in outputs]},
+                      separators=(",", ":"))
+    return hashlib.blake2b(body.encode("utf-8"), digest_size=32).hexdigest()
 
 
 @dataclass
@@ -17,11 +28,20 @@ class Coin:
 
     def verify_issuer(self, pk_issuer_hex: str = None) -> bool:
         pk_hex = pk_issuer_hex or self.pk_issuer
-        return verify(
-            bytes.fromhex(pk_hex),
-            self.signing_payload(),
-            bytes.fromhex(self.issuer_signature),
-        )
+        return verify_hex(pk_hex, self.signing_payload(), self.issuer_signature)
+
+    def derived_payload(self) -> bytes:
+        """Payload the engine signs for a coin it created by split or merge."""
+        return build_payload("derived", self.coin_id, str(self.waarde), self.pk_issuer)
+
+    def verify_origin(self, trusted_engines=()) -> bool:
+        """Signed by its issuer, or derived from that issuer's coins by one of
+        the trusted_engines (pk hex). The coin's own pk_engine field is only
+        accepted when the caller trusts that key."""
+        if self.verify_issuer():
+            return True
+        return (self.pk_engine in trusted_engines
+                and verify_hex(self.pk_engine, self.derived_payload(), self.issuer_signature))
 
     def to_dict(self) -> dict:
         return {
@@ -0,0 +1,72 @@
+"""
+Compact binary layout for coin_status_batch queries.
+
+A wallet or merchant asks an engine for the current owners of up to
+STATUS_BATCH_MAX coins in one message. Both directions carry base64 blobs
+inside the JSON envelope:
+
+    request   coin_id[16] * n
+    response  n(u16) found-bitmap[ceil(n/8)] fingerprint[8] * (coins found)
+
+The bitmap has bit i (LSB first) set when the i-th requested coin exists.
+Fingerprints follow only for those coins, in request order. A fingerprint
+is the first 8 bytes of blake2b(pk_current): enough to see whether the
+owner key is the one the asker expects. It is a pre-check; only a
+confirmed transaction proves ownership.
+"""
+
+import base64
+import hashlib
+import struct
+import uuid
+
+STATUS_BATCH_MAX = 256
+FINGERPRINT_SIZE = 8
+_COUNT = struct.Struct(">H")
+
+
+def fingerprint(pk: bytes) -> bytes:
+    return hashlib.blake2b(pk, digest_size=FINGERPRINT_SIZE).digest()
+
+
+def encode_request(coin_ids: list[str]) -> str:
+    if len(coin_ids) > STATUS_BATCH_MAX:
+        raise ValueError(f"Maximaal {STATUS_BATCH_MAX} coins per coin_status_batch")
+    return base64.b64encode(b"".join(uuid.UUID(c).bytes for c in coin_ids)).decode("ascii")
+
+
+def decode_request(blob: str) -> list[bytes]:
+    data = base64.b64decode(blob)
+    if len(data) % 16 or len(data) // 16 > STATUS_BATCH_MAX:
+        raise ValueError("Ongeldige coin_status_batch aanvraag")
+    return [data[i:i + 16] for i in range(0, len(data), 16)]
+
+
+def encode_status(keys: list[bytes], owners: dict[bytes, bytes]) -> str:
+    """Response blob for the requested coin keys; owners maps key -> pk_current."""
+    bitmap = bytearray((len(keys) + 7) // 8)
+    prints = []
+    for i, key in enumerate(keys):
+        pk = owners.get(key)
+        if pk is not None:
+            bitmap[i >> 3] |= 1 << (i & 7)
+            prints.append(fingerprint(pk))
+    return base64.b64encode(_COUNT.pack(len(keys)) + bytes(bitmap) + b"".join(prints)).decode("ascii")
+
+
+def decode_status(blob: str, coin_ids: list[str]) -> dict[str, bytes | None]:
+    """Map each requested coin_id to its owner fingerprint, or None if unknown."""
+    data = base64.b64decode(blob)
+    (n,) = _COUNT.unpack_from(data, 0)
+    if n != len(coin_ids):
+        raise ValueError("coin_status_batch antwoord past niet bij de aanvraag")
+    bitmap = data[_COUNT.size:_COUNT.size + (n + 7) // 8]
+    pos = _COUNT.size + len(bitmap)
+    result = {}
+    for i, coin_id in enumerate(coin_ids):
+        if bitmap[i >> 3] & (1 << (i & 7)):
+            result[coin_id] = data[pos:pos + FINGERPRINT_SIZE]
+            pos += FINGERPRINT_SIZE
+        else:
+            result[coin_id] = None
+    return result
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from nacl.signing import SigningKey, VerifyKey
 from nacl.exceptions import BadSignatureError
 
@@ -13,15 +15,50 @@ def sign(sk: SigningKey, message: bytes) -> bytes:
     return signed.signature
 
 
+VERIFY_KEY_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=VERIFY_KEY_CACHE_SIZE)
+def verify_key(pk_bytes: bytes) -> VerifyKey:
+    """Parsed VerifyKey for raw public key bytes, cached per key."""
+    return VerifyKey(pk_bytes)
+
+
+def verify_key_hex(pk_hex: str) -> VerifyKey:
+    """Parsed VerifyKey for a hex public key, from the same per-key cache."""
+    return verify_key(bytes.fromhex(pk_hex))
+
+
 def verify(pk_bytes: bytes, message: bytes, signature: bytes) -> bool:
     try:
-        pk = VerifyKey(pk_bytes)
+        verify_key(pk_bytes).verify(message, signature)
+        return True
+    except BadSignatureError:
+        return False
+
+
+def verify_with_key(pk: VerifyKey, message: bytes, signature: bytes) -> bool:
+    try:
         pk.verify(message, signature)
         return True
     except BadSignatureError:
         return False
 
 
+def verify_hex(pk_hex: str, message: bytes, signature_hex: str) -> bool:
+    try:
+        verify_key_hex(pk_hex).verify(message, bytes.fromhex(signature_hex))
+        return True
+    except BadSignatureError:
+        return False
+
+
+def verify_key_cache_info() -> dict:
+    """Hit/miss counts of the VerifyKey cache, for raw and hex lookups alike."""
+    info = verify_key.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
+
+
 def sk_to_hex(sk: SigningKey) -> str:
     return sk.encode().hex()
 
@@ -0,0 +1,160 @@
+"""
+SQLite connection management for the state engine.
+
+One writer connection, serialised by a lock, plus a bounded pool of reader
+connections. File databases run in WAL mode so readers never block on (or
+block) a committing writer. In-memory databases cannot be shared between
+connections, so there every read goes through the writer under its lock.
+
+A pool checkout costs more than a point read, so while no pooled reader is
+checked out and the writer lock is free with no writer waiting for it, a
+read goes through the writer connection instead. The pool only comes into
+play once reads overlap each other or a write.
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class WriteLock:
+    """Reentrant lock that counts the threads waiting for it, so readers can
+    stay out of a writer's way, and its hold depth, so a writer's own reads
+    are not served from inside its open transaction."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._count_lock = threading.Lock()
+        self.waiting = 0
+        self.depth = 0
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._lock.acquire(False):
+            if not blocking:
+                return False
+            with self._count_lock:
+                self.waiting += 1
+            try:
+                self._lock.acquire()
+            finally:
+                with self._count_lock:
+                    self.waiting -= 1
+        self.depth += 1
+        return True
+
+    def release(self):
+        self.depth -= 1
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ConnectionPool:
+    def __init__(self, db_path: str = ":memory:", max_readers: int = 8):
+        self.db_path = db_path
+        self._shared = db_path != ":memory:" and max_readers > 0
+        self._max_readers = max_readers if self._shared else 0
+
+        self.write_lock = WriteLock()
+        self.writer = self._connect()
+        if db_path != ":memory:":
+            self.writer.execute("PRAGMA journal_mode=WAL")
+            self.writer.execute("PRAGMA synchronous=NORMAL")
+
+        # list.pop/append are atomic, so the common checkout takes no lock
+        self._idle: list[sqlite3.Connection] = []
+        self._all_readers: list[sqlite3.Connection] = []
+        self._readers_cond = threading.Condition()
+        self._waiting = 0
+        self._stats = {
+            "connections_opened": 1,
+            "reader_checkouts": 0,
+            "reader_waits": 0,
+            "writer_reads": 0,
+        }
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Check out a read-only connection for the calling thread."""
+        if not self._shared:
+            with self.write_lock:
+                yield self.writer
+            return
+
+        lock = self.write_lock
+        if not lock.waiting and len(self._idle) == len(self._all_readers) and lock.acquire(False):
+            if lock.depth == 1:
+                try:
+                    self._stats["writer_reads"] += 1
+                    yield self.writer
+                finally:
+                    lock.release()
+                return
+            lock.release()
+
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._idle.append(conn)
+            if self._waiting:
+                with self._readers_cond:
+                    self._readers_cond.notify()
+
+    def _checkout(self) -> sqlite3.Connection:
+        try:
+            conn = self._idle.pop()
+        except IndexError:
+            with self._readers_cond:
+                self._waiting += 1
+                try:
+                    while True:
+                        if self._idle:
+                            conn = self._idle.pop()
+                            break
+                        if len(self._all_readers) < self._max_readers:
+                            conn = self._connect()
+                            conn.execute("PRAGMA query_only=ON")
+                            self._all_readers.append(conn)
+                            self._stats["connections_opened"] += 1
+                            break
+                        self._stats["reader_waits"] += 1
+                        self._readers_cond.wait()
+                finally:
+                    self._waiting -= 1
+        self._stats["reader_checkouts"] += 1
+        return conn
+
+    def stats(self) -> dict:
+        with self._readers_cond:
+            readers_open = len(self._all_readers)
+        return {
+            "wal": self.db_path != ":memory:",
+            "pooled_readers": self._shared,
+            "max_readers": self._max_readers,
+            "readers_open": readers_open,
+            "readers_idle": len(self._idle),
+            **self._stats,
+        }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        with self._readers_cond:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers.clear()
+        with self.write_lock:
+            self.writer.close()
@@ -0,0 +1,166 @@
+"""
+Per-recipient coalescing of engine deliveries.
+
+After a commit the actor calls schedule(recipient, ...) instead of sending
+the recipient's deliveries itself. The first schedule() for a recipient
+opens a window of window_s seconds; everything committed for that recipient
+until the window closes goes out as one coin_delivery_pack message, taken
+from pending_deliveries in one read. A pack holds at most max_coins
+deliveries, and a window closes early once that many coins are waiting.
+
+Pack layout (pack_deliveries / unpack_deliveries): fields that are equal
+in every delivery of the pack (pk_issuer, pk_engine, endpoint, status,
+Merkle root, sender, ...) are sent once under "shared"; each item carries
+only what differs. A confirmation's coin_id and pk_next are left out when
+they equal the coin's coin_id and pk_current. The transport zlib-compresses
+the whole envelope on top of that.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PACK_TYPE = "coin_delivery_pack"
+_SECTIONS = ("coin", "confirmation")
+
+
+def pack_deliveries(deliveries: list[dict]) -> dict:
+    shared = {}
+    for section in _SECTIONS:
+        first = deliveries[0][section]
+        shared[section] = {k: v for k, v in first.items()
+                           if all(d[section].get(k, object()) == v for d in deliveries)}
+    extra_keys = {k for d in deliveries for k in d if k not in _SECTIONS}
+    shared["extra"] = {k: deliveries[0][k] for k in extra_keys
+                       if all(k in d and d[k] == deliveries[0][k] for d in deliveries)}
+
+    items = []
+    for d in deliveries:
+        coin = {k: v for k, v in d["coin"].items() if k not in shared["coin"]}
+        confirmation = {k: v for k, v in d["confirmation"].items() if k not in shared["confirmation"]}
+        if confirmation.get("coin_id") == d["coin"]["coin_id"]:
+            del confirmation["coin_id"]
+        if confirmation.get("pk_next") == d["coin"]["pk_current"]:
+            del confirmation["pk_next"]
+        item = {"coin": coin, "confirmation": confirmation}
+        item.update((k, v) for k, v in d.items() if k not in _SECTIONS and k not in shared["extra"])
+        items.append(item)
+    return {"shared": shared, "items": items}
+
+
+def unpack_deliveries(payload: dict) -> list[dict]:
+    shared = payload["shared"]
+    deliveries = []
+    for item in payload["items"]:
+        coin = {**shared["coin"], **item["coin"]}
+        confirmation = {"coin_id": coin["coin_id"], "pk_next": coin["pk_current"],
+                        **shared["confirmation"], **item["confirmation"]}
+        extra = {k: v for k, v in item.items() if k not in _SECTIONS}
+        deliveries.append({**shared["extra"], **extra, "coin": coin, "confirmation": confirmation})
+    return deliveries
+
+
+class DeliveryCoalescer:
+    def __init__(self, engine, send, window_s: float = 0.05, max_coins: int = 256,
+                 send_workers: int = 4):
+        """
+        engine: StateEngine or ShardedStateEngine (get_pending_deliveries).
+        send(dest_hash, role, msg_type, payload): blocking transport send.
+        """
+        self._engine = engine
+        self._send = send
+        self.window_s = window_s
+        self.max_coins = max(1, max_coins)
+        # recipient -> {"due", "coins", "notes": {coin_id: (description, sender)}, "fallback"}
+        self._pending: dict[str, dict] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {"scheduled": 0, "flushes": 0, "messages": 0, "deliveries": 0, "errors": 0}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, send_workers),
+                                            thread_name_prefix="delivery-send")
+        self._thread = threading.Thread(target=self._run, daemon=True, name="delivery-coalescer")
+        self._thread.start()
+
+    def schedule(self, recipient: str, coin_ids=(), description: str = None, sender: str = ""):
+        """Send everything pending for recipient once its window closes.
+        description and sender are attached to the deliveries of coin_ids;
+        other pending deliveries get those of the latest schedule() call."""
+        if not recipient:
+            return
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                return
+            entry = self._pending.get(recipient)
+            if entry is None:
+                entry = self._pending[recipient] = {"due": now + self.window_s, "coins": 0, "notes": {}}
+            for coin_id in coin_ids:
+                entry["notes"][coin_id] = (description, sender)
+            entry["coins"] += len(coin_ids)
+            entry["fallback"] = (description, sender)
+            if entry["coins"] >= self.max_coins:
+                entry["due"] = now
+            self._stats["scheduled"] += 1
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "waiting_recipients": len(self._pending),
+                    "window_s": self.window_s, "max_coins": self.max_coins}
+
+    def close(self):
+        """Send what is still waiting, then stop."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    now = time.monotonic()
+                    due = min((e["due"] for e in self._pending.values()), default=None)
+                    if due is not None and due <= now:
+                        break
+                    self._cond.wait(None if due is None else due - now)
+                now = time.monotonic()
+                ready = [(r, e) for r, e in self._pending.items() if self._closed or e["due"] <= now]
+                for recipient, _ in ready:
+                    del self._pending[recipient]
+                closed = self._closed
+            for recipient, entry in ready:
+                self._executor.submit(self._flush, recipient, entry)
+            if closed:
+                return
+
+    def _flush(self, recipient: str, entry: dict):
+        try:
+            deliveries = self._engine.get_pending_deliveries(recipient)
+        except Exception as exc:
+            print(f"[DELIVERY] deliveries voor {recipient[:16]} ophalen MISLUKT: {exc}", flush=True)
+            with self._cond:
+                self._stats["errors"] += 1
+            return
+        for d in deliveries:
+            description, sender = entry["notes"].get(d["coin"]["coin_id"], entry["fallback"])
+            if description:
+                d["description"] = description
+            d["sender_dest"] = sender
+        sent = errors = 0
+        for i in range(0, len(deliveries), self.max_coins):
+            chunk = deliveries[i:i + self.max_coins]
+            try:
+                self._send(recipient, "wallet", PACK_TYPE, pack_deliveries(chunk))
+                sent += 1
+            except Exception as exc:
+                errors += 1
+                print(f"[DELIVERY] {PACK_TYPE} naar {recipient[:16]} MISLUKT: {exc}", flush=True)
+        with self._cond:
+            self._stats["flushes"] += 1
+            self._stats["messages"] += sent
+            self._stats["deliveries"] += len(deliveries)
+            self._stats["errors"] += errors
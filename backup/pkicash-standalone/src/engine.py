@@ -1,12 +1,26 @@
+import hashlib
+import itertools
 import json
 import sqlite3
+import time
+import uuid
+from collections import OrderedDict
 from pathlib import Path
 
+from nacl.signing import VerifyKey
+
 from src.crypto_utils import (
-    generate_keypair, sign, verify, sk_to_hex, pk_to_hex,
-    sk_from_hex, build_payload,
+    generate_keypair, sign, verify, verify_hex, verify_with_key, verify_key_hex,
+    sk_to_hex, pk_to_hex, sk_from_hex, build_payload, verify_key_cache_info,
+)
+from src.coin import Coin, reissue_digest
+from src.bloom import BloomFilter
+from src.db_pool import ConnectionPool
+from src.journal import (
+    ISSUE, RETIRE, TRANSFER, Journal, check_event, digest_update, recover, state_hash,
 )
-from src.coin import Coin
+from src.merkle import merkle_tree
+from src.ownership_cache import OwnershipCache
 
 
 class InvalidSignatureError(Exception):
@@ -25,11 +39,99 @@ class UntrustedIssuerError(Exception):
     pass
 
 
+_COIN_COLUMNS = (
+    "o.coin_id, o.pk_current, m.waarde, m.pk_issuer, m.issuer_signature, "
+    "m.state_engine_endpoint, m.pk_engine"
+)
+STATS_MINUTES_KEPT = 24 * 60
+REPLAY_CACHE_MAX = 4096
+# Most input or output coins in one split/merge
+REISSUE_MAX = 64
+
+_COIN_JOIN = "FROM coin_owner o JOIN coin_meta m ON m.coin_id = o.coin_id"
+
+
+def _id_blob(coin_id: str) -> bytes:
+    return uuid.UUID(coin_id).bytes
+
+
+def _replay_key(coin_id: str, pk_next: str, signature: str) -> bytes:
+    """Identity of a transfer request, to recognise retransmissions."""
+    return hashlib.blake2b(build_payload(coin_id, pk_next, signature), digest_size=16).digest()
+
+
+def _verify_triple(triple: tuple[bytes, bytes, bytes]) -> bool:
+    """verify() that reports a malformed key or signature as invalid instead
+    of raising, so one bad item cannot fail a whole batch."""
+    try:
+        return verify(*triple)
+    except Exception:
+        return False
+
+
+def _derived_coin_id(digest: str, index: int, accept_id=None) -> str:
+    """Deterministic id of output `index` of a split/merge. accept_id may
+    reject candidates; the next one is tried (used for shard placement)."""
+    for attempt in itertools.count():
+        raw = hashlib.blake2b(build_payload(digest, str(index), str(attempt)), digest_size=16).digest()
+        coin_id = str(uuid.UUID(bytes=raw, version=4))
+        if accept_id is None or accept_id(coin_id):
+            return coin_id
+
+
+def _coin_dict(row) -> dict:
+    return {
+        "coin_id": str(uuid.UUID(bytes=row["coin_id"])),
+        "waarde": row["waarde"],
+        "pk_current": row["pk_current"].hex(),
+        "pk_issuer": row["pk_issuer"].hex(),
+        "issuer_signature": row["issuer_signature"].hex(),
+        "state_engine_endpoint": row["state_engine_endpoint"],
+        "pk_engine": row["pk_engine"].hex(),
+    }
+
+
 class StateEngine:
-    def __init__(self, db_path: str = ":memory:", sk=None):
-        self._conn = sqlite3.connect(db_path, check_same_thread=False)
-        self._conn.row_factory = sqlite3.Row
+    def __init__(self, db_path: str = ":memory:", sk=None, max_readers: int = 8,
+                 delivery_retention_s: float = 7 * 24 * 3600,
+                 cache_max_bytes: int = 16 * 1024 * 1024, verifier=None,
+                 merkle_confirmations: bool = False, journal_dir: str = None,
+                 snapshot_every: int = 10000, journal_fsync: bool = False,
+                 journal_recover: bool = False, spent_filter_fp: float = 0, spent_filter_capacity: int = 100_000):
+        self._db_path = db_path
+        self._verifier = verifier
+        # Sign one Merkle root per commit instead of every confirmation
+        self.merkle_confirmations = merkle_confirmations
+        self.delivery_retention_s = delivery_retention_s
+        self._owners = OwnershipCache(cache_max_bytes)
+        self._issuers: dict[str, VerifyKey] = {}
+        self._issuer_listeners: list = []
+        self._pool = ConnectionPool(db_path, max_readers=max_readers)
+        self._conn = self._pool.writer
+        self._write_lock = self._pool.write_lock
+        self._stats = {"commits": 0, "rollbacks": 0}
+        self._opened_at = time.time()
+        self._closed = False
+        self._journal = None
+        self._journal_pending: list[tuple[int, tuple]] = []
+        self._state_digest = 0
+        self._ledger_minute = None
+        self.snapshot_every = snapshot_every
+        self.spent_filter_fp = spent_filter_fp
+        self._spent: BloomFilter | None = None
+        self._spent_pending: list[bytes] = []
+        # Per-issuer [coins, value, transfers] deltas of the open transaction
+        self._ledger_pending: dict[bytes, list[int]] = {}
+        # Recently committed confirmations by _replay_key, newest last
+        self._replays: OrderedDict[bytes, dict] = OrderedDict()
+        self._replay_pending: list[tuple[bytes, dict]] = []
+        self._replay_stats = {"hits": 0}
+        self._spent_stats = {"checks": 0, "rejected": 0, "false_positives": 0}
         self._init_db()
+        if spent_filter_fp:
+            self._build_spent_filter(spent_filter_capacity)
+        if journal_dir:
+            self._open_journal(journal_dir, journal_fsync, journal_recover)
 
         if sk:
             self._sk = sk
@@ -41,13 +143,202 @@ class StateEngine:
     def pk_hex(self) -> str:
         return pk_to_hex(self._pk)
 
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._journal is not None:
+            self._journal.close()
+        self._pool.close()
+
+    def connection_stats(self) -> dict:
+        return {
+            "db_path": self._db_path,
+            "open": not self._closed,
+            "uptime_s": round(time.time() - self._opened_at, 1),
+            "total_changes": self._conn.total_changes if not self._closed else None,
+            **self._stats,
+            **self._pool.stats(),
+            "ownership_cache": self._owners.stats(),
+            "verify_key_cache": verify_key_cache_info(),
+            "verifier": self._verifier.stats() if self._verifier else None,
+            "journal": self._journal.stats() if self._journal else None,
+            "spent_filter": {**self._spent.stats(), **self._spent_stats} if self._spent else None,
+            "replay_cache": {"size": len(self._replays), **self._replay_stats},
+        }
+
+    def _commit(self):
+        if self._ledger_pending:
+            self._flush_ledger()
+        self._conn.commit()
+        self._stats["commits"] += 1
+        if self._replay_pending:
+            for tx_key, confirmation in self._replay_pending:
+                self._replays[tx_key] = confirmation
+            self._replay_pending = []
+            while len(self._replays) > REPLAY_CACHE_MAX:
+                self._replays.popitem(last=False)
+        if self._spent_pending:
+            for item in self._spent_pending:
+                self._spent.add(item)
+            self._spent_pending = []
+            if self._spent.count > self._spent.capacity:
+                self._build_spent_filter(2 * self._spent.capacity)
+                print(f"[ENGINE] spent-filter vol, opnieuw begonnen met capaciteit "
+                      f"{self._spent.capacity}", flush=True)
+        if self._journal_pending:
+            # Appended after the commit, under the write lock, so the journal
+            # order is the commit order and never holds rolled-back events
+            self._journal.append(self._journal_pending)
+            for rtype, fields in self._journal_pending:
+                self._state_digest = digest_update(self._state_digest, rtype, fields)
+            self._journal_pending = []
+            if self._journal.seq - self._journal.snapshot_seq >= self.snapshot_every:
+                self.write_snapshot()
+
+    def _rollback(self):
+        self._conn.rollback()
+        self._stats["rollbacks"] += 1
+        self._journal_pending = []
+        self._spent_pending = []
+        self._ledger_pending = {}
+        self._replay_pending = []
+
+    # ── journal ─────────────────────────────────────────────
+
+    def _open_journal(self, journal_dir: str, fsync: bool, journal_recover: bool = False):
+        """Open the journal and make it match the database. Records are
+        appended after the commit, so a crash can leave the journal behind
+        the database; it then restarts from a fresh snapshot. With
+        journal_recover the database is rebuilt from the journal instead,
+        so the journal is left as it is."""
+        self._journal = Journal(journal_dir, fsync=fsync)
+        with self._write_lock:
+            for r in self._conn.execute("SELECT coin_id, pk_current FROM coin_owner"):
+                self._state_digest ^= state_hash(r["coin_id"], r["pk_current"])
+            has_coins = self._conn.execute("SELECT 1 FROM coin_owner LIMIT 1").fetchone() is not None
+            if self._journal.seq == 0:
+                if has_coins:
+                    # Existing database without a journal: start from a snapshot
+                    self.write_snapshot()
+                return
+            if journal_recover:
+                return
+            _, coins = recover(journal_dir)
+            journal_digest = 0
+            for coin_id, c in coins.items():
+                journal_digest ^= state_hash(coin_id, c[0])
+            if journal_digest == self._state_digest:
+                return
+            if not has_coins:
+                print(f"[ENGINE] database is leeg maar journal heeft {len(coins)} coins; "
+                      f"start met --recover om te herstellen", flush=True)
+                return
+            print(f"[ENGINE] journal ({len(coins)} coins) loopt niet gelijk met de database, "
+                  f"nieuwe snapshot", flush=True)
+            # A new seq, so replicas that already hold the old one pick it up
+            self._journal.skip()
+            self.write_snapshot()
+
+    def _journal_event(self, rtype: int, fields: tuple):
+        """Stage a journal record for the next commit. A malformed key fails
+        here, inside the transaction, rather than after the commit."""
+        check_event(rtype, fields)
+        self._journal_pending.append((rtype, fields))
+
+    @property
+    def journal_dir(self) -> str | None:
+        return str(self._journal.dir) if self._journal is not None else None
+
+    def journal_position(self) -> dict:
+        """Last journal seq and the state digest of the table at that seq."""
+        if self._journal is None:
+            raise ValueError("Engine heeft geen journal")
+        with self._write_lock:
+            return {"seq": self._journal.seq, "digest": f"{self._state_digest:064x}"}
+
+    def write_snapshot(self) -> str | None:
+        """Write the ownership table to a journal snapshot at the current seq."""
+        if self._journal is None:
+            return None
+        with self._write_lock:
+            rows = self._conn.execute(f"SELECT {_COIN_COLUMNS} {_COIN_JOIN}")
+            path = self._journal.write_snapshot(
+                (r["coin_id"], r["pk_current"], r["waarde"], r["pk_issuer"],
+                 r["issuer_signature"], r["pk_engine"], r["state_engine_endpoint"])
+                for r in rows
+            )
+        print(f"[ENGINE] journal snapshot geschreven: {path.name}", flush=True)
+        return str(path)
+
+    def rebuild_from_journal(self) -> int:
+        """Replace the coin tables with the state recovered from the newest
+        journal snapshot plus the journal tail. Returns the number of coins."""
+        if self._journal is None:
+            raise ValueError("Engine heeft geen journal")
+        seq, coins = recover(str(self._journal.dir))
+        with self._write_lock:
+            try:
+                self._conn.execute("DELETE FROM coin_owner")
+                self._conn.execute("DELETE FROM coin_meta")
+                self._conn.executemany(
+                    "INSERT INTO coin_meta (coin_id, waarde, pk_issuer, issuer_signature, "
+                    "pk_engine, state_engine_endpoint) VALUES (?, ?, ?, ?, ?, ?)",
+                    ((k, c[1], c[2], c[3], c[4], c[5]) for k, c in coins.items()),
+                )
+                self._conn.executemany(
+                    "INSERT INTO coin_owner (coin_id, pk_current) VALUES (?, ?)",
+                    ((k, c[0]) for k, c in coins.items()),
+                )
+                self._recount_ledger()
+                self._conn.commit()
+            except Exception:
+                self._rollback()
+                raise
+            self._owners.clear()
+            self._state_digest = 0
+            for k, c in coins.items():
+                self._state_digest ^= state_hash(k, c[0])
+        print(f"[ENGINE] {len(coins)} coins hersteld uit journal tot seq {seq}", flush=True)
+        return len(coins)
+
     def _init_db(self):
         self._conn.executescript("""
-            CREATE TABLE IF NOT EXISTS coins (
-                coin_id TEXT PRIMARY KEY,
-                pk_current TEXT NOT NULL,
-                coin_data TEXT NOT NULL
+            CREATE TABLE IF NOT EXISTS coin_meta (
+                coin_id BLOB PRIMARY KEY,
+                waarde INTEGER NOT NULL,
+                pk_issuer BLOB NOT NULL,
+                issuer_signature BLOB NOT NULL,
+                state_engine_endpoint TEXT NOT NULL,
+                pk_engine BLOB NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS coin_owner (
+                coin_id BLOB PRIMARY KEY,
+                pk_current BLOB NOT NULL
+            ) WITHOUT ROWID;
+            DROP TABLE IF EXISTS retired_keys;
+            CREATE TABLE IF NOT EXISTS issuer_stats (
+                pk_issuer BLOB PRIMARY KEY,
+                coins INTEGER NOT NULL DEFAULT 0,
+                value INTEGER NOT NULL DEFAULT 0,
+                transfers INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS transfer_minutes (
+                minute INTEGER PRIMARY KEY,
+                transfers INTEGER NOT NULL
             );
+            CREATE TABLE IF NOT EXISTS confirmed_requests (
+                request_key BLOB PRIMARY KEY,
+                confirmation TEXT NOT NULL,
+                created_at REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS reissue_holds (
+                coin_id BLOB PRIMARY KEY,
+                request_key BLOB NOT NULL,
+                pk_current BLOB NOT NULL,
+                coin_json TEXT NOT NULL,
+                created_at REAL NOT NULL
+            ) WITHOUT ROWID;
             CREATE TABLE IF NOT EXISTS trusted_issuers (
                 pk_issuer TEXT PRIMARY KEY
             );
@@ -60,163 +351,951 @@ class StateEngine:
             );
         """)
         self._conn.commit()
+        self._migrate_legacy_coins()
+        self._migrate_deliveries()
+        if (self._conn.execute("SELECT 1 FROM issuer_stats LIMIT 1").fetchone() is None
+                and self._conn.execute("SELECT 1 FROM coin_meta LIMIT 1").fetchone() is not None):
+            self._recount_ledger()
+            self._conn.commit()
+        self._ledger_pending = {}
+        self._load_issuers()
 
-    def register_issuer(self, pk_issuer_hex: str):
+    def _migrate_deliveries(self):
+        """Add delivery timestamps to older databases and index the queue."""
+        columns = {r["name"] for r in self._conn.execute("PRAGMA table_info(pending_deliveries)")}
+        if "created_at" not in columns:
+            self._conn.execute("ALTER TABLE pending_deliveries ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+        if "delivered_at" not in columns:
+            self._conn.execute("ALTER TABLE pending_deliveries ADD COLUMN delivered_at REAL")
+            self._conn.execute(
+                "UPDATE pending_deliveries SET delivered_at = ? WHERE delivered = 1", (time.time(),)
+            )
+        self._conn.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_deliveries_recipient
+                ON pending_deliveries (recipient_address, delivered, id);
+            CREATE INDEX IF NOT EXISTS idx_deliveries_delivered_at
+                ON pending_deliveries (delivered_at) WHERE delivered = 1;
+        """)
+        self._conn.commit()
+
+    def _migrate_legacy_coins(self):
+        """Move rows from the old JSON `coins` table into coin_meta/coin_owner."""
+        legacy = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'coins'"
+        ).fetchone()
+        if legacy is None:
+            return
+
+        migrated = skipped = 0
+        for row in self._conn.execute("SELECT coin_id, pk_current, coin_data FROM coins").fetchall():
+            try:
+                coin = Coin.from_dict(json.loads(row["coin_data"]))
+                self._insert_coin(coin, row["pk_current"])
+                migrated += 1
+            except (ValueError, KeyError, TypeError, sqlite3.IntegrityError) as exc:
+                print(f"[ENGINE] migratie: coin {row['coin_id']} overgeslagen ({exc})", flush=True)
+                skipped += 1
+        self._conn.execute("DROP TABLE coins")
+        self._conn.commit()
+        if self._db_path != ":memory:":
+            self._conn.execute("VACUUM")
+        print(f"[ENGINE] migratie naar binair schema: {migrated} coins, {skipped} overgeslagen", flush=True)
+
+    def _insert_coin(self, coin: Coin, pk_owner_hex: str):
+        key = _id_blob(coin.coin_id)
         self._conn.execute(
-            "INSERT OR IGNORE INTO trusted_issuers (pk_issuer) VALUES (?)",
-            (pk_issuer_hex,),
+            "INSERT INTO coin_meta (coin_id, waarde, pk_issuer, issuer_signature, "
+            "state_engine_endpoint, pk_engine) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, coin.waarde, bytes.fromhex(coin.pk_issuer),
+             bytes.fromhex(coin.issuer_signature), coin.state_engine_endpoint,
+             bytes.fromhex(coin.pk_engine)),
         )
-        self._conn.commit()
+        self._conn.execute(
+            "INSERT INTO coin_owner (coin_id, pk_current) VALUES (?, ?)",
+            (key, bytes.fromhex(pk_owner_hex)),
+        )
+        self._ledger_add(bytes.fromhex(coin.pk_issuer), coins=1, value=coin.waarde)
+        if self._journal is not None:
+            self._journal_event(ISSUE, (
+                key, bytes.fromhex(pk_owner_hex), coin.waarde, bytes.fromhex(coin.pk_issuer),
+                bytes.fromhex(coin.issuer_signature), bytes.fromhex(coin.pk_engine),
+                coin.state_engine_endpoint,
+            ))
+
+    def _ledger_add(self, pk_issuer: bytes, coins: int = 0, value: int = 0, transfers: int = 0):
+        delta = self._ledger_pending.setdefault(pk_issuer, [0, 0, 0])
+        delta[0] += coins
+        delta[1] += value
+        delta[2] += transfers
+
+    def _flush_ledger(self):
+        """Write the pending ledger deltas; runs inside the transaction being committed."""
+        self._conn.executemany(
+            "INSERT INTO issuer_stats (pk_issuer, coins, value, transfers) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(pk_issuer) DO UPDATE SET coins = coins + excluded.coins, "
+            "value = value + excluded.value, transfers = transfers + excluded.transfers",
+            ((pk, *delta) for pk, delta in self._ledger_pending.items()),
+        )
+        transfers = sum(delta[2] for delta in self._ledger_pending.values())
+        if transfers:
+            minute = int(time.time() // 60)
+            self._conn.execute(
+                "INSERT INTO transfer_minutes (minute, transfers) VALUES (?, ?) "
+                "ON CONFLICT(minute) DO UPDATE SET transfers = transfers + excluded.transfers",
+                (minute, transfers),
+            )
+            if minute != self._ledger_minute:
+                self._conn.execute("DELETE FROM transfer_minutes WHERE minute < ?",
+                                   (minute - STATS_MINUTES_KEPT,))
+                self._ledger_minute = minute
+        self._ledger_pending = {}
+
+    def _recount_ledger(self):
+        """Recount coins and value per issuer from coin_meta; transfer counts are kept."""
+        self._conn.execute("UPDATE issuer_stats SET coins = 0, value = 0")
+        self._conn.execute(
+            "INSERT INTO issuer_stats (pk_issuer, coins, value) "
+            "SELECT pk_issuer, COUNT(*), SUM(waarde) FROM coin_meta WHERE true GROUP BY pk_issuer "
+            "ON CONFLICT(pk_issuer) DO UPDATE SET coins = excluded.coins, value = excluded.value"
+        )
+
+    def stats(self) -> dict:
+        """Coin supply and transfer counters, per issuer and in total."""
+        minute = int(time.time() // 60)
+        with self._pool.reader() as conn:
+            rows = conn.execute("SELECT pk_issuer, coins, value, transfers FROM issuer_stats").fetchall()
+            minutes = conn.execute(
+                "SELECT minute, transfers FROM transfer_minutes WHERE minute > ? ORDER BY minute",
+                (minute - 60,),
+            ).fetchall()
+        per_minute = {r["minute"]: r["transfers"] for r in minutes}
+        issuers = {
+            r["pk_issuer"].hex(): {"coins": r["coins"], "value": r["value"], "transfers": r["transfers"]}
+            for r in rows
+        }
+        return {
+            "coins": sum(i["coins"] for i in issuers.values()),
+            "outstanding_value": sum(i["value"] for i in issuers.values()),
+            "transfers": sum(i["transfers"] for i in issuers.values()),
+            "transfers_last_minute": per_minute.get(minute - 1, 0),
+            "transfers_per_minute": [[m * 60, per_minute.get(m, 0)] for m in range(minute - 59, minute + 1)],
+            "issuers": issuers,
+        }
+
+    def _replayed(self, coin_id: str, pk_next: str, signature: str) -> dict | None:
+        """The stored confirmation if this exact request was committed before."""
+        tx_key = _replay_key(coin_id, pk_next, signature)
+        confirmation = self._replays.get(tx_key)
+        if confirmation is None:
+            with self._pool.reader() as conn:
+                row = conn.execute("SELECT confirmation FROM confirmed_requests WHERE request_key = ?",
+                                   (tx_key,)).fetchone()
+            if row is None:
+                return None
+            confirmation = json.loads(row["confirmation"])
+        self._replay_stats["hits"] += 1
+        return confirmation
+
+    def _remember_confirmed(self, requests: list[tuple[str, str, str]], confirmations: list[dict]):
+        """Store confirmations by request in the open transaction; caller holds the write lock."""
+        now = time.time()
+        rows = [(_replay_key(*request), confirmation)
+                for request, confirmation in zip(requests, confirmations)]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO confirmed_requests (request_key, confirmation, created_at) "
+            "VALUES (?, ?, ?)",
+            ((tx_key, json.dumps(confirmation), now) for tx_key, confirmation in rows),
+        )
+        self._replay_pending.extend(rows)
+
+    def _build_spent_filter(self, capacity: int):
+        """Start an empty Bloom filter of retired owner keys. It lives in
+        memory only: it fills with the rotations committed since, and is
+        started over once it outgrows its capacity."""
+        self._spent = BloomFilter(capacity, self.spent_filter_fp)
+
+    def _check_not_spent(self, coin_id: str, pk_claimed: str):
+        """Reject a spend by an owner key that was already rotated out,
+        before the database and signature work. A filter hit is trusted at
+        the configured false-positive rate, unless the ownership cache shows
+        the claimed key is the current owner."""
+        self._spent_stats["checks"] += 1
+        try:
+            item = _id_blob(coin_id) + bytes.fromhex(pk_claimed)
+        except ValueError:
+            return
+        if item not in self._spent:
+            return
+        cached = self._owners.get(coin_id)
+        if cached is not None and cached[0].hex() == pk_claimed:
+            self._spent_stats["false_positives"] += 1
+            return
+        self._spent_stats["rejected"] += 1
+        raise DoubleSpendError(f"Coin {coin_id} is al uitgegeven door deze sleutel")
+
+    def _load_issuers(self):
+        for r in self._conn.execute("SELECT pk_issuer FROM trusted_issuers").fetchall():
+            try:
+                self._issuers[r["pk_issuer"]] = verify_key_hex(r["pk_issuer"])
+            except (ValueError, TypeError) as exc:
+                print(f"[ENGINE] ongeldige issuer sleutel {r['pk_issuer'][:16]} overgeslagen ({exc})", flush=True)
+
+    def register_issuer(self, pk_issuer_hex: str):
+        key = verify_key_hex(pk_issuer_hex)
+        with self._write_lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO trusted_issuers (pk_issuer) VALUES (?)",
+                (pk_issuer_hex,),
+            )
+            self._commit()
+            added = cur.rowcount == 1 or pk_issuer_hex not in self._issuers
+            self._issuers[pk_issuer_hex] = key
+        if added:
+            self._notify_issuer_change("added", pk_issuer_hex)
+
+    def on_issuer_change(self, callback):
+        """Register callback(event, pk_issuer_hex), called after the trusted set changes."""
+        self._issuer_listeners.append(callback)
+
+    def _notify_issuer_change(self, event: str, pk_issuer_hex: str):
+        for callback in self._issuer_listeners:
+            try:
+                callback(event, pk_issuer_hex)
+            except Exception as exc:
+                print(f"[ENGINE] issuer listener MISLUKT: {exc}", flush=True)
 
     def is_trusted_issuer(self, pk_issuer_hex: str) -> bool:
-        row = self._conn.execute(
-            "SELECT 1 FROM trusted_issuers WHERE pk_issuer = ?",
-            (pk_issuer_hex,),
-        ).fetchone()
-        return row is not None
+        return pk_issuer_hex in self._issuers
 
     def list_issuers(self) -> list[str]:
-        rows = self._conn.execute("SELECT pk_issuer FROM trusted_issuers").fetchall()
-        return [r["pk_issuer"] for r in rows]
+        return list(self._issuers)
 
     def register_coin(self, coin: Coin, recipient_address: str,
                        pk_next: str, transfer_signature: str):
-        if not self.is_trusted_issuer(coin.pk_issuer):
-            raise UntrustedIssuerError(f"Issuer {coin.pk_issuer[:16]}... is niet vertrouwd")
-
-        if not coin.verify_issuer():
-            raise InvalidSignatureError("Ongeldige issuer signature")
+        if self._replayed(coin.coin_id, pk_next, transfer_signature) is not None:
+            return
+        self._check_registration(coin, pk_next, transfer_signature)
+        with self._write_lock:
+            coin_data = self._apply_registration(coin, recipient_address, pk_next, transfer_signature)
+            confirmations = self._queue_confirmed([(recipient_address, coin_data, "issued", None)])
+            self._remember_confirmed([(coin.coin_id, pk_next, transfer_signature)], confirmations)
+            self._commit()
+            self._cache_owner(coin_data)
 
-        transfer_payload = build_payload(coin.coin_id, pk_next)
-        if not verify(bytes.fromhex(coin.pk_current), transfer_payload,
-                      bytes.fromhex(transfer_signature)):
-            raise InvalidSignatureError("Ongeldige transfer signature bij issuance")
+    def register_coins(self, items: list[dict], recipient_address: str) -> list[dict]:
+        """
+        Register a batch of freshly issued coins for one recipient in one
+        SQLite transaction. Each item contains: coin (Coin), pk_next,
+        transfer_signature. Returns one result per item, in order:
+            {"coin_id": ..., "ok": True}
+            {"coin_id": ..., "ok": False, "error": "..."}
+        """
+        return self.commit_registrations(items, recipient_address,
+                                         self.verify_registrations(items))
 
-        coin_data = coin.to_dict()
-        coin_data["pk_current"] = pk_next
+    def verify_registrations(self, items: list[dict]) -> list[Exception | dict | None]:
+        """Check issuer trust and signatures for register_coins items without
+        writing anything. Returns one error (or None) per item, or the stored
+        confirmation for an item that was registered before."""
+        triples, owners = [], []
+        checks: list[Exception | dict | None] = []
+        for j, item in enumerate(items):
+            try:
+                replay = self._replayed(item["coin"].coin_id, item["pk_next"], item["transfer_signature"])
+                if replay is not None:
+                    checks.append(replay)
+                    continue
+                item_triples = self._registration_triples(
+                    item["coin"], item["pk_next"], item["transfer_signature"])
+            except (UntrustedIssuerError, KeyError, ValueError) as exc:
+                checks.append(exc)
+                continue
+            checks.append(None)
+            triples.extend(item_triples)
+            owners.extend([j] * len(item_triples))
+        for j, ok in zip(owners, self._check_signatures(triples)):
+            if not ok and checks[j] is None:
+                checks[j] = InvalidSignatureError("Ongeldige signature bij issuance")
+        return checks
 
-        self._conn.execute(
-            "INSERT INTO coins (coin_id, pk_current, coin_data) VALUES (?, ?, ?)",
-            (coin.coin_id, pk_next, json.dumps(coin_data)),
-        )
+    def commit_registrations(self, items: list[dict], recipient_address: str,
+                             checks: list[Exception | None]) -> list[dict]:
+        """Insert items already checked by verify_registrations in one SQLite
+        transaction. An item may carry a pre-signed "confirmation"."""
+        with self._write_lock:
+            results = []
+            registered = []
+            requests = []
+            try:
+                for item, check in zip(items, checks):
+                    coin = item["coin"]
+                    if isinstance(check, dict):
+                        results.append({"coin_id": coin.coin_id, "ok": True, "confirmation": check})
+                        continue
+                    try:
+                        if check is not None:
+                            raise check
+                        coin_data = self._apply_registration(
+                            coin, recipient_address, item["pk_next"], item["transfer_signature"])
+                        registered.append((recipient_address, coin_data, "issued",
+                                           item.get("confirmation")))
+                        requests.append((coin.coin_id, item["pk_next"], item["transfer_signature"]))
+                    except (UntrustedIssuerError, InvalidSignatureError,
+                            sqlite3.IntegrityError, KeyError, ValueError) as exc:
+                        results.append({"coin_id": coin.coin_id, "ok": False, "error": str(exc)})
+                        continue
+                    results.append({"coin_id": coin.coin_id, "ok": True})
+                if registered:
+                    self._remember_confirmed(requests, self._queue_confirmed(registered))
+                self._commit()
+            except Exception:
+                self._rollback()
+                raise
+            for _, coin_data, _, _ in registered:
+                self._cache_owner(coin_data)
+        return results
 
-        confirmation_payload = build_payload(coin.coin_id, pk_next, "issued")
-        confirmation_sig = sign(self._sk, confirmation_payload)
-        confirmation = {
-            "coin_id": coin.coin_id,
+    def sign_confirmation(self, coin_id: str, pk_next: str, status: str) -> dict:
+        """Engine-signed confirmation for coin_id now being owned by pk_next."""
+        confirmation_sig = sign(self._sk, build_payload(coin_id, pk_next, status))
+        return {
+            "coin_id": coin_id,
             "pk_next": pk_next,
-            "status": "issued",
+            "status": status,
             "engine_signature": confirmation_sig.hex(),
             "pk_engine": self.pk_hex,
         }
 
-        self._conn.execute(
-            "INSERT INTO pending_deliveries (recipient_address, coin_json, confirmation) VALUES (?, ?, ?)",
-            (recipient_address, json.dumps(coin_data), json.dumps(confirmation)),
-        )
-        self._conn.commit()
+    def _registration_triples(self, coin: Coin, pk_next: str,
+                              transfer_signature: str) -> list[tuple[bytes, bytes, bytes]]:
+        """(pk, payload, signature) checks for an issued coin: issuer signature
+        and the initial transfer signature."""
+        if coin.pk_issuer not in self._issuers:
+            raise UntrustedIssuerError(f"Issuer {coin.pk_issuer[:16]}... is niet vertrouwd")
+        return [
+            (bytes.fromhex(coin.pk_issuer), coin.signing_payload(),
+             bytes.fromhex(coin.issuer_signature)),
+            (bytes.fromhex(coin.pk_current), build_payload(coin.coin_id, pk_next),
+             bytes.fromhex(transfer_signature)),
+        ]
+
+    def _check_registration(self, coin: Coin, pk_next: str, transfer_signature: str):
+        issuer_key = self._issuers.get(coin.pk_issuer)
+        if issuer_key is None:
+            raise UntrustedIssuerError(f"Issuer {coin.pk_issuer[:16]}... is niet vertrouwd")
+
+        if self._verifier is not None:
+            triples = self._registration_triples(coin, pk_next, transfer_signature)
+            issuer_ok, transfer_ok = self._check_signatures(triples)
+        else:
+            issuer_ok = verify_with_key(issuer_key, coin.signing_payload(),
+                                        bytes.fromhex(coin.issuer_signature))
+            transfer_payload = build_payload(coin.coin_id, pk_next)
+            if coin.pk_current == coin.pk_issuer:
+                transfer_ok = verify_with_key(issuer_key, transfer_payload, bytes.fromhex(transfer_signature))
+            else:
+                transfer_ok = verify_hex(coin.pk_current, transfer_payload, transfer_signature)
+
+        if not issuer_ok:
+            raise InvalidSignatureError("Ongeldige issuer signature")
+        if not transfer_ok:
+            raise InvalidSignatureError("Ongeldige transfer signature bij issuance")
+
+    def _check_signatures(self, triples: list[tuple[bytes, bytes, bytes]]) -> list[bool]:
+        """Verify (pk, payload, signature) triples, in the process pool if configured."""
+        if self._verifier is None:
+            return [_verify_triple(t) for t in triples]
+        if len(triples) == 1:
+            return [self._verifier.verify(*triples[0])]
+        if len(triples) < self._verifier.batch_size:
+            futures = [self._verifier.submit(*t) for t in triples]
+            return [f.result() for f in futures]
+        return self._verifier.verify_batch(triples)
+
+    def _apply_registration(self, coin: Coin, recipient_address: str,
+                            pk_next: str, transfer_signature: str):
+        """Insert one issued coin whose signatures were already checked, without
+        committing. Returns the stored coin dict."""
+        if coin.pk_issuer not in self._issuers:
+            raise UntrustedIssuerError(f"Issuer {coin.pk_issuer[:16]}... is niet vertrouwd")
+
+        coin_data = coin.to_dict()
+        coin_data["pk_current"] = pk_next
+        self._insert_coin(coin, pk_next)
+        return coin_data
 
     def get_coin_state(self, coin_id: str) -> dict | None:
-        row = self._conn.execute(
-            "SELECT coin_id, pk_current FROM coins WHERE coin_id = ?",
-            (coin_id,),
+        cached = self._owners.get(coin_id)
+        if cached is not None:
+            return {"coin_id": coin_id, "pk_current": cached[0].hex()}
+        with self._pool.reader() as conn:
+            return self._coin_state(conn, coin_id)
+
+    def coin_owners(self, keys: list[bytes]) -> dict[bytes, bytes]:
+        """Current owner key per 16-byte coin key, for the keys that exist.
+        Served from the ownership cache and one read-pool query."""
+        owners, missing = {}, []
+        for key in keys:
+            cached = self._owners.get(str(uuid.UUID(bytes=key)))
+            if cached is not None:
+                owners[key] = cached[0]
+            else:
+                missing.append(key)
+        if missing:
+            placeholders = ",".join("?" * len(missing))
+            with self._pool.reader() as conn:
+                for row in conn.execute(
+                        f"SELECT coin_id, pk_current FROM coin_owner WHERE coin_id IN ({placeholders})",
+                        missing):
+                    owners[row["coin_id"]] = row["pk_current"]
+        return owners
+
+    def _cache_owner(self, coin_data: dict):
+        self._owners.put(coin_data["coin_id"], bytes.fromhex(coin_data["pk_current"]), coin_data)
+
+    def _load_coin(self, coin_id: str) -> tuple[bytes, bytes, dict]:
+        """Return (key, pk_current, coin dict) from the cache or the DB."""
+        try:
+            key = _id_blob(coin_id)
+        except ValueError:
+            raise UnknownCoinError(f"Coin {coin_id} niet gevonden")
+        cached = self._owners.get(coin_id)
+        if cached is not None:
+            return key, cached[0], dict(cached[1])
+        with self._pool.reader() as conn:
+            row = conn.execute(
+                f"SELECT {_COIN_COLUMNS} {_COIN_JOIN} WHERE o.coin_id = ?", (key,),
+            ).fetchone()
+        if row is None:
+            raise UnknownCoinError(f"Coin {coin_id} niet gevonden")
+        coin_data = _coin_dict(row)
+        # Only fill a miss: a commit that cached a newer owner meanwhile wins
+        self._owners.fill(coin_id, row["pk_current"], coin_data)
+        return key, row["pk_current"], coin_data
+
+    def _coin_state(self, conn, coin_id: str) -> dict | None:
+        try:
+            key = _id_blob(coin_id)
+        except ValueError:
+            return None
+        row = conn.execute(
+            "SELECT pk_current FROM coin_owner WHERE coin_id = ?", (key,),
         ).fetchone()
         if row is None:
             return None
-        return {"coin_id": row["coin_id"], "pk_current": row["pk_current"]}
+        return {"coin_id": coin_id, "pk_current": row["pk_current"].hex()}
 
-    def list_coins(self) -> list[dict]:
-        rows = self._conn.execute("SELECT coin_id, pk_current, coin_data FROM coins").fetchall()
+    def list_coins(self, limit: int = None, after: str = None, issuer: str = None,
+                   owner_prefix: str = None) -> list[dict]:
+        """Coins in coin_id order. With limit, one page of at most limit coins
+        after the coin_id cursor `after`; issuer is a pk_issuer hex and
+        owner_prefix a hex prefix of the current owner key."""
+        where, params = [], []
+        if after:
+            where.append("o.coin_id > ?")
+            params.append(_id_blob(after))
+        if issuer:
+            where.append("m.pk_issuer = ?")
+            params.append(bytes.fromhex(issuer))
+        if owner_prefix:
+            where.append("o.pk_current BETWEEN ? AND ?")
+            params += [bytes.fromhex(owner_prefix.ljust(64, "0")),
+                       bytes.fromhex(owner_prefix.ljust(64, "f"))]
+        sql = f"SELECT {_COIN_COLUMNS} {_COIN_JOIN}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY o.coin_id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._pool.reader() as conn:
+            rows = conn.execute(sql, params).fetchall()
         result = []
         for r in rows:
-            entry = {"coin_id": r["coin_id"], "pk_current": r["pk_current"]}
-            try:
-                entry["coin_data"] = json.loads(r["coin_data"])
-            except (json.JSONDecodeError, TypeError):
-                pass
-            result.append(entry)
+            coin_data = _coin_dict(r)
+            result.append({
+                "coin_id": coin_data["coin_id"],
+                "pk_current": coin_data["pk_current"],
+                "coin_data": coin_data,
+            })
         return result
 
+    def iter_coins(self, page_size: int = 500, **filters):
+        """Yield every coin matching the list_coins filters, one page at a time."""
+        after = filters.pop("after", None)
+        while True:
+            page = self.list_coins(limit=page_size, after=after, **filters)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1]["coin_id"]
+
+    def count_coins(self) -> int:
+        with self._pool.reader() as conn:
+            return conn.execute("SELECT COUNT(*) FROM coin_owner").fetchone()[0]
+
     def process_transaction(self, tx: dict) -> dict:
         """
-        tx must contain: coin_id, pk_next, recipient_address, signature (hex)
+        tx must contain: coin_id, pk_current, pk_next, recipient_address,
+        signature (hex)
         Returns signed confirmation dict.
         """
-        coin_id = tx["coin_id"]
-        pk_next = tx["pk_next"]
-        recipient_address = tx["recipient_address"]
-        sig_hex = tx["signature"]
+        replay = self._replayed(tx["coin_id"], tx["pk_next"], tx["signature"])
+        if replay is not None:
+            return replay
+        verified = self._verify_transaction(tx)
+        with self._write_lock:
+            try:
+                self._rotate_owner(verified)
+            except DoubleSpendError:
+                # A retry that overlapped the original: answer like a replay
+                replay = self._replayed(tx["coin_id"], tx["pk_next"], tx["signature"])
+                if replay is not None:
+                    return replay
+                raise
+            [confirmation] = self._queue_confirmed([
+                (verified["recipient_address"], verified["coin_data"], "confirmed",
+                 verified.get("confirmation")),
+            ])
+            self._remember_confirmed([(tx["coin_id"], tx["pk_next"], tx["signature"])], [confirmation])
+            self._commit()
+            self._cache_owner(verified["coin_data"])
+        return confirmation
 
-        state = self.get_coin_state(coin_id)
-        if state is None:
-            raise UnknownCoinError(f"Coin {coin_id} niet gevonden")
+    def process_transactions(self, txs: list[dict]) -> list[dict]:
+        """
+        Verify, rotate and confirm a batch of transactions in one SQLite
+        transaction. Each tx has the same fields as process_transaction.
+        Returns one result per tx, in order:
+            {"coin_id": ..., "ok": True, "confirmation": {...}}
+            {"coin_id": ..., "ok": False, "error": "..."}
+        """
+        return self.commit_transactions(txs, self.verify_transactions(txs))
 
-        pk_current_hex = state["pk_current"]
+    def verify_transactions(self, txs: list[dict]) -> list:
+        """Look up and signature-check a batch of transactions without writing.
+        Returns, per tx, either a prepared entry for commit_transactions or the
+        exception that rejects it."""
+        verified = []
+        for tx in txs:
+            try:
+                replay = self._replayed(tx["coin_id"], tx["pk_next"], tx["signature"])
+                if replay is not None:
+                    verified.append({"coin_id": tx["coin_id"], "replay": replay})
+                    continue
+                verified.append(self._prepare_transaction(tx))
+            except (UnknownCoinError, DoubleSpendError, KeyError, ValueError) as exc:
+                verified.append(exc)
+        pending = [j for j, v in enumerate(verified) if not isinstance(v, Exception) and "check" in v]
+        for j, ok in zip(pending, self._check_signatures([verified[j]["check"] for j in pending])):
+            if not ok:
+                self._owners.discard(verified[j]["coin_id"])
+                verified[j] = InvalidSignatureError("Ongeldige transactie signature")
+        return verified
 
-        payload = build_payload(coin_id, pk_next)
-        if not verify(bytes.fromhex(pk_current_hex), payload, bytes.fromhex(sig_hex)):
+    def commit_transactions(self, txs: list[dict], verified: list) -> list[dict]:
+        """Rotate owners for entries from verify_transactions in one SQLite
+        transaction. An entry may carry a pre-signed "confirmation"; a replayed
+        request is answered with its stored confirmation. That includes a
+        retry verified before its original committed, and a copy of a request
+        earlier in the same batch."""
+        results = []
+        rotated = []
+        # Replay key -> result of the first copy of that request in this batch
+        firsts: dict[bytes, dict] = {}
+        copies = []
+        with self._write_lock:
+            try:
+                for tx, v in zip(txs, verified):
+                    coin_id = tx.get("coin_id", "")
+                    if isinstance(v, Exception):
+                        results.append({"coin_id": coin_id, "ok": False, "error": str(v)})
+                        continue
+                    if "replay" in v:
+                        results.append({"coin_id": coin_id, "ok": True, "confirmation": v["replay"]})
+                        continue
+                    request = (tx["coin_id"], tx["pk_next"], tx["signature"])
+                    tx_key = _replay_key(*request)
+                    if tx_key in firsts:
+                        results.append({"coin_id": coin_id, "ok": True})
+                        copies.append((results[-1], firsts[tx_key]))
+                        continue
+                    try:
+                        self._rotate_owner(v)
+                    except DoubleSpendError as exc:
+                        replay = self._replayed(*request)
+                        if replay is not None:
+                            results.append({"coin_id": coin_id, "ok": True, "confirmation": replay})
+                        else:
+                            results.append({"coin_id": coin_id, "ok": False, "error": str(exc)})
+                        continue
+                    results.append({"coin_id": coin_id, "ok": True})
+                    rotated.append((results[-1], v, tx))
+                    firsts[tx_key] = results[-1]
+                if rotated:
+                    confirmations = self._queue_confirmed([
+                        (v["recipient_address"], v["coin_data"], "confirmed", v.get("confirmation"))
+                        for _, v, _ in rotated
+                    ])
+                    self._remember_confirmed(
+                        [(tx["coin_id"], tx["pk_next"], tx["signature"]) for _, _, tx in rotated],
+                        confirmations)
+                    for (result, _, _), confirmation in zip(rotated, confirmations):
+                        result["confirmation"] = confirmation
+                for result, first in copies:
+                    result["confirmation"] = first["confirmation"]
+                self._commit()
+            except Exception:
+                self._rollback()
+                for v in verified:
+                    if not isinstance(v, Exception):
+                        self._owners.discard(v["coin_id"])
+                raise
+            for _, v, _ in rotated:
+                self._cache_owner(v["coin_data"])
+        return results
+
+    def _verify_transaction(self, tx: dict) -> dict:
+        """Read the committed owner and check the transfer signature.
+
+        Runs without the write lock; _rotate_owner re-checks the owner
+        atomically, so a concurrent spend of the same coin cannot slip
+        between verification and commit.
+        """
+        v = self._prepare_transaction(tx)
+        if not self._check_signatures([v["check"]])[0]:
+            # The owner may have come from a stale cache entry; the next try reads the DB
+            self._owners.discard(tx["coin_id"])
             raise InvalidSignatureError("Ongeldige transactie signature")
+        return v
 
-        # Retrieve full coin data before updating
-        row = self._conn.execute(
-            "SELECT coin_data FROM coins WHERE coin_id = ?", (coin_id,)
-        ).fetchone()
-        coin_data = json.loads(row["coin_data"])
+    def _prepare_transaction(self, tx: dict) -> dict:
+        """Load the committed owner and build the signature check for tx."""
+        coin_id = tx["coin_id"]
+        pk_next = tx["pk_next"]
+        sig_hex = tx["signature"]
+        # The spender names the key it spends from, so a rotated-out key is
+        # rejected before the database and signature work
+        pk_claimed = tx.get("pk_current")
+        if not pk_claimed:
+            raise ValueError(f"Transactie voor coin {coin_id} mist pk_current")
+        if self._spent is not None:
+            self._check_not_spent(coin_id, pk_claimed)
+
+        key, pk_current, coin_data = self._load_coin(coin_id)
+        if pk_claimed != pk_current.hex():
+            # Re-read past the cache once, so a stale entry cannot block the real owner
+            self._owners.discard(coin_id)
+            key, pk_current, coin_data = self._load_coin(coin_id)
+        if pk_claimed != pk_current.hex():
+            raise DoubleSpendError(f"Coin {coin_id} is niet (meer) van deze sleutel")
         coin_data["pk_current"] = pk_next
+        return {
+            "coin_id": coin_id,
+            "key": key,
+            "pk_current": pk_current,
+            "pk_next": pk_next,
+            "recipient_address": tx["recipient_address"],
+            "coin_data": coin_data,
+            "check": (pk_current, build_payload(coin_id, pk_next), bytes.fromhex(sig_hex)),
+        }
 
-        self._conn.execute(
-            "UPDATE coins SET pk_current = ?, coin_data = ? WHERE coin_id = ?",
-            (pk_next, json.dumps(coin_data), coin_id),
+    def _rotate_owner(self, v: dict):
+        """Compare-and-swap the owner key; caller holds the write lock."""
+        coin_id = v["coin_id"]
+        pk_next = v["pk_next"]
+
+        cur = self._conn.execute(
+            "UPDATE coin_owner SET pk_current = ? WHERE coin_id = ? AND pk_current = ?",
+            (bytes.fromhex(pk_next), v["key"], v["pk_current"]),
         )
+        if cur.rowcount != 1:
+            self._owners.discard(coin_id)
+            raise DoubleSpendError(f"Coin {coin_id} is al uitgegeven")
+        if self._spent is not None:
+            self._spent_pending.append(v["key"] + v["pk_current"])
+        self._ledger_add(bytes.fromhex(v["coin_data"]["pk_issuer"]), transfers=1)
+        if self._journal is not None:
+            self._journal_event(TRANSFER, (v["key"], v["pk_current"], bytes.fromhex(pk_next)))
+
+    def reissue_replay(self, request: dict) -> list[dict] | None:
+        """The stored confirmations of a split/merge that was already done."""
+        inputs = request["inputs"]
+        digest = reissue_digest([i["coin_id"] for i in inputs], request["outputs"])
+        replay = self._replayed(inputs[0]["coin_id"], digest, inputs[0]["signature"])
+        return None if replay is None else replay["outputs"]
+
+    def process_reissue(self, request: dict, accept_id=None, held: dict = None) -> list[dict]:
+        """
+        Split or merge coins: retire every input coin and create the output
+        coins in one SQLite transaction. request contains:
+            inputs:  [{"coin_id", "signature"}]
+            outputs: [{"waarde", "pk_owner", "recipient_address"}]
+            recipient_address: default for outputs without one
+        Each input is signed by its current owner over
+        build_payload("reissue", coin_id, reissue_digest(input ids, outputs)).
+        Inputs must share one issuer; outputs keep that issuer, carry the
+        engine's signature over Coin.derived_payload() and add up to the
+        same value. Returns one confirmation per output, in order.
+
+        held maps inputs that another shard already retired with
+        hold_reissue_inputs() to their coin data; their signatures were
+        checked there.
+        """
+        inputs, outputs = request["inputs"], request["outputs"]
+        if not 1 <= len(inputs) <= REISSUE_MAX or not 1 <= len(outputs) <= REISSUE_MAX:
+            raise ValueError(f"Split/merge heeft 1 tot {REISSUE_MAX} inputs en outputs")
+        input_ids = [i["coin_id"] for i in inputs]
+        if len(set(input_ids)) != len(input_ids):
+            raise ValueError("Coin komt dubbel voor in de inputs")
+        for o in outputs:
+            if type(o["waarde"]) is not int or o["waarde"] <= 0:
+                raise ValueError(f"Ongeldige waarde {o['waarde']!r}")
+            try:
+                verify_key_hex(o["pk_owner"])
+            except (ValueError, TypeError):
+                raise ValueError(f"Ongeldige pk_owner {str(o['pk_owner'])[:16]!r}")
+        digest = reissue_digest(input_ids, outputs)
+        replay = self.reissue_replay(request)
+        if replay is not None:
+            return replay
+
+        held = held or {}
+        loaded = [(None, None, held[coin_id]) if coin_id in held else self._load_coin(coin_id)
+                  for coin_id in input_ids]
+        local = [(entry, coin_id, i) for entry, coin_id, i in zip(loaded, input_ids, inputs)
+                 if coin_id not in held]
+        first = loaded[0][2]
+        for _, _, coin_data in loaded:
+            if (coin_data["pk_issuer"], coin_data["state_engine_endpoint"]) != \
+                    (first["pk_issuer"], first["state_engine_endpoint"]):
+                raise ValueError("Inputs van een split/merge moeten dezelfde issuer hebben")
+        if first["pk_issuer"] not in self._issuers:
+            raise UntrustedIssuerError(f"Issuer {first['pk_issuer'][:16]}... is niet vertrouwd")
+        if sum(c["waarde"] for _, _, c in loaded) != sum(o["waarde"] for o in outputs):
+            raise ValueError("Waarde van de outputs is niet gelijk aan die van de inputs")
+        triples = [(pk_current, build_payload("reissue", coin_id, digest), bytes.fromhex(i["signature"]))
+                   for (_, pk_current, _), coin_id, i in local]
+        if not all(self._check_signatures(triples)):
+            raise InvalidSignatureError("Ongeldige signature op split/merge input")
+
+        created = []
+        for index, o in enumerate(outputs):
+            coin = Coin(
+                coin_id=_derived_coin_id(digest, index, accept_id),
+                waarde=o["waarde"],
+                pk_current=o["pk_owner"],
+                pk_issuer=first["pk_issuer"],
+                issuer_signature="",
+                state_engine_endpoint=first["state_engine_endpoint"],
+                pk_engine=self.pk_hex,
+            )
+            coin.issuer_signature = sign(self._sk, coin.derived_payload()).hex()
+            created.append((o.get("recipient_address") or request["recipient_address"], coin))
+
+        with self._write_lock:
+            try:
+                for (key, pk_current, coin_data), coin_id, _ in local:
+                    self._retire_coin(coin_id, key, pk_current, coin_data)
+                for _, coin in created:
+                    self._insert_coin(coin, coin.pk_current)
+                confirmations = self._queue_confirmed(
+                    [(recipient, coin.to_dict(), "reissued", None) for recipient, coin in created])
+                self._remember_confirmed([(input_ids[0], digest, inputs[0]["signature"])],
+                                         [{"outputs": confirmations}])
+                self._commit()
+            except Exception:
+                self._rollback()
+                raise
+            for coin_id in input_ids:
+                self._owners.discard(coin_id)
+            for _, coin in created:
+                self._cache_owner(coin.to_dict())
+        return confirmations
+
+    def hold_reissue_inputs(self, request: dict, coin_ids: list[str]) -> dict[str, dict]:
+        """First step of a split/merge whose inputs span shards, on a shard
+        that does not create the outputs: check and retire this shard's
+        inputs (coin_ids) and keep them in reissue_holds until
+        release_reissue_holds(). Returns their coin data."""
+        inputs = request["inputs"]
+        input_ids = [i["coin_id"] for i in inputs]
+        digest = reissue_digest(input_ids, request["outputs"])
+        signatures = {i["coin_id"]: i["signature"] for i in inputs}
+        loaded = [self._load_coin(coin_id) for coin_id in coin_ids]
+        triples = [(pk_current, build_payload("reissue", coin_id, digest), bytes.fromhex(signatures[coin_id]))
+                   for (_, pk_current, _), coin_id in zip(loaded, coin_ids)]
+        if not all(self._check_signatures(triples)):
+            raise InvalidSignatureError("Ongeldige signature op split/merge input")
 
-        confirmation_payload = build_payload(coin_id, pk_next, "confirmed")
-        confirmation_sig = sign(self._sk, confirmation_payload)
-        confirmation = {
+        request_key = _replay_key(input_ids[0], digest, inputs[0]["signature"])
+        now = time.time()
+        with self._write_lock:
+            try:
+                for coin_id, (key, pk_current, coin_data) in zip(coin_ids, loaded):
+                    # Not spent yet: the owner gets the coin back if the outputs are never made
+                    self._retire_coin(coin_id, key, pk_current, coin_data, spent=False)
+                    self._conn.execute(
+                        "INSERT INTO reissue_holds (coin_id, request_key, pk_current, coin_json, created_at) "
+                        "VALUES (?, ?, ?, ?, ?)", (key, request_key, pk_current, json.dumps(coin_data), now))
+                self._commit()
+            except Exception:
+                self._rollback()
+                raise
+            for coin_id in coin_ids:
+                self._owners.discard(coin_id)
+        return {coin_id: coin_data for coin_id, (_, _, coin_data) in zip(coin_ids, loaded)}
+
+    def release_reissue_holds(self, request_key: bytes, restore: bool) -> int:
+        """Last step of a cross-shard split/merge: forget the held inputs
+        once the outputs exist, or put them back with their owner when the
+        split/merge failed. Returns how many coins were held."""
+        with self._write_lock:
+            rows = self._conn.execute(
+                "SELECT coin_id, pk_current, coin_json FROM reissue_holds WHERE request_key = ?",
+                (request_key,)).fetchall()
+            try:
+                for row in rows:
+                    if restore:
+                        self._insert_coin(Coin.from_dict(json.loads(row["coin_json"])), row["pk_current"].hex())
+                    elif self._spent is not None:
+                        self._spent_pending.append(row["coin_id"] + row["pk_current"])
+                self._conn.execute("DELETE FROM reissue_holds WHERE request_key = ?", (request_key,))
+                self._commit()
+            except Exception:
+                self._rollback()
+                raise
+        return len(rows)
+
+    def reissue_holds(self) -> list[bytes]:
+        """Request keys of the cross-shard split/merges with held inputs."""
+        with self._pool.reader() as conn:
+            return [r["request_key"] for r in
+                    conn.execute("SELECT DISTINCT request_key FROM reissue_holds").fetchall()]
+
+    def has_confirmed(self, request_key: bytes) -> bool:
+        with self._pool.reader() as conn:
+            return conn.execute("SELECT 1 FROM confirmed_requests WHERE request_key = ?",
+                                (request_key,)).fetchone() is not None
+
+    def _retire_coin(self, coin_id: str, key: bytes, pk_current: bytes, coin_data: dict,
+                     spent: bool = True):
+        """Delete a coin if pk_current still owns it; caller holds the write lock."""
+        cur = self._conn.execute("DELETE FROM coin_owner WHERE coin_id = ? AND pk_current = ?",
+                                 (key, pk_current))
+        if cur.rowcount != 1:
+            self._owners.discard(coin_id)
+            raise DoubleSpendError(f"Coin {coin_id} is al uitgegeven")
+        self._conn.execute("DELETE FROM coin_meta WHERE coin_id = ?", (key,))
+        if spent and self._spent is not None:
+            self._spent_pending.append(key + pk_current)
+        self._ledger_add(bytes.fromhex(coin_data["pk_issuer"]), coins=-1, value=-coin_data["waarde"])
+        if self._journal is not None:
+            self._journal_event(RETIRE, (key, pk_current))
+
+    def _queue_confirmed(self, entries: list[tuple[str, dict, str, dict | None]]) -> list[dict]:
+        """Confirm and queue deliveries for coins written in the current
+        transaction. Each entry is (recipient_address, coin_data, status,
+        pre-signed confirmation or None). In Merkle mode the whole list
+        shares one signed root and pre-signed confirmations are ignored."""
+        if self.merkle_confirmations:
+            confirmations = self._merkle_confirmations(
+                [(coin_data["coin_id"], coin_data["pk_current"], status)
+                 for _, coin_data, status, _ in entries])
+        else:
+            confirmations = [
+                presigned or self.sign_confirmation(coin_data["coin_id"], coin_data["pk_current"], status)
+                for _, coin_data, status, presigned in entries
+            ]
+        for (recipient_address, coin_data, _, _), confirmation in zip(entries, confirmations):
+            self._queue_delivery(recipient_address, coin_data, confirmation)
+        return confirmations
+
+    def _merkle_confirmations(self, confirmed: list[tuple[str, str, str]]) -> list[dict]:
+        """One engine signature over the Merkle root of all (coin_id, pk_next,
+        status) leaves; every confirmation carries its own inclusion path."""
+        root, paths = merkle_tree([build_payload(*c) for c in confirmed])
+        root_sig = sign(self._sk, build_payload("merkle", root.hex())).hex()
+        return [{
             "coin_id": coin_id,
             "pk_next": pk_next,
-            "status": "confirmed",
-            "engine_signature": confirmation_sig.hex(),
+            "status": status,
+            "merkle_root": root.hex(),
+            "merkle_path": path,
+            "engine_signature": root_sig,
             "pk_engine": self.pk_hex,
-        }
+        } for (coin_id, pk_next, status), path in zip(confirmed, paths)]
 
+    def _queue_delivery(self, recipient_address: str, coin_data: dict, confirmation: dict):
         self._conn.execute(
-            "INSERT INTO pending_deliveries (recipient_address, coin_json, confirmation) VALUES (?, ?, ?)",
-            (recipient_address, json.dumps(coin_data), json.dumps(confirmation)),
+            "INSERT INTO pending_deliveries (recipient_address, coin_json, confirmation, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (recipient_address, json.dumps(coin_data), json.dumps(confirmation), time.time()),
         )
-        self._conn.commit()
-
-        return confirmation
 
     def get_pending_deliveries(self, wallet_address: str) -> list[dict]:
-        rows = self._conn.execute(
-            "SELECT id, coin_json, confirmation FROM pending_deliveries WHERE recipient_address = ? AND delivered = 0",
-            (wallet_address,),
-        ).fetchall()
+        with self._write_lock:
+            rows = self._conn.execute(
+                "SELECT id, coin_json, confirmation FROM pending_deliveries WHERE recipient_address = ? AND delivered = 0",
+                (wallet_address,),
+            ).fetchall()
 
-        results = []
-        ids = []
-        for row in rows:
-            results.append({
-                "coin": json.loads(row["coin_json"]),
-                "confirmation": json.loads(row["confirmation"]),
-            })
-            ids.append(row["id"])
+            results = []
+            ids = []
+            for row in rows:
+                results.append({
+                    "coin": json.loads(row["coin_json"]),
+                    "confirmation": json.loads(row["confirmation"]),
+                })
+                ids.append(row["id"])
 
-        if ids:
-            placeholders = ",".join("?" * len(ids))
-            self._conn.execute(
-                f"UPDATE pending_deliveries SET delivered = 1 WHERE id IN ({placeholders})",
-                ids,
+            if ids:
+                placeholders = ",".join("?" * len(ids))
+                self._conn.execute(
+                    f"UPDATE pending_deliveries SET delivered = 1, delivered_at = ? WHERE id IN ({placeholders})",
+                    [time.time(), *ids],
+                )
+                self._commit()
+
+            return results
+
+    def compact_deliveries(self, retention_s: float = None) -> int:
+        """Delete delivered rows older than the retention period. Returns row count."""
+        if retention_s is None:
+            retention_s = self.delivery_retention_s
+        cutoff = time.time() - retention_s
+        with self._write_lock:
+            cur = self._conn.execute(
+                "DELETE FROM pending_deliveries WHERE delivered = 1 AND delivered_at < ?",
+                (cutoff,),
             )
-            self._conn.commit()
+            self._conn.execute("DELETE FROM confirmed_requests WHERE created_at < ?", (cutoff,))
+            self._commit()
+        return cur.rowcount
 
-        return results
+    def delivery_queue_stats(self) -> dict:
+        with self._pool.reader() as conn:
+            pending = conn.execute(
+                "SELECT COUNT(*) AS n, COUNT(DISTINCT recipient_address) AS recipients, "
+                "MIN(created_at) AS oldest FROM pending_deliveries WHERE delivered = 0"
+            ).fetchone()
+            retained = conn.execute(
+                "SELECT COUNT(*) AS n FROM pending_deliveries WHERE delivered = 1"
+            ).fetchone()
+        oldest = pending["oldest"]
+        return {
+            "pending": pending["n"],
+            "recipients_waiting": pending["recipients"],
+            "oldest_pending_age_s": round(time.time() - oldest, 1) if oldest else None,
+            "delivered_retained": retained["n"],
+            "retention_s": self.delivery_retention_s,
+        }
 
     def save_key(self, path: str):
         Path(path).write_text(sk_to_hex(self._sk))
 
     @classmethod
-    def load_key(cls, path: str, db_path: str = ":memory:") -> "StateEngine":
+    def load_key(cls, path: str, db_path: str = ":memory:", **kwargs) -> "StateEngine":
         hex_str = Path(path).read_text().strip()
         sk = sk_from_hex(hex_str)
-        return cls(db_path=db_path, sk=sk)
+        return cls(db_path=db_path, sk=sk, **kwargs)
@@ -0,0 +1,348 @@
+"""
+Staged asyncio pipeline for the state engine's coin messages.
+
+register_coin(_batch) and transaction(_batch) messages go through a chain of
+stages connected by bounded asyncio queues:
+
+    ingest -> decode -> verify -> sign -> commit -> deliver
+
+submit() is the ingest step: it refuses a message when the decode queue is
+full, or with wait_s waits for room. The actor's ingress workers wait, so
+the backlog builds up in the priority-ordered ingress queue in front of it. Every
+stage has its own number of workers, and the blocking engine and transport
+calls run on a thread pool. A full downstream queue makes the stage in front
+of it wait, so backpressure travels back to ingest.
+
+Confirmations are signed before the commit, not after: the signed payload
+does not depend on the commit, and the pending_deliveries row has to carry
+the confirmation in the same SQLite transaction. The commit stage has a
+single worker that commits all transaction messages waiting in its queue in
+one SQLite transaction. With Merkle confirmations the sign stage passes
+jobs through, since the engine signs one root per commit. The commit stage
+hands the recipients of committed coins to the DeliveryCoalescer, which
+sends their deliveries; the deliver stage sends the replies to the sender.
+This is the engine's only path for these messages.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.coin import Coin
+
+STAGES = ("decode", "verify", "sign", "commit", "deliver")
+MESSAGE_TYPES = ("register_coin", "register_coin_batch", "transaction", "transaction_batch")
+
+
+class EnginePipeline:
+    def __init__(self, engine, send, coalescer, notify=None, queue_size: int = 256,
+                 verify_workers: int = 4, sign_workers: int = 2,
+                 deliver_workers: int = 8, commit_batch: int = 64):
+        """
+        engine: StateEngine or ShardedStateEngine.
+        send(dest_hash, role, msg_type, payload): blocking transport send.
+        coalescer: DeliveryCoalescer that sends the recipient deliveries.
+        notify(event_dict): local UI notification, optional.
+        """
+        self._engine = engine
+        self._coalescer = coalescer
+        self._send = send
+        self._notify = notify or (lambda event: None)
+        self.queue_size = queue_size
+        self.commit_batch = max(1, commit_batch)
+        self._workers = {
+            "decode": 1,
+            "verify": max(1, verify_workers),
+            "sign": max(1, sign_workers),
+            "commit": 1,
+            "deliver": max(1, deliver_workers),
+        }
+        self._executor = ThreadPoolExecutor(
+            max_workers=sum(self._workers.values()), thread_name_prefix="engine-pipeline",
+        )
+        self._stats = {name: {"processed": 0, "errors": 0, "busy": 0} for name in STAGES}
+        self._ingest = {"accepted": 0, "rejected": 0}
+
+        self._loop = asyncio.new_event_loop()
+        self._queues: dict[str, asyncio.Queue] = {}
+        self._tasks = []
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait()
+        self._closed = False
+
+    # ── public API ──────────────────────────────────────────
+
+    def submit(self, msg_type: str, payload: dict, from_hash: str, from_role: str,
+               on_done=None, wait_s: float = 0) -> bool:
+        """Queue one message. Returns False when the pipeline is full or closed.
+        With wait_s the caller waits up to that long for room instead.
+        on_done() is called once the message is committed or dropped."""
+        if self._closed or msg_type not in MESSAGE_TYPES:
+            return False
+        message = {"msg_type": msg_type, "payload": payload,
+                   "from_hash": from_hash, "from_role": from_role, "on_done": on_done}
+        future = asyncio.run_coroutine_threadsafe(self._offer(message, wait_s), self._loop)
+        try:
+            return future.result(wait_s + 1 if wait_s else None)
+        except TimeoutError:
+            # The loop stopped (shutdown) while we waited for room
+            future.cancel()
+            return False
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Block until every submitted message went through all stages."""
+        future = asyncio.run_coroutine_threadsafe(self._join_all(), self._loop)
+        try:
+            future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return asyncio.run_coroutine_threadsafe(self._snapshot(), self._loop).result()
+
+    def shutdown(self):
+        """Stop all stages. Messages still in the queues are dropped."""
+        if self._closed:
+            return
+        self._closed = True
+        asyncio.run_coroutine_threadsafe(self._cancel_workers(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown(wait=True)
+
+    # ── event loop ──────────────────────────────────────────
+
+    def _run_loop(self, ready: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        handlers = {
+            "decode": self._decode,
+            "verify": self._verify,
+            "sign": self._sign,
+            "commit": self._commit,
+            "deliver": self._deliver,
+        }
+        for name in STAGES:
+            self._queues[name] = asyncio.Queue(maxsize=self.queue_size)
+        for i, name in enumerate(STAGES):
+            next_name = STAGES[i + 1] if i + 1 < len(STAGES) else None
+            batch = self.commit_batch if name == "commit" else 1
+            for _ in range(self._workers[name]):
+                self._tasks.append(self._loop.create_task(
+                    self._stage_worker(name, handlers[name], next_name, batch)))
+        ready.set()
+        self._loop.run_forever()
+
+    async def _offer(self, message: dict, wait_s: float = 0) -> bool:
+        try:
+            if wait_s:
+                await asyncio.wait_for(self._queues["decode"].put(message), wait_s)
+            else:
+                self._queues["decode"].put_nowait(message)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self._ingest["rejected"] += 1
+            return False
+        self._ingest["accepted"] += 1
+        return True
+
+    async def _stage_worker(self, name: str, handler, next_name: str | None, batch: int):
+        q = self._queues[name]
+        stats = self._stats[name]
+        while True:
+            jobs = [await q.get()]
+            while len(jobs) < batch and not q.empty():
+                jobs.append(q.get_nowait())
+            stats["busy"] += 1
+            try:
+                out = await handler(jobs if batch > 1 else jobs[0])
+                stats["processed"] += len(jobs)
+            except Exception as exc:
+                stats["errors"] += len(jobs)
+                print(f"[PIPELINE] {name} MISLUKT: {exc}", flush=True)
+                out = None
+            # Jobs that end in this stage (committed, rejected or failed) are done
+            passed_on = {id(item.get("on_done")) for item in out or ()}
+            for job in jobs:
+                if job.get("on_done") is not None and id(job["on_done"]) not in passed_on:
+                    self._call_done(job["on_done"])
+            try:
+                for item in out or ():
+                    await self._queues[next_name].put(item)
+            finally:
+                stats["busy"] -= 1
+                for _ in jobs:
+                    q.task_done()
+
+    @staticmethod
+    def _call_done(on_done):
+        try:
+            on_done()
+        except Exception as exc:
+            print(f"[PIPELINE] on_done MISLUKT: {exc}", flush=True)
+
+    async def _blocking(self, fn, *args):
+        return await self._loop.run_in_executor(self._executor, fn, *args)
+
+    async def _join_all(self):
+        for name in STAGES:
+            await self._queues[name].join()
+
+    async def _snapshot(self) -> dict:
+        return {
+            "ingest": dict(self._ingest),
+            "stages": {
+                name: {
+                    "workers": self._workers[name],
+                    "queue_depth": self._queues[name].qsize(),
+                    "queue_max": self.queue_size,
+                    **self._stats[name],
+                }
+                for name in STAGES
+            },
+        }
+
+    async def _cancel_workers(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    # ── stages ──────────────────────────────────────────────
+
+    async def _decode(self, message: dict) -> list[dict]:
+        payload = message["payload"]
+        msg_type = message["msg_type"]
+        job = {
+            "msg_type": msg_type,
+            "from_hash": message["from_hash"],
+            "from_role": message["from_role"],
+            "description": payload.get("description"),
+            "on_done": message["on_done"],
+        }
+        if msg_type in ("register_coin", "register_coin_batch"):
+            entries = payload.get("coins", []) if msg_type == "register_coin_batch" else [payload]
+            job["kind"] = "registration"
+            job["recipient"] = payload.get("recipient_dest", "")
+            job["items"] = [{
+                "coin": Coin.from_dict(entry["coin"]),
+                "pk_next": entry["pk_next"],
+                "transfer_signature": entry["transfer_signature"],
+            } for entry in entries
+                if entry.get("coin") and entry.get("pk_next") and entry.get("transfer_signature")]
+            if not job["recipient"]:
+                job["items"] = []
+        else:
+            entries = payload.get("transactions", []) if msg_type == "transaction_batch" else [payload]
+            job["kind"] = "transaction"
+            job["items"] = [{
+                "coin_id": t.get("coin_id", ""),
+                "pk_current": t.get("pk_current"),
+                "pk_next": t.get("pk_next", ""),
+                "recipient_address": t.get("recipient_dest", ""),
+                "signature": t.get("signature", ""),
+            } for t in entries if t.get("coin_id")]
+        if not job["items"]:
+            print(f"[PIPELINE] {msg_type} van {message['from_hash'][:16]} AFGEBROKEN - ontbrekende data",
+                  flush=True)
+            return []
+        return [job]
+
+    async def _verify(self, job: dict) -> list[dict]:
+        if job["kind"] == "registration":
+            job["checks"] = await self._blocking(self._engine.verify_registrations, job["items"])
+        else:
+            job["checks"] = await self._blocking(self._engine.verify_transactions, job["items"])
+        return [job]
+
+    async def _sign(self, job: dict) -> list[dict]:
+        await self._blocking(self._sign_job, job)
+        return [job]
+
+    def _sign_job(self, job: dict):
+        e = self._engine
+        if e.merkle_confirmations:
+            # One root signature per commit, made by the engine itself
+            return
+        if job["kind"] == "registration":
+            for item, check in zip(job["items"], job["checks"]):
+                if check is None:
+                    item["confirmation"] = e.sign_confirmation(
+                        item["coin"].coin_id, item["pk_next"], "issued")
+        else:
+            for v in job["checks"]:
+                if not isinstance(v, Exception) and "replay" not in v:
+                    v["confirmation"] = e.sign_confirmation(v["coin_id"], v["pk_next"], "confirmed")
+
+    async def _commit(self, jobs: list[dict]) -> list[dict]:
+        await self._blocking(self._commit_jobs, jobs)
+        out = []
+        for job in jobs:
+            out.extend(self._after_commit(job))
+        return out
+
+    def _commit_jobs(self, jobs: list[dict]):
+        e = self._engine
+        tx_jobs = [j for j in jobs if j["kind"] == "transaction"]
+        for job in jobs:
+            if job["kind"] == "registration":
+                job["results"] = e.commit_registrations(job["items"], job["recipient"], job["checks"])
+        if tx_jobs:
+            txs = [tx for j in tx_jobs for tx in j["items"]]
+            results = e.commit_transactions(txs, [v for j in tx_jobs for v in j["checks"]])
+            start = 0
+            for job in tx_jobs:
+                job["results"] = results[start:start + len(job["items"])]
+                start += len(job["items"])
+
+    def _after_commit(self, job: dict) -> list[dict]:
+        """Notify locally, schedule the recipients' deliveries and return
+        the replies to the sender."""
+        results = job["results"]
+        ok = [r["coin_id"] for r in results if r["ok"]]
+        for r in results:
+            if not r["ok"]:
+                print(f"[PIPELINE] {job['msg_type']} MISLUKT voor {r['coin_id'][:16]}: {r['error']}",
+                      flush=True)
+
+        out = []
+        if job["kind"] == "registration":
+            for coin_id in ok:
+                self._notify({"type": "coin_registered", "coin_id": coin_id})
+            coins_for = {job["recipient"]: ok} if ok else {}
+        else:
+            for coin_id in ok:
+                self._notify({"type": "transaction", "coin_id": coin_id})
+            if job["msg_type"] == "transaction_batch":
+                out.append({"dest": job["from_hash"], "role": job["from_role"],
+                            "msg_type": "tx_batch_confirmed", "payload": {"results": [
+                                {"coin_id": r["coin_id"],
+                                 "status": "confirmed" if r["ok"] else "rejected"}
+                                for r in results]}})
+            else:
+                # A rejection is answered too: the wallet holds the coin until it hears back
+                out.append({"dest": job["from_hash"], "role": job["from_role"],
+                            "msg_type": "tx_confirmed",
+                            "payload": {"coin_id": results[0]["coin_id"],
+                                        "status": "confirmed" if ok else "rejected"}})
+            coins_for = {}
+            for tx, r in zip(job["items"], results):
+                if r["ok"] and tx["recipient_address"]:
+                    coins_for.setdefault(tx["recipient_address"], []).append(r["coin_id"])
+
+        for recipient in sorted(coins_for):
+            self._coalescer.schedule(recipient, coins_for[recipient],
+                                     job["description"], job["from_hash"])
+        return out
+
+    async def _deliver(self, item: dict) -> list:
+        await self._blocking(self._deliver_item, item)
+        return []
+
+    def _deliver_item(self, item: dict):
+        try:
+            self._send(item["dest"], item["role"], item["msg_type"], item["payload"])
+        except Exception as exc:
+            print(f"[PIPELINE] {item['msg_type']} MISLUKT: {exc}", flush=True)
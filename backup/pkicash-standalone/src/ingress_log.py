@@ -0,0 +1,195 @@
+"""
+Durable log of incoming transport messages.
+
+The transport appends every received message to the current segment file
+(ingress-<first seq>.log) and returns to RNS right away. A consumer thread
+hands the logged messages to the message handlers in order. Whoever finishes
+a message calls ack(seq); the checkpoint file holds the highest seq up to
+which every message was acknowledged. On restart the messages after the
+checkpoint are handed out again, so a message is processed at least once.
+The engine recognises a repeated transaction or registration by its
+signature and answers it from its confirmation cache.
+
+Record framing: u32 body length, u32 CRC-32 of the body, body. A body is
+seq (u64) followed by the raw message bytes. A torn record at the end of
+the last segment is cut off when the log is opened. Segments that lie
+completely before the checkpoint are deleted.
+"""
+
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from pathlib import Path
+
+_MAGIC = b"PKI1"
+_FRAME = struct.Struct(">II")
+_SEQ = struct.Struct(">Q")
+CHECKPOINT_INTERVAL_S = 0.2
+
+
+def _scan(data: bytes, pos: int):
+    """Yield (end offset, seq, message bytes) for every intact record from pos."""
+    view = memoryview(data)
+    while pos + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(data, pos)
+        start = pos + _FRAME.size
+        end = start + length
+        if length < _SEQ.size or end > len(data) or zlib.crc32(view[start:end]) != crc:
+            return
+        yield end, _SEQ.unpack_from(data, start)[0], bytes(view[start + _SEQ.size:end])
+        pos = end
+
+
+class IngressLog:
+    def __init__(self, log_dir: str, fsync: bool = False, segment_bytes: int = 4 * 1024 * 1024):
+        self.dir = Path(log_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.segment_bytes = segment_bytes
+        self._checkpoint_path = self.dir / "checkpoint"
+        self.checkpoint = int(self._checkpoint_path.read_text() or 0) if self._checkpoint_path.exists() else 0
+        self._done = self.checkpoint
+        self._acked: set[int] = set()
+        self._checkpoint_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._pending: deque[tuple[int, bytes]] = deque()
+        self._thread = None
+        self._closed = False
+        self._stats = {"appended": 0, "replayed": 0}
+
+        self.seq = self.checkpoint
+        for path in self._segments():
+            data = self._repair(path)
+            for _, seq, message in _scan(data, len(_MAGIC)):
+                self.seq = seq
+                if seq > self.checkpoint:
+                    self._pending.append((seq, message))
+        self._stats["replayed"] = len(self._pending)
+        if self._pending:
+            print(f"[INGRESS] {len(self._pending)} berichten na checkpoint {self.checkpoint} opnieuw aangeboden",
+                  flush=True)
+        self._open_segment(self.seq + 1)
+
+    def _segments(self) -> list[Path]:
+        return sorted(self.dir.glob("ingress-*.log"))
+
+    def _repair(self, path: Path) -> bytes:
+        data = path.read_bytes()
+        if data[:len(_MAGIC)] != _MAGIC:
+            print(f"[INGRESS] {path.name} is geen ingress segment, overgeslagen", flush=True)
+            return _MAGIC
+        good = len(_MAGIC)
+        for end, _, _ in _scan(data, good):
+            good = end
+        if good < len(data):
+            print(f"[INGRESS] {len(data) - good} bytes onvolledige staart afgekapt in {path.name}", flush=True)
+            with open(path, "r+b") as f:
+                f.truncate(good)
+        return data[:good]
+
+    def _open_segment(self, first_seq: int):
+        self._segment = self.dir / f"ingress-{first_seq:020d}.log"
+        self._file = open(self._segment, "ab")
+        if self._file.tell() == 0:
+            self._file.write(_MAGIC)
+            self._file.flush()
+
+    def append(self, message: bytes) -> int:
+        """Write one message to the log and queue it for the consumer. Returns its seq."""
+        with self._cond:
+            if self._closed:
+                raise ValueError("Ingress log is gesloten")
+            seq = self.seq + 1
+            body = _SEQ.pack(seq) + message
+            self._file.write(_FRAME.pack(len(body), zlib.crc32(body)) + body)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.seq = seq
+            self._stats["appended"] += 1
+            self._pending.append((seq, message))
+            self._cond.notify()
+            if self._file.tell() >= self.segment_bytes:
+                self._file.close()
+                self._open_segment(seq + 1)
+        return seq
+
+    def start(self, handler):
+        """Run handler(seq, message) for every logged message on a consumer thread."""
+        self._thread = threading.Thread(target=self._consume, args=(handler,), daemon=True,
+                                        name="ingress-consumer")
+        self._thread.start()
+
+    def _consume(self, handler):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                seq, message = self._pending.popleft()
+            try:
+                handler(seq, message)
+            except Exception as exc:
+                print(f"[INGRESS] bericht {seq} MISLUKT: {exc}", flush=True)
+                self.ack(seq)
+
+    def ack(self, seq: int):
+        """Mark message seq as finished; moves the checkpoint when possible."""
+        with self._lock:
+            if seq <= self._done:
+                return
+            self._acked.add(seq)
+            while self._done + 1 in self._acked:
+                self._done += 1
+                self._acked.discard(self._done)
+            if time.monotonic() - self._checkpoint_at >= CHECKPOINT_INTERVAL_S:
+                self._write_checkpoint()
+
+    def _write_checkpoint(self):
+        if self._done == self.checkpoint:
+            return
+        tmp = self._checkpoint_path.with_suffix(".tmp")
+        tmp.write_text(str(self._done))
+        os.replace(tmp, self._checkpoint_path)
+        self.checkpoint = self._done
+        self._checkpoint_at = time.monotonic()
+        # A segment is obsolete once the next one starts at or before the checkpoint
+        segments = self._segments()
+        for path, following in zip(segments, segments[1:]):
+            if int(following.stem.split("-")[1]) - 1 > self.checkpoint:
+                break
+            path.unlink(missing_ok=True)
+
+    def flush_checkpoint(self):
+        with self._lock:
+            self._write_checkpoint()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "seq": self.seq,
+                "checkpoint": self.checkpoint,
+                "acked": self._done,
+                "unacked": self.seq - self._done,
+                "queued": len(self._pending),
+                "segments": len(self._segments()),
+                "fsync": self.fsync,
+            }
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self._write_checkpoint()
+            self._file.close()
@@ -0,0 +1,404 @@
+"""
+Append-only binary journal of state-engine transitions.
+
+Every committed issuance, owner rotation and retirement is appended as a fixed-layout
+binary record to the current segment file (journal-<first seq>.bin) in the
+journal directory. A snapshot (snapshot-<seq>.bin) holds the complete
+ownership table as of one sequence number. Each snapshot closes the current
+segment, so recovery reads the newest snapshot plus the segments after it.
+
+Record framing: u32 body length, u32 CRC-32 of the body, body. A body
+starts with type (u8), seq (u64) and a timestamp (f64):
+
+    ISSUE     coin_id[16] pk_owner[32] waarde(i64) pk_issuer[32]
+              issuer_signature[64] pk_engine(u16 len + bytes)
+              state_engine_endpoint(u16 len + utf-8)
+    TRANSFER  coin_id[16] pk_prev[32] pk_next[32]
+    RETIRE    coin_id[16] pk_prev[32]
+
+A torn record at the end of the last segment (crash during a write) is cut
+off when the journal is opened.
+
+Frames are also the replication format: read_frames() ships raw records to
+a replica, which appends them unchanged with Journal.append_frames(). Both
+sides keep a state digest: the XOR of blake2b(coin_id + pk_current) over all
+coins, updated per record.
+"""
+
+import hashlib
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+
+ISSUE = 1
+TRANSFER = 2
+RETIRE = 3
+
+_SEGMENT_MAGIC = b"PKJ1"
+_SNAPSHOT_MAGIC = b"PKS1"
+_FRAME = struct.Struct(">II")
+_HEAD = struct.Struct(">BQd")
+_ISSUE_FIXED = struct.Struct(">16s32sq32s64s")
+_TRANSFER = struct.Struct(">16s32s32s")
+_RETIRE = struct.Struct(">16s32s")
+_VARLEN = struct.Struct(">H")
+_SNAPSHOT_HEAD = struct.Struct(">QQ")
+_TRANSFER_RECORD = struct.Struct(">II" + _HEAD.format[1:] + _TRANSFER.format[1:])
+
+
+class JournalError(Exception):
+    pass
+
+
+class JournalGap(JournalError):
+    """The records after a seq are not in the journal; only the newest
+    snapshot covers them."""
+
+
+def check_event(rtype: int, fields: tuple):
+    """Raise ValueError if fields do not fit the fixed-size record layout."""
+    sizes = {TRANSFER: (16, 32, 32), RETIRE: (16, 32)}.get(rtype, (16, 32, None, 32, 64))
+    for value, size in zip(fields, sizes):
+        if size is not None and len(value) != size:
+            raise ValueError(f"Journal veld van {len(value)} bytes, verwacht {size}")
+
+
+def state_hash(coin_id: bytes, pk_current: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(coin_id + pk_current, digest_size=32).digest(), "big")
+
+
+def digest_update(digest: int, rtype: int, fields: tuple) -> int:
+    """State digest after applying one record."""
+    if rtype == TRANSFER:
+        return digest ^ state_hash(fields[0], fields[1]) ^ state_hash(fields[0], fields[2])
+    # ISSUE adds the coin, RETIRE removes it: both toggle its term
+    return digest ^ state_hash(fields[0], fields[1])
+
+
+def _encode(rtype: int, seq: int, ts: float, fields: tuple) -> bytes:
+    head = _HEAD.pack(rtype, seq, ts)
+    if rtype == TRANSFER:
+        body = head + _TRANSFER.pack(*fields)
+    elif rtype == RETIRE:
+        body = head + _RETIRE.pack(*fields)
+    else:
+        coin_id, pk_owner, waarde, pk_issuer, issuer_sig, pk_engine, endpoint = fields
+        endpoint_bytes = endpoint.encode("utf-8")
+        body = (head + _ISSUE_FIXED.pack(coin_id, pk_owner, waarde, pk_issuer, issuer_sig)
+                + _VARLEN.pack(len(pk_engine)) + pk_engine
+                + _VARLEN.pack(len(endpoint_bytes)) + endpoint_bytes)
+    return _FRAME.pack(len(body), zlib.crc32(body)) + body
+
+
+def _decode(body: memoryview) -> tuple[int, int, float, tuple]:
+    rtype, seq, ts = _HEAD.unpack_from(body, 0)
+    pos = _HEAD.size
+    if rtype == TRANSFER:
+        return rtype, seq, ts, _TRANSFER.unpack_from(body, pos)
+    if rtype == RETIRE:
+        return rtype, seq, ts, _RETIRE.unpack_from(body, pos)
+    if rtype != ISSUE:
+        raise JournalError(f"Onbekend journal record type {rtype}")
+    coin_id, pk_owner, waarde, pk_issuer, issuer_sig = _ISSUE_FIXED.unpack_from(body, pos)
+    pos += _ISSUE_FIXED.size
+    (n,) = _VARLEN.unpack_from(body, pos)
+    pk_engine = bytes(body[pos + 2:pos + 2 + n])
+    pos += 2 + n
+    (n,) = _VARLEN.unpack_from(body, pos)
+    endpoint = bytes(body[pos + 2:pos + 2 + n]).decode("utf-8")
+    return rtype, seq, ts, (coin_id, pk_owner, waarde, pk_issuer, issuer_sig, pk_engine, endpoint)
+
+
+def _scan(data: bytes, start: int):
+    """Yield (end_offset, record) for every intact record from start on."""
+    view = memoryview(data)
+    pos = start
+    while pos + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(view, pos)
+        end = pos + _FRAME.size + length
+        if end > len(data):
+            return
+        body = view[pos + _FRAME.size:end]
+        if zlib.crc32(body) != crc:
+            return
+        yield end, _decode(body)
+        pos = end
+
+
+def _numbered(directory: Path, prefix: str) -> list[tuple[int, Path]]:
+    found = []
+    for p in directory.glob(f"{prefix}-*.bin"):
+        try:
+            found.append((int(p.stem.split("-", 1)[1]), p))
+        except ValueError:
+            continue
+    return sorted(found)
+
+
+def _tail_segments(journal_dir: str, after_seq: int):
+    """Contents of the segments that can hold records after after_seq."""
+    segments = _numbered(Path(journal_dir), "journal")
+    for i, (_, path) in enumerate(segments):
+        if i + 1 < len(segments) and segments[i + 1][0] <= after_seq + 1:
+            continue
+        data = path.read_bytes()
+        if data[:4] != _SEGMENT_MAGIC:
+            raise JournalError(f"{path.name} is geen journal segment")
+        yield data
+
+
+def read_records(journal_dir: str, after_seq: int = 0):
+    """Yield (type, seq, ts, fields) for every journal record after after_seq."""
+    for data in _tail_segments(journal_dir, after_seq):
+        for _, record in _scan(data, 4):
+            if record[1] > after_seq:
+                yield record
+
+
+def decode_frames(data: bytes) -> list[tuple[int, int, float, tuple]]:
+    """Decode a run of frames that must be complete and intact."""
+    records, end = [], 0
+    for end, record in _scan(data, 0):
+        records.append(record)
+    if end != len(data):
+        raise JournalError(f"Beschadigde frames na {len(records)} records")
+    return records
+
+
+def read_frames(journal_dir: str, after_seq: int, max_records: int = 500,
+                upto_seq: int = None) -> tuple[bytes, int]:
+    """Raw frames of up to max_records records after after_seq (and not past
+    upto_seq). Returns (frames, seq of the last included record). Raises
+    JournalGap when the record after after_seq is missing."""
+    out, last = [], after_seq
+    for data in _tail_segments(journal_dir, after_seq):
+        start = 4
+        for end, (_, seq, _, _) in _scan(data, 4):
+            if upto_seq is not None and seq > upto_seq:
+                return b"".join(out), last
+            if seq > after_seq:
+                if not out and seq != after_seq + 1:
+                    raise JournalGap(f"Geen record {after_seq + 1} in het journal")
+                out.append(data[start:end])
+                last = seq
+                if len(out) >= max_records:
+                    return b"".join(out), last
+            start = end
+    if not out and upto_seq is not None and upto_seq > after_seq:
+        raise JournalGap(f"Geen record {after_seq + 1} in het journal")
+    return b"".join(out), last
+
+
+def snapshot_frames(journal_dir: str, offset: int = 0,
+                    max_records: int = 500) -> tuple[bytes, int, int] | None:
+    """Raw ISSUE frames offset..offset+max_records of the newest snapshot.
+    Returns (frames, snapshot seq, total coins), or None without snapshot."""
+    snapshots = _numbered(Path(journal_dir), "snapshot")
+    if not snapshots:
+        return None
+    data = snapshots[-1][1].read_bytes()
+    seq, count = _SNAPSHOT_HEAD.unpack_from(data, 4)
+    out = []
+    start = 4 + _SNAPSHOT_HEAD.size
+    for i, (end, _) in enumerate(_scan(data, start)):
+        if i >= offset + max_records:
+            break
+        if i >= offset:
+            out.append(data[start:end])
+        start = end
+    return b"".join(out), seq, count
+
+
+def load_snapshot(path: Path) -> tuple[int, dict[bytes, list]]:
+    """Read a snapshot into {coin_id: [pk_owner, waarde, pk_issuer,
+    issuer_signature, pk_engine, endpoint]}."""
+    data = path.read_bytes()
+    if data[:4] != _SNAPSHOT_MAGIC:
+        raise JournalError(f"{path.name} is geen snapshot")
+    seq, count = _SNAPSHOT_HEAD.unpack_from(data, 4)
+    coins = {}
+    for _, (_, _, _, fields) in _scan(data, 4 + _SNAPSHOT_HEAD.size):
+        coins[fields[0]] = list(fields[1:])
+    if len(coins) != count:
+        raise JournalError(f"{path.name} is onvolledig: {len(coins)} van {count} coins")
+    return seq, coins
+
+
+def _replay(data: bytes, after_seq: int, coins: dict[bytes, list]) -> int:
+    """Apply the records of one segment to coins; returns the last seq.
+
+    Transfers dominate the tail, so they are decoded inline with one
+    precompiled struct instead of going through _scan/_decode.
+    """
+    view = memoryview(data)
+    unpack_frame = _FRAME.unpack_from
+    unpack_transfer = _TRANSFER_RECORD.unpack_from
+    crc32 = zlib.crc32
+    seq = after_seq
+    pos, size = 4, len(data)
+    while pos + _FRAME.size <= size:
+        length, crc = unpack_frame(view, pos)
+        end = pos + _FRAME.size + length
+        if end > size or crc32(view[pos + _FRAME.size:end]) != crc:
+            break
+        if data[pos + _FRAME.size] == TRANSFER:
+            _, _, _, rseq, _, coin_id, pk_prev, pk_next = unpack_transfer(view, pos)
+            if rseq > after_seq:
+                coin = coins.get(coin_id)
+                if coin is None or coin[0] != pk_prev:
+                    raise JournalError(f"Journal record {rseq} past niet op de vorige eigenaar")
+                coin[0] = pk_next
+                seq = rseq
+        else:
+            rtype, rseq, _, fields = _decode(view[pos + _FRAME.size:end])
+            if rseq > after_seq:
+                if rtype == RETIRE:
+                    coin = coins.pop(fields[0], None)
+                    if coin is None or coin[0] != fields[1]:
+                        raise JournalError(f"Journal record {rseq} past niet op de vorige eigenaar")
+                else:
+                    coins[fields[0]] = list(fields[1:])
+                seq = rseq
+        pos = end
+    return seq
+
+
+def recover(journal_dir: str) -> tuple[int, dict[bytes, list]]:
+    """Ownership table from the newest snapshot plus the journal tail.
+
+    Returns (last seq, {coin_id: [pk_owner, waarde, pk_issuer,
+    issuer_signature, pk_engine, endpoint]}).
+    """
+    snapshots = _numbered(Path(journal_dir), "snapshot")
+    seq, coins = load_snapshot(snapshots[-1][1]) if snapshots else (0, {})
+    for data in _tail_segments(journal_dir, seq):
+        seq = _replay(data, seq, coins)
+    return seq, coins
+
+
+class Journal:
+    def __init__(self, journal_dir: str, fsync: bool = False):
+        self.dir = Path(journal_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        snapshots = _numbered(self.dir, "snapshot")
+        self.snapshot_seq = snapshots[-1][0] if snapshots else 0
+        self.seq = self.snapshot_seq
+        self._stats = {"records": 0, "bytes": 0, "snapshots": 0}
+
+        segments = _numbered(self.dir, "journal")
+        if segments:
+            self._segment = segments[-1][1]
+            self.seq = max(self.seq, self._repair(self._segment, segments[-1][0] - 1))
+            self._file = open(self._segment, "ab")
+        else:
+            self._open_segment(self.seq + 1)
+
+    def _repair(self, path: Path, seq: int) -> int:
+        """Cut a torn tail off the segment; returns its last seq."""
+        data = path.read_bytes()
+        if len(data) < 4 and _SEGMENT_MAGIC.startswith(data):
+            # Crashed while creating the segment
+            path.write_bytes(_SEGMENT_MAGIC)
+            return seq
+        if data[:4] != _SEGMENT_MAGIC:
+            raise JournalError(f"{path.name} is geen journal segment")
+        good = 4
+        for end, record in _scan(data, 4):
+            good, seq = end, record[1]
+        if good < len(data):
+            print(f"[JOURNAL] {len(data) - good} bytes onvolledige staart afgekapt in {path.name}", flush=True)
+            with open(path, "r+b") as f:
+                f.truncate(good)
+        return seq
+
+    def _open_segment(self, first_seq: int):
+        self._segment = self.dir / f"journal-{first_seq:020d}.bin"
+        self._file = open(self._segment, "ab")
+        if self._file.tell() == 0:
+            self._file.write(_SEGMENT_MAGIC)
+            self._file.flush()
+
+    def append(self, events: list[tuple[int, tuple]]) -> int:
+        """Append (type, fields) events with consecutive seqs in one write.
+        Returns the last seq."""
+        if not events:
+            return self.seq
+        ts = time.time()
+        chunks = []
+        for rtype, fields in events:
+            self.seq += 1
+            chunks.append(_encode(rtype, self.seq, ts, fields))
+        data = b"".join(chunks)
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._stats["records"] += len(events)
+        self._stats["bytes"] += len(data)
+        return self.seq
+
+    def append_frames(self, data: bytes) -> list[tuple[int, int, float, tuple]]:
+        """Append frames received from a primary. Their seqs must continue
+        this journal exactly. Returns the decoded records."""
+        records = decode_frames(data)
+        for i, record in enumerate(records):
+            if record[1] != self.seq + 1 + i:
+                raise JournalError(f"Verwacht seq {self.seq + 1 + i}, kreeg {record[1]}")
+        if not records:
+            return records
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.seq = records[-1][1]
+        self._stats["records"] += len(records)
+        self._stats["bytes"] += len(data)
+        return records
+
+    def skip(self):
+        """Move to the next seq without a record, for a snapshot of changes
+        the journal missed. Replicas past the old seq find the gap and
+        reload the snapshot."""
+        self.seq += 1
+
+    def install_snapshot(self, coins, seq: int) -> Path:
+        """Take over a primary's snapshot at seq; later frames continue from it."""
+        self.seq = seq
+        return self.write_snapshot(coins)
+
+    def write_snapshot(self, coins) -> Path:
+        """Write the full ownership table as of the current seq and start a
+        new segment. coins yields the ISSUE fields of every coin, with the
+        current owner as pk_owner."""
+        ts = time.time()
+        records = [_encode(ISSUE, self.seq, ts, fields) for fields in coins]
+        path = self.dir / f"snapshot-{self.seq:020d}.bin"
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_SNAPSHOT_MAGIC + _SNAPSHOT_HEAD.pack(self.seq, len(records)))
+            f.write(b"".join(records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self.snapshot_seq = self.seq
+        self._stats["snapshots"] += 1
+        self._file.close()
+        self._open_segment(self.seq + 1)
+        return path
+
+    def stats(self) -> dict:
+        return {
+            "dir": str(self.dir),
+            "seq": self.seq,
+            "snapshot_seq": self.snapshot_seq,
+            "segment": self._segment.name,
+            "fsync": self.fsync,
+            **self._stats,
+        }
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
@@ -0,0 +1,59 @@
+"""
+Merkle trees for batched engine confirmations.
+
+Leaves and inner nodes are hashed with SHA-256 under different prefixes
+(0x00 for leaves, 0x01 for nodes), so an inner node can never pass for a
+leaf. A node without a sibling is carried up to the next level unchanged
+instead of being paired with itself.
+
+An inclusion path is a list of [side, sibling_hex] steps from the leaf up,
+where side is "L" when the sibling sits on the left.
+"""
+
+import hashlib
+
+
+def leaf_hash(payload: bytes) -> bytes:
+    return hashlib.sha256(b"\x00" + payload).digest()
+
+
+def _node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def merkle_tree(payloads: list[bytes]) -> tuple[bytes, list[list[list[str]]]]:
+    """Root hash and one inclusion path per payload."""
+    if not payloads:
+        raise ValueError("Merkle tree zonder leaves")
+    level = [leaf_hash(p) for p in payloads]
+    # Leaf indices under each node of the current level
+    members = [[i] for i in range(len(payloads))]
+    paths: list[list[list[str]]] = [[] for _ in payloads]
+    while len(level) > 1:
+        next_level, next_members = [], []
+        for i in range(0, len(level) - 1, 2):
+            left, right = level[i], level[i + 1]
+            for j in members[i]:
+                paths[j].append(["R", right.hex()])
+            for j in members[i + 1]:
+                paths[j].append(["L", left.hex()])
+            next_level.append(_node_hash(left, right))
+            next_members.append(members[i] + members[i + 1])
+        if len(level) % 2:
+            next_level.append(level[-1])
+            next_members.append(members[-1])
+        level, members = next_level, next_members
+    return level[0], paths
+
+
+def merkle_root_from_path(payload: bytes, path: list[list[str]]) -> bytes:
+    node = leaf_hash(payload)
+    for side, sibling_hex in path:
+        sibling = bytes.fromhex(sibling_hex)
+        if side == "L":
+            node = _node_hash(sibling, node)
+        elif side == "R":
+            node = _node_hash(node, sibling)
+        else:
+            raise ValueError(f"Ongeldige kant in Merkle path: {side!r}")
+    return node
@@ -0,0 +1,92 @@
+"""
+Bounded LRU cache of coin ownership for the state engine.
+
+Maps coin_id -> (pk_current bytes, coin dict). The engine writes through to
+it right after a commit succeeds, still under the write lock, so a cached
+owner is always the latest committed owner. Reads from the database only
+fill missing entries. Memory use is estimated per entry and capped at max_bytes.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+# Rough per-entry overhead of the OrderedDict slot, tuple and dict shells.
+_ENTRY_OVERHEAD = 600
+
+
+def _entry_size(coin_id: str, pk_current: bytes, coin: dict) -> int:
+    return (_ENTRY_OVERHEAD + sys.getsizeof(coin_id) + sys.getsizeof(pk_current)
+            + sum(sys.getsizeof(v) for v in coin.values()))
+
+
+class OwnershipCache:
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[bytes, dict, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, coin_id: str) -> tuple[bytes, dict] | None:
+        with self._lock:
+            entry = self._entries.get(coin_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(coin_id)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, coin_id: str, pk_current: bytes, coin: dict):
+        self._store(coin_id, pk_current, coin, replace=True)
+
+    def fill(self, coin_id: str, pk_current: bytes, coin: dict):
+        """put() for a value read outside the write lock: it never replaces
+        an entry, which a commit may have written in the meantime."""
+        self._store(coin_id, pk_current, coin, replace=False)
+
+    def _store(self, coin_id: str, pk_current: bytes, coin: dict, replace: bool):
+        if self.max_bytes <= 0:
+            return
+        coin = {**coin, "pk_current": pk_current.hex()}
+        size = _entry_size(coin_id, pk_current, coin)
+        with self._lock:
+            old = self._entries.pop(coin_id, None)
+            if old is not None:
+                if not replace:
+                    self._entries[coin_id] = old
+                    return
+                self._bytes -= old[2]
+            self._entries[coin_id] = (pk_current, coin, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[2]
+                self.evictions += 1
+
+    def discard(self, coin_id: str):
+        with self._lock:
+            old = self._entries.pop(coin_id, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
@@ -0,0 +1,296 @@
+"""
+Log-shipping read replica of the state engine.
+
+A replica follows a primary engine's transition journal. It sends
+replica_pull messages. The primary answers each one with serve_pull(): raw
+journal frames after the replica's seq, or chunks of its newest snapshot when
+a fresh replica bootstraps. When the records after the replica's seq are not
+in the journal (the primary resynced it from its database with a snapshot at
+a new seq), the answer is a resync and the replica bootstraps again. The replica appends the frames to its own
+journal and keeps an in-memory ownership table, so it answers coin status
+queries without touching the primary. A restarted replica recovers that
+table from its local journal and comes up warm.
+
+Every records reply carries the primary's seq and state digest. Once the
+replica reaches that seq it compares digests, and status() reports the
+result together with the replication lag.
+
+Every shard of a sharded primary has its own journal. A ShardedReplica
+follows each of them with its own EngineReplica; pulls and replies name the
+shard.
+"""
+
+import base64
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from src.journal import (
+    RETIRE, TRANSFER, Journal, JournalError, JournalGap, decode_frames, digest_update,
+    read_frames, recover, snapshot_frames, state_hash,
+)
+from src.sharded_engine import shard_index
+
+PULL_MAX_RECORDS = 500
+
+
+def serve_pull(engine, payload: dict) -> dict:
+    """Primary side: the replica_batch reply to a replica_pull payload. A
+    sharded primary answers from the journal of the shard the pull names."""
+    n_shards = getattr(engine, "n_shards", 1)
+    shard = int(payload.get("shard", 0))
+    if not 0 <= shard < n_shards:
+        raise ValueError(f"Primary heeft geen shard {shard}")
+    reply = _serve_journal(engine.shards[shard] if n_shards > 1 else engine, payload)
+    return {**reply, "shard": shard, "n_shards": n_shards}
+
+
+def _serve_journal(engine, payload: dict) -> dict:
+    journal_dir = engine.journal_dir
+    if journal_dir is None:
+        raise ValueError("Primary engine heeft geen journal")
+    max_records = max(1, min(int(payload.get("max", PULL_MAX_RECORDS)), PULL_MAX_RECORDS))
+    position = engine.journal_position()
+
+    if "snapshot_offset" in payload:
+        offset = int(payload["snapshot_offset"])
+        snapshot = snapshot_frames(journal_dir, offset, max_records)
+        if snapshot is None:
+            return {"kind": "snapshot", "none": True, "primary_seq": position["seq"]}
+        frames, snapshot_seq, count = snapshot
+        return {
+            "kind": "snapshot",
+            "frames": base64.b64encode(frames).decode("ascii"),
+            "snapshot_seq": snapshot_seq,
+            "offset": offset,
+            "count": count,
+            "primary_seq": position["seq"],
+        }
+
+    after_seq = int(payload.get("after_seq", 0))
+    try:
+        frames, _ = read_frames(journal_dir, after_seq, max_records, upto_seq=position["seq"])
+    except JournalGap:
+        return {"kind": "resync", "primary_seq": position["seq"]}
+    return {
+        "kind": "records",
+        "frames": base64.b64encode(frames).decode("ascii"),
+        "after_seq": after_seq,
+        "primary_seq": position["seq"],
+        "digest": position["digest"],
+    }
+
+
+class EngineReplica:
+    def __init__(self, replica_dir: str, fsync: bool = False):
+        journal_dir = Path(replica_dir) / "journal"
+        self._journal = Journal(str(journal_dir), fsync=fsync)
+        _, coins = recover(str(journal_dir))
+        self._owners: dict[bytes, bytes] = {k: c[0] for k, c in coins.items()}
+        self._digest = 0
+        for k, pk in self._owners.items():
+            self._digest ^= state_hash(k, pk)
+        self._lock = threading.Lock()
+        self._bootstrapped = self._journal.seq > 0 or bool(self._owners)
+        self._staging: tuple[int, list] | None = None
+        self.primary_seq: int | None = None
+        self._last_contact: float | None = None
+        self._synced_at: float | None = None
+        self._digest_check: dict | None = None
+
+    @property
+    def seq(self) -> int:
+        return self._journal.seq
+
+    def pull_request(self) -> dict:
+        """Payload for the next replica_pull to the primary."""
+        with self._lock:
+            if not self._bootstrapped:
+                offset = len(self._staging[1]) if self._staging else 0
+                return {"snapshot_offset": offset, "max": PULL_MAX_RECORDS}
+            return {"after_seq": self._journal.seq, "max": PULL_MAX_RECORDS}
+
+    def apply(self, reply: dict) -> bool:
+        """Apply a replica_batch reply. Returns True when the replica is
+        still behind and should pull again right away."""
+        with self._lock:
+            self._last_contact = time.time()
+            self.primary_seq = reply.get("primary_seq", self.primary_seq)
+            if reply.get("kind") == "snapshot":
+                return self._apply_snapshot(reply)
+            if reply.get("kind") == "resync":
+                # The primary skipped past our seq with a snapshot: bootstrap again
+                if self._bootstrapped:
+                    print(f"[REPLICA] primary heeft geen records na seq {self._journal.seq}, "
+                          f"snapshot opnieuw laden", flush=True)
+                self._bootstrapped = False
+                return True
+            return self._apply_records(reply)
+
+    def _apply_snapshot(self, reply: dict) -> bool:
+        if self._bootstrapped:
+            return True
+        if reply.get("none"):
+            self._bootstrapped = True
+            return True
+        snapshot_seq = reply["snapshot_seq"]
+        if self._staging is None or self._staging[0] != snapshot_seq:
+            # First chunk, or the primary wrote a newer snapshot meanwhile
+            self._staging = (snapshot_seq, [])
+        staged = self._staging[1]
+        if reply["offset"] != len(staged):
+            return True
+        staged.extend(fields for _, _, _, fields in decode_frames(base64.b64decode(reply["frames"])))
+        if len(staged) < reply["count"]:
+            return True
+
+        self._journal.install_snapshot(staged, snapshot_seq)
+        self._owners = {fields[0]: fields[1] for fields in staged}
+        self._digest = 0
+        for k, pk in self._owners.items():
+            self._digest ^= state_hash(k, pk)
+        self._staging = None
+        self._bootstrapped = True
+        print(f"[REPLICA] snapshot van primary geladen: {len(self._owners)} coins tot seq {snapshot_seq}",
+              flush=True)
+        return True
+
+    def _apply_records(self, reply: dict) -> bool:
+        if not self._bootstrapped or reply["after_seq"] != self._journal.seq:
+            # Answer to an older pull; ask again from where we are
+            return True
+        data = base64.b64decode(reply["frames"])
+        records = decode_frames(data)
+
+        # Check every transfer against the table before anything is written
+        # A change to None removes a retired coin
+        changes: dict[bytes, bytes | None] = {}
+        digest = self._digest
+        for rtype, rseq, _, fields in records:
+            if rtype in (TRANSFER, RETIRE):
+                current = changes[fields[0]] if fields[0] in changes else self._owners.get(fields[0])
+                if current is None or current != fields[1]:
+                    raise JournalError(f"Record {rseq} van primary past niet op de vorige eigenaar")
+                changes[fields[0]] = fields[2] if rtype == TRANSFER else None
+            else:
+                changes[fields[0]] = fields[1]
+            digest = digest_update(digest, rtype, fields)
+        self._journal.append_frames(data)
+        for key, pk in changes.items():
+            if pk is None:
+                self._owners.pop(key, None)
+            else:
+                self._owners[key] = pk
+        self._digest = digest
+
+        now = time.time()
+        if self._journal.seq == reply["primary_seq"]:
+            ok = f"{self._digest:064x}" == reply["digest"]
+            if not ok and (self._digest_check is None or self._digest_check["ok"]):
+                print(f"[REPLICA] state digest wijkt af van primary op seq {self._journal.seq}!", flush=True)
+            self._digest_check = {"seq": self._journal.seq, "ok": ok, "at": now}
+        if self._journal.seq >= reply["primary_seq"]:
+            self._synced_at = now
+            return False
+        return True
+
+    def coin_state(self, coin_id: str) -> dict | None:
+        try:
+            key = uuid.UUID(coin_id).bytes
+        except ValueError:
+            return None
+        with self._lock:
+            pk = self._owners.get(key)
+            if pk is None:
+                return None
+            return {"coin_id": coin_id, "pk_current": pk.hex(), "seq": self._journal.seq}
+
+    def coin_owners(self, keys: list[bytes]) -> dict[bytes, bytes]:
+        with self._lock:
+            return {key: self._owners[key] for key in keys if key in self._owners}
+
+    def status(self) -> dict:
+        with self._lock:
+            now = time.time()
+            lag_records = lag_s = None
+            if self.primary_seq is not None:
+                lag_records = max(0, self.primary_seq - self._journal.seq)
+            if self._synced_at is not None:
+                # Seconds since the replica last had everything the primary had
+                lag_s = round(now - self._synced_at, 1) if lag_records else 0.0
+            return {
+                "seq": self._journal.seq,
+                "primary_seq": self.primary_seq,
+                "lag_records": lag_records,
+                "lag_s": lag_s,
+                "last_contact_s": round(now - self._last_contact, 1) if self._last_contact else None,
+                "bootstrapped": self._bootstrapped,
+                "coins": len(self._owners),
+                "digest": f"{self._digest:064x}",
+                "digest_check": dict(self._digest_check) if self._digest_check else None,
+            }
+
+    def close(self):
+        self._journal.close()
+
+
+class ShardedReplica:
+    """Replica of a primary with n_shards shards: one EngineReplica per
+    shard, in replica_dir/shard-<i>. With one shard it is a single
+    EngineReplica in replica_dir itself."""
+
+    def __init__(self, replica_dir: str, n_shards: int = 1, fsync: bool = False):
+        self.n_shards = n_shards
+        if n_shards == 1:
+            self.replicas = [EngineReplica(replica_dir, fsync=fsync)]
+        else:
+            self.replicas = [EngineReplica(os.path.join(replica_dir, f"shard-{i}"), fsync=fsync)
+                             for i in range(n_shards)]
+
+    def pull_requests(self) -> list[dict]:
+        """Payloads for the next replica_pull of every shard."""
+        return [{**r.pull_request(), "shard": i} for i, r in enumerate(self.replicas)]
+
+    def apply(self, reply: dict) -> bool:
+        """Apply a replica_batch reply to its shard. Returns True when that
+        shard is still behind and should pull again right away."""
+        if reply.get("kind") == "error":
+            raise ValueError(f"primary weigert: {reply.get('error', '?')}")
+        n_shards = reply.get("n_shards", 1)
+        if n_shards != self.n_shards:
+            raise ValueError(f"primary heeft {n_shards} shards, deze replica {self.n_shards}; "
+                             f"start de replica met --shards {n_shards}")
+        return self.replicas[reply.get("shard", 0)].apply(reply)
+
+    def coin_state(self, coin_id: str) -> dict | None:
+        return self.replicas[shard_index(coin_id, self.n_shards)].coin_state(coin_id)
+
+    def coin_owners(self, keys: list[bytes]) -> dict[bytes, bytes]:
+        groups: dict[int, list[bytes]] = {}
+        for key in keys:
+            groups.setdefault(shard_index(str(uuid.UUID(bytes=key)), self.n_shards), []).append(key)
+        owners = {}
+        for i, shard_keys in groups.items():
+            owners.update(self.replicas[i].coin_owners(shard_keys))
+        return owners
+
+    def status(self) -> dict:
+        if self.n_shards == 1:
+            return self.replicas[0].status()
+        per_shard = [r.status() for r in self.replicas]
+        lags = [s["lag_records"] for s in per_shard]
+        checks = [s["digest_check"] for s in per_shard]
+        return {
+            "shards": self.n_shards,
+            "lag_records": None if None in lags else sum(lags),
+            "bootstrapped": all(s["bootstrapped"] for s in per_shard),
+            "coins": sum(s["coins"] for s in per_shard),
+            "digests_ok": None if None in checks else all(c["ok"] for c in checks),
+            "per_shard": per_shard,
+        }
+
+    def close(self):
+        for r in self.replicas:
+            r.close()
@@ -0,0 +1,495 @@
+"""
+Coin-id sharded state engine.
+
+Spreads coins over N StateEngine shards, each with its own SQLite file and
+its own single writer thread, so commits on different shards run in
+parallel. With processes=True every shard engine runs in its own process
+(ShardProcess) and the writer threads only wait on its pipe, so shards use
+separate cores instead of sharing one interpreter lock. All shards share
+one signing key. Trusted issuers are replicated
+to every shard. The public API mirrors StateEngine so the actor code can
+use either one.
+
+The shard count is stored in each shard's PRAGMA user_version and cannot be
+changed for an existing data directory. A data directory whose unsharded
+engine.db already holds coins is refused: those coins would be invisible to
+the shards.
+
+A split or merge creates its outputs on the shard of its first input, in
+one transaction with retiring the inputs there. Inputs on other shards are
+retired into a hold first (hold_reissue_inputs); once the outputs exist the
+holds are dropped, and if creating them fails the held coins go back to
+their owner. Holds left by a crash are settled when the engine starts.
+"""
+
+import functools
+import hashlib
+import heapq
+import itertools
+import multiprocessing
+import os
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from src.crypto_utils import generate_keypair, sk_to_hex, sk_from_hex
+from src.coin import reissue_digest
+from src.engine import StateEngine, _replay_key
+
+
+def shard_index(coin_id: str, n_shards: int) -> int:
+    digest = hashlib.blake2b(coin_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n_shards
+
+
+def count_coins(db_path: str) -> int:
+    """Number of coins in an engine database, 0 if it does not exist."""
+    if not os.path.exists(db_path):
+        return 0
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM coin_owner").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
+
+def _on_shard(coin_id: str, n_shards: int, index: int) -> bool:
+    return shard_index(coin_id, n_shards) == index
+
+
+def _claim_shard_count(engine: StateEngine, n_shards: int) -> int:
+    """Store n_shards in a new shard's user_version; return the stored count."""
+    with engine._write_lock:
+        stored = engine._conn.execute("PRAGMA user_version").fetchone()[0]
+        if stored == 0:
+            engine._conn.execute(f"PRAGMA user_version = {n_shards}")
+            return n_shards
+        return stored
+
+
+def _serve_shard(conn, db_path: str, sk_hex: str, engine_kwargs: dict):
+    """Child process of a ShardProcess: run the requests from the pipe on
+    one StateEngine until it is closed."""
+    try:
+        engine = StateEngine(db_path=db_path, sk=sk_from_hex(sk_hex), **engine_kwargs)
+    except Exception as exc:
+        conn.send(("error", exc))
+        return
+    conn.send(("ok", None))
+    while True:
+        try:
+            op, name, args, kwargs = conn.recv()
+        except EOFError:
+            engine.close()
+            return
+        try:
+            if op == "get":
+                result = getattr(engine, name)
+            elif op == "set":
+                setattr(engine, name, args[0])
+                result = None
+            elif op == "run":
+                result = name(engine, *args)
+            else:
+                result = getattr(engine, name)(*args, **kwargs)
+            reply = ("ok", result)
+        except Exception as exc:
+            reply = ("error", exc)
+        try:
+            conn.send(reply)
+        except Exception as exc:
+            conn.send(("error", RuntimeError(f"{name}: antwoord niet te versturen ({exc})")))
+        if op == "call" and name == "close":
+            return
+
+
+class ShardProcess:
+    """A shard's StateEngine in its own process. Method calls and the
+    attributes in ATTRIBUTES go over a pipe, one at a time."""
+
+    ATTRIBUTES = ("pk_hex", "merkle_confirmations", "delivery_retention_s", "journal_dir")
+
+    def __init__(self, db_path: str, sk, engine_kwargs: dict, name: str = "engine-shard"):
+        object.__setattr__(self, "_lock", threading.Lock())
+        ctx = multiprocessing.get_context("spawn")
+        conn, child = ctx.Pipe()
+        process = ctx.Process(target=_serve_shard, args=(child, db_path, sk_to_hex(sk), engine_kwargs),
+                              name=name, daemon=True)
+        process.start()
+        child.close()
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_process", process)
+        status, result = conn.recv()
+        if status == "error":
+            process.join()
+            raise result
+
+    def _call(self, op: str, name, *args, **kwargs):
+        with self._lock:
+            self._conn.send((op, name, args, kwargs))
+            status, result = self._conn.recv()
+        if status == "error":
+            raise result
+        return result
+
+    def __getattr__(self, name: str):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        if name in self.ATTRIBUTES:
+            return self._call("get", name)
+        return functools.partial(self._call, "call", name)
+
+    def __setattr__(self, name: str, value):
+        if name not in self.ATTRIBUTES:
+            raise AttributeError(f"{name} kan niet op een shard-proces gezet worden")
+        self._call("set", name, value)
+
+    def run(self, fn, *args):
+        """fn(engine, *args) in the shard process; fn must be a module-level function."""
+        return self._call("run", fn, *args)
+
+    # A generator cannot cross the pipe: page through list_coins from here
+    iter_coins = StateEngine.iter_coins
+
+    def close(self):
+        if self._process.is_alive():
+            self._call("call", "close")
+        self._process.join(5)
+        self._conn.close()
+
+
+class ShardedStateEngine:
+    def __init__(self, db_dir: str, n_shards: int = 4, sk=None, processes: bool = False,
+                 **engine_kwargs):
+        if n_shards < 1:
+            raise ValueError("n_shards moet minimaal 1 zijn")
+        unsharded = count_coins(os.path.join(db_dir, "engine.db"))
+        if unsharded:
+            raise ValueError(
+                f"{db_dir} bevat een engine.db met {unsharded} coins zonder shards; "
+                f"start zonder --shards of gebruik een nieuwe datamap"
+            )
+        if sk is None:
+            sk, _ = generate_keypair()
+        self._sk = sk
+        self.n_shards = n_shards
+        self.processes = processes
+        self._issuer_listeners = []
+        journal_dir = engine_kwargs.pop("journal_dir", None)
+        if processes:
+            # A shard process checks its own signatures; the pool does not cross processes
+            engine_kwargs.pop("verifier", None)
+        self.shards = []
+        for i in range(n_shards):
+            if journal_dir:
+                engine_kwargs["journal_dir"] = os.path.join(journal_dir, f"shard-{i}")
+            db_path = os.path.join(db_dir, f"engine-shard-{i}.db")
+            if processes:
+                shard = ShardProcess(db_path, sk, dict(engine_kwargs), name=f"engine-shard-{i}")
+            else:
+                shard = StateEngine(db_path=db_path, sk=sk, **engine_kwargs)
+            self.shards.append(shard)
+            self._check_shard_count(i)
+        self._writers = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"engine-shard-{i}")
+            for i in range(n_shards)
+        ]
+        self._settle_holds()
+
+    def _in_shard(self, i: int, fn, *args):
+        """fn(shard engine, *args), in the shard's process if it has one."""
+        shard = self.shards[i]
+        return shard.run(fn, *args) if self.processes else fn(shard, *args)
+
+    def _check_shard_count(self, i: int):
+        stored = self._in_shard(i, _claim_shard_count, self.n_shards)
+        if stored != self.n_shards:
+            for shard in self.shards:
+                shard.close()
+            raise ValueError(
+                f"Shard {i} hoort bij een engine met {stored} shards, niet {self.n_shards}"
+            )
+
+    def _settle_holds(self):
+        """Finish the cross-shard split/merges a crash cut off: drop the
+        holds of those whose outputs were created, restore the others."""
+        for i, shard in enumerate(self.shards):
+            for request_key in shard.reissue_holds():
+                done = any(s.has_confirmed(request_key) for s in self.shards)
+                n = self._run(i, shard.release_reissue_holds, request_key, not done)
+                print(f"[ENGINE] shard {i}: {n} coins van een onderbroken split/merge "
+                      f"{'afgeboekt' if done else 'teruggezet'}", flush=True)
+
+    def _shard_for(self, coin_id: str) -> int:
+        return shard_index(coin_id, self.n_shards)
+
+    def _run(self, i: int, fn, *args):
+        return self._writers[i].submit(fn, *args).result()
+
+    # ── StateEngine API ─────────────────────────────────────
+
+    @property
+    def pk_hex(self) -> str:
+        return self.shards[0].pk_hex
+
+    @property
+    def merkle_confirmations(self) -> bool:
+        return self.shards[0].merkle_confirmations
+
+    @property
+    def delivery_retention_s(self) -> float:
+        return self.shards[0].delivery_retention_s
+
+    @delivery_retention_s.setter
+    def delivery_retention_s(self, value: float):
+        for shard in self.shards:
+            shard.delivery_retention_s = value
+
+    def close(self):
+        for writer in self._writers:
+            writer.shutdown(wait=True)
+        for shard in self.shards:
+            shard.close()
+
+    def connection_stats(self) -> dict:
+        return {
+            "shards": self.n_shards,
+            "per_shard": [s.connection_stats() for s in self.shards],
+        }
+
+    def register_issuer(self, pk_issuer_hex: str):
+        added = not self.is_trusted_issuer(pk_issuer_hex)
+        for i in range(self.n_shards):
+            self._run(i, self.shards[i].register_issuer, pk_issuer_hex)
+        # Listeners live here, not on a shard: a shard process cannot call back
+        if added:
+            for callback in self._issuer_listeners:
+                try:
+                    callback("added", pk_issuer_hex)
+                except Exception as exc:
+                    print(f"[ENGINE] issuer listener MISLUKT: {exc}", flush=True)
+
+    def on_issuer_change(self, callback):
+        """Register callback(event, pk_issuer_hex), called once every shard trusts the issuer."""
+        self._issuer_listeners.append(callback)
+
+    def is_trusted_issuer(self, pk_issuer_hex: str) -> bool:
+        return self.shards[0].is_trusted_issuer(pk_issuer_hex)
+
+    def list_issuers(self) -> list[str]:
+        return self.shards[0].list_issuers()
+
+    def register_coin(self, coin, recipient_address: str,
+                      pk_next: str, transfer_signature: str):
+        i = self._shard_for(coin.coin_id)
+        self._run(i, self.shards[i].register_coin, coin, recipient_address,
+                  pk_next, transfer_signature)
+
+    def register_coins(self, items: list[dict], recipient_address: str) -> list[dict]:
+        groups = self._group(items, lambda item: item["coin"].coin_id)
+        futures = {
+            i: self._writers[i].submit(self.shards[i].register_coins,
+                                       [items[j] for j in idx], recipient_address)
+            for i, idx in groups.items()
+        }
+        return self._merge(len(items), groups, futures)
+
+    def verify_registrations(self, items: list[dict]) -> list:
+        groups = self._group(items, lambda item: item["coin"].coin_id)
+        if self.processes:
+            futures = {i: self._writers[i].submit(self.shards[i].verify_registrations,
+                                                  [items[j] for j in idx])
+                       for i, idx in groups.items()}
+            return self._merge(len(items), groups, futures)
+        checks = [None] * len(items)
+        for i, idx in groups.items():
+            for j, check in zip(idx, self.shards[i].verify_registrations([items[j] for j in idx])):
+                checks[j] = check
+        return checks
+
+    def commit_registrations(self, items: list[dict], recipient_address: str,
+                             checks: list) -> list[dict]:
+        groups = self._group(items, lambda item: item["coin"].coin_id)
+        futures = {
+            i: self._writers[i].submit(self.shards[i].commit_registrations,
+                                       [items[j] for j in idx], recipient_address,
+                                       [checks[j] for j in idx])
+            for i, idx in groups.items()
+        }
+        return self._merge(len(items), groups, futures)
+
+    def sign_confirmation(self, coin_id: str, pk_next: str, status: str) -> dict:
+        return self.shards[0].sign_confirmation(coin_id, pk_next, status)
+
+    def get_coin_state(self, coin_id: str) -> dict | None:
+        return self.shards[self._shard_for(coin_id)].get_coin_state(coin_id)
+
+    def coin_owners(self, keys: list[bytes]) -> dict[bytes, bytes]:
+        groups: dict[int, list[bytes]] = {}
+        for key in keys:
+            groups.setdefault(self._shard_for(str(uuid.UUID(bytes=key))), []).append(key)
+        owners = {}
+        for i, shard_keys in groups.items():
+            owners.update(self.shards[i].coin_owners(shard_keys))
+        return owners
+
+    def list_coins(self, limit: int = None, **filters) -> list[dict]:
+        # Every shard returns its coins in coin_id order, so a merge gives the
+        # global order and the first `limit` of it is the page
+        merged = heapq.merge(*(shard.list_coins(limit=limit, **filters) for shard in self.shards),
+                             key=lambda c: c["coin_id"])
+        return list(itertools.islice(merged, limit))
+
+    def iter_coins(self, page_size: int = 500, **filters):
+        return heapq.merge(*(shard.iter_coins(page_size, **filters) for shard in self.shards),
+                           key=lambda c: c["coin_id"])
+
+    def count_coins(self) -> int:
+        return sum(shard.count_coins() for shard in self.shards)
+
+    def stats(self) -> dict:
+        total = None
+        for shard_stats in (shard.stats() for shard in self.shards):
+            if total is None:
+                total = shard_stats
+                continue
+            for field in ("coins", "outstanding_value", "transfers", "transfers_last_minute"):
+                total[field] += shard_stats[field]
+            rows = {row[0]: row for row in total["transfers_per_minute"]}
+            for ts, n in shard_stats["transfers_per_minute"]:
+                if ts in rows:
+                    rows[ts][1] += n
+            for pk, counts in shard_stats["issuers"].items():
+                merged = total["issuers"].setdefault(pk, {"coins": 0, "value": 0, "transfers": 0})
+                for field, n in counts.items():
+                    merged[field] += n
+        return total
+
+    def process_transaction(self, tx: dict) -> dict:
+        i = self._shard_for(tx["coin_id"])
+        return self._run(i, self.shards[i].process_transaction, tx)
+
+    def process_transactions(self, txs: list[dict]) -> list[dict]:
+        groups = self._group(txs, lambda tx: tx.get("coin_id", ""))
+        futures = {
+            i: self._writers[i].submit(self.shards[i].process_transactions,
+                                       [txs[j] for j in idx])
+            for i, idx in groups.items()
+        }
+        return self._merge(len(txs), groups, futures)
+
+    def verify_transactions(self, txs: list[dict]) -> list:
+        # Read-only, so it runs on the calling thread instead of the shard writers,
+        # unless the shards are processes: then the shards check in parallel
+        groups = self._group(txs, lambda tx: tx.get("coin_id", ""))
+        if self.processes:
+            futures = {i: self._writers[i].submit(self.shards[i].verify_transactions,
+                                                  [txs[j] for j in idx])
+                       for i, idx in groups.items()}
+            return self._merge(len(txs), groups, futures)
+        verified = [None] * len(txs)
+        for i, idx in groups.items():
+            for j, v in zip(idx, self.shards[i].verify_transactions([txs[j] for j in idx])):
+                verified[j] = v
+        return verified
+
+    def commit_transactions(self, txs: list[dict], verified: list) -> list[dict]:
+        groups = self._group(txs, lambda tx: tx.get("coin_id", ""))
+        futures = {
+            i: self._writers[i].submit(self.shards[i].commit_transactions,
+                                       [txs[j] for j in idx], [verified[j] for j in idx])
+            for i, idx in groups.items()
+        }
+        return self._merge(len(txs), groups, futures)
+
+    def process_reissue(self, request: dict) -> list[dict]:
+        # The outputs get ids that land on the shard of the first input
+        inputs = request["inputs"]
+        t = self._shard_for(inputs[0]["coin_id"])
+        target = self.shards[t]
+        on_target = functools.partial(_on_shard, n_shards=self.n_shards, index=t)
+        groups = self._group(inputs, lambda item: item["coin_id"])
+        if len(groups) == 1:
+            return self._run(t, target.process_reissue, request, on_target)
+
+        replay = target.reissue_replay(request)
+        if replay is not None:
+            return replay
+        input_ids = [i["coin_id"] for i in inputs]
+        request_key = _replay_key(input_ids[0], reissue_digest(input_ids, request["outputs"]),
+                                  inputs[0]["signature"])
+        others = [i for i in groups if i != t]
+        held = {}
+        try:
+            for i in others:
+                held.update(self._run(i, self.shards[i].hold_reissue_inputs, request,
+                                      [input_ids[j] for j in groups[i]]))
+            confirmations = self._run(t, target.process_reissue, request, on_target, held)
+        except Exception:
+            for i in others:
+                try:
+                    self._run(i, self.shards[i].release_reissue_holds, request_key, True)
+                except Exception as exc:
+                    # Left for _settle_holds at the next start
+                    print(f"[ENGINE] shard {i}: inputs terugzetten MISLUKT: {exc}", flush=True)
+            raise
+        for i in others:
+            self._run(i, self.shards[i].release_reissue_holds, request_key, False)
+        return confirmations
+
+    def get_pending_deliveries(self, wallet_address: str) -> list[dict]:
+        deliveries = []
+        for i, shard in enumerate(self.shards):
+            deliveries.extend(self._run(i, shard.get_pending_deliveries, wallet_address))
+        return deliveries
+
+    def compact_deliveries(self, retention_s: float = None) -> int:
+        return sum(self._run(i, s.compact_deliveries, retention_s)
+                   for i, s in enumerate(self.shards))
+
+    def delivery_queue_stats(self) -> dict:
+        per_shard = [s.delivery_queue_stats() for s in self.shards]
+        ages = [s["oldest_pending_age_s"] for s in per_shard if s["oldest_pending_age_s"] is not None]
+        return {
+            "pending": sum(s["pending"] for s in per_shard),
+            # A wallet can have deliveries waiting on several shards
+            "recipients_waiting": max((s["recipients_waiting"] for s in per_shard), default=0),
+            "oldest_pending_age_s": max(ages) if ages else None,
+            "delivered_retained": sum(s["delivered_retained"] for s in per_shard),
+            "retention_s": self.delivery_retention_s,
+        }
+
+    def write_snapshot(self) -> list:
+        return [self._run(i, s.write_snapshot) for i, s in enumerate(self.shards)]
+
+    def rebuild_from_journal(self) -> int:
+        return sum(self._run(i, s.rebuild_from_journal) for i, s in enumerate(self.shards))
+
+    def save_key(self, path: str):
+        Path(path).write_text(sk_to_hex(self._sk))
+
+    @classmethod
+    def load_key(cls, path: str, db_dir: str, n_shards: int = 4, processes: bool = False,
+                 **engine_kwargs) -> "ShardedStateEngine":
+        sk = sk_from_hex(Path(path).read_text().strip())
+        return cls(db_dir, n_shards=n_shards, sk=sk, processes=processes, **engine_kwargs)
+
+    # ── helpers ─────────────────────────────────────────────
+
+    def _group(self, items: list, coin_id_of) -> dict[int, list[int]]:
+        groups: dict[int, list[int]] = {}
+        for j, item in enumerate(items):
+            groups.setdefault(self._shard_for(coin_id_of(item)), []).append(j)
+        return groups
+
+    @staticmethod
+    def _merge(n: int, groups: dict[int, list[int]], futures: dict) -> list[dict]:
+        results = [None] * n
+        for i, idx in groups.items():
+            for j, r in zip(idx, futures[i].result()):
+                results[j] = r
+        return results
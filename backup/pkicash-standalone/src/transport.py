@@ -15,6 +15,8 @@ from datetime import datetime
 
 import RNS
 
+from src.ingress_log import IngressLog
+
 APP_NAME = "pkicash"
 
 
@@ -26,12 +28,16 @@ class PKICashTransport:
     Thread-safe — RNS callbacks run on background threads, Flask runs on main.
     """
 
-    def __init__(self, role: str, data_dir: str, config_path: str = None):
+    def __init__(self, role: str, data_dir: str, config_path: str = None,
+                 ingress_log: bool = False, ingress_fsync: bool = False):
         """
         Args:
             role: one of 'engine', 'bank', 'wallet'
             data_dir: actor-specific directory (e.g. data/engine/)
             config_path: optional Reticulum config directory
+            ingress_log: append incoming messages to data_dir/ingress and
+                hand them to the handlers from a consumer thread
+            ingress_fsync: fsync the ingress log after every message
         """
         self.role = role
         self.data_dir = data_dir
@@ -46,6 +52,8 @@ class PKICashTransport:
         self._announce_handlers: list = []
 
         os.makedirs(data_dir, exist_ok=True)
+        self._ingress = (IngressLog(os.path.join(data_dir, "ingress"), fsync=ingress_fsync)
+                         if ingress_log else None)
 
         self.reticulum = RNS.Reticulum(config_path)
 
@@ -188,6 +196,28 @@ class PKICashTransport:
             "ts": datetime.now().isoformat(),
         })
 
+    # ── ingress log ─────────────────────────────────────────
+
+    def start_consumer(self):
+        """Start handing logged messages to the handlers. Call once, after
+        the message handlers are registered; no-op without ingress log."""
+        if self._ingress is not None:
+            self._ingress.start(self._dispatch)
+
+    def ack(self, msg: dict):
+        """Mark a message as fully processed in the ingress log. Handlers that
+        set msg["ack_deferred"] must call this themselves when done."""
+        seq = msg.get("ingress_seq")
+        if seq is not None and self._ingress is not None:
+            self._ingress.ack(seq)
+
+    def ingress_stats(self) -> dict | None:
+        return self._ingress.stats() if self._ingress is not None else None
+
+    def close(self):
+        if self._ingress is not None:
+            self._ingress.close()
+
     # ── inbox ───────────────────────────────────────────────
 
     def get_inbox(self) -> list[dict]:
@@ -284,6 +314,18 @@ class PKICashTransport:
 
     def _process_incoming(self, raw_data):
         """Shared logic for processing incoming data from Packet or Resource."""
+        if self._ingress is not None:
+            # Log and return; the consumer thread runs the handlers
+            try:
+                self._ingress.append(raw_data)
+                return
+            except Exception as exc:
+                print(f"[INGRESS] append MISLUKT, direct verwerken: {exc}", flush=True)
+        self._dispatch(None, raw_data)
+
+    def _dispatch(self, seq, raw_data):
+        """Decode one message and run the message handlers. seq is its
+        ingress log seq, or None without ingress log."""
         try:
             decompressed = zlib.decompress(raw_data)
             msg = json.loads(decompressed.decode("utf-8"))
@@ -291,7 +333,11 @@ class PKICashTransport:
             try:
                 msg = json.loads(raw_data.decode("utf-8"))
             except Exception:
+                if seq is not None:
+                    self._ingress.ack(seq)
                 return
+        if seq is not None:
+            msg["ingress_seq"] = seq
 
         print(f"[MSG IN] type={msg.get('type','?')} from={msg.get('from_role','?')}", flush=True)
 
@@ -308,6 +354,8 @@ class PKICashTransport:
                 print(f"[HANDLER CRASH] {exc}", flush=True)
                 import traceback
                 print(traceback.format_exc(), flush=True)
+        if not msg.get("ack_deferred"):
+            self.ack(msg)
 
     def _on_packet(self, raw_data, packet):
         """Called when a small packet arrives over an inbound Link."""
@@ -0,0 +1,126 @@
+"""
+Process-pool Ed25519 verification for the state engine.
+
+Signature checks are shipped to worker processes in chunks of
+(pk_bytes, message, signature) triples. verify_batch() splits a known batch
+into chunks. submit()/verify() queue single checks, and a background thread
+gathers them into chunks of up to batch_size or until max_latency_ms has
+passed. Only verification is offloaded; the engine keeps doing all SQLite
+writes itself.
+"""
+
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from src.crypto_utils import verify
+
+
+def _verify_chunk(triples: list[tuple[bytes, bytes, bytes]]) -> list[bool]:
+    results = []
+    for pk, message, signature in triples:
+        try:
+            results.append(verify(pk, message, signature))
+        except Exception:
+            results.append(False)
+    return results
+
+
+class VerificationExecutor:
+    def __init__(self, workers: int = None, batch_size: int = 64, max_latency_ms: float = 2.0):
+        self.batch_size = max(1, batch_size)
+        self.max_latency_s = max_latency_ms / 1000
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._queue: queue.Queue = queue.Queue()
+        self._stats = {"verified": 0, "chunks": 0, "queued_batches": 0}
+        self._stats_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._batch_loop, daemon=True)
+        self._thread.start()
+
+    def verify_batch(self, triples: list[tuple[bytes, bytes, bytes]]) -> list[bool]:
+        if not triples:
+            return []
+        chunks = [triples[i:i + self.batch_size] for i in range(0, len(triples), self.batch_size)]
+        futures = [self._pool.submit(_verify_chunk, c) for c in chunks]
+        self._count(len(triples), len(chunks))
+        return [ok for f in futures for ok in f.result()]
+
+    def submit(self, pk: bytes, message: bytes, signature: bytes) -> Future:
+        future = Future()
+        self._queue.put((pk, message, signature, future))
+        return future
+
+    def verify(self, pk: bytes, message: bytes, signature: bytes) -> bool:
+        return self.submit(pk, message, signature).result()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "batch_size": self.batch_size,
+                "max_latency_ms": self.max_latency_s * 1000,
+                "queue_depth": self._queue.qsize(),
+                **self._stats,
+            }
+
+    def shutdown(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._pool.shutdown(wait=True)
+
+    def _count(self, verified: int, chunks: int, queued: bool = False):
+        with self._stats_lock:
+            self._stats["verified"] += verified
+            self._stats["chunks"] += chunks
+            if queued:
+                self._stats["queued_batches"] += 1
+
+    def _batch_loop(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_latency_s
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        try:
+            chunk_future = self._pool.submit(_verify_chunk, [(p, m, s) for p, m, s, _ in batch])
+        except RuntimeError as exc:
+            for *_, future in batch:
+                future.set_exception(exc)
+            return
+        self._count(len(batch), 1, queued=True)
+
+        def _done(f):
+            try:
+                results = f.result()
+            except Exception as exc:
+                for *_, future in batch:
+                    future.set_exception(exc)
+                return
+            for (*_, future), ok in zip(batch, results):
+                future.set_result(ok)
+
+        chunk_future.add_done_callback(_done)
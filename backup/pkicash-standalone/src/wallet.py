@@ -3,25 +3,33 @@ from datetime import datetime
 from pathlib import Path
 
 from src.crypto_utils import (
-    generate_keypair, sign, verify, sk_to_hex, pk_to_hex,
+    generate_keypair, sign, verify_hex, sk_to_hex, pk_to_hex,
     sk_from_hex, pk_from_hex, build_payload,
 )
-from src.coin import Coin
+from src.coin import Coin, reissue_digest
+from src.merkle import merkle_root_from_path
+
+# How many verified Merkle roots a wallet remembers
+VERIFIED_ROOTS_MAX = 1024
 
 
 class Wallet:
     def __init__(self, wallet_path: str):
         self._path = Path(wallet_path)
-        self._data = {"coins": {}, "pending_keypairs": {}, "transaction_log": [], "contacts": [], "address": ""}
+        self._data = {"coins": {}, "pending_keypairs": {}, "pending_reissues": {}, "pending_sends": {},
+                      "transaction_log": [], "contacts": [], "address": ""}
         if self._path.exists():
             stored = json.loads(self._path.read_text())
             self._data.update(stored)
             for key in ("transaction_log", "contacts"):
                 if key not in self._data:
                     self._data[key] = []
+            self._data.setdefault("pending_reissues", {})
+            self._data.setdefault("pending_sends", {})
             if "address" not in self._data:
                 self._data["address"] = ""
         self.address = self._data["address"]
+        self._verified_roots: dict[tuple[str, str], None] = {}
 
     def get_address(self):
         return self._data.get("address", "")
@@ -102,6 +110,7 @@ class Wallet:
 
         return {
             "coin_id": coin_id,
+            "pk_current": entry["coin"]["pk_current"],
             "pk_next": pk_next_hex,
             "recipient_address": recipient_address,
             "signature": signature.hex(),
@@ -118,7 +127,161 @@ class Wallet:
                   description=description)
         self._save()
 
-    def receive_from_engine(self, delivery: dict):
+    def hold_for_send(self, coin_ids: list[str], recipient_address: str = None, description: str = None):
+        """Park coins whose transfer was sent until the engine answers; they
+        keep their keys but can no longer be spent."""
+        for coin_id in coin_ids:
+            entry = self._data["coins"].pop(coin_id, None)
+            if entry is not None:
+                self._data["pending_sends"][coin_id] = {
+                    **entry, "recipient_address": recipient_address, "description": description}
+        self._save()
+
+    def confirm_sent(self, coin_ids: list[str]) -> int:
+        """The engine moved the parked coins to their recipient. Returns how
+        many were still parked."""
+        confirmed = 0
+        for coin_id in coin_ids:
+            entry = self._data["pending_sends"].pop(coin_id, None)
+            if entry is None:
+                continue
+            self._log("verstuurd", coin_id, waarde=entry["coin"]["waarde"],
+                      counterparty=entry["recipient_address"], coin_data=entry["coin"],
+                      description=entry["description"])
+            confirmed += 1
+        if confirmed:
+            self._save()
+        return confirmed
+
+    def cancel_send(self, coin_ids: list[str]) -> int:
+        """Put parked coins back after a rejected or refused transfer.
+        Returns how many coins were restored."""
+        restored = 0
+        for coin_id in coin_ids:
+            entry = self._data["pending_sends"].pop(coin_id, None)
+            if entry is not None:
+                self._data["coins"][coin_id] = {
+                    k: v for k, v in entry.items() if k not in ("recipient_address", "description")}
+                restored += 1
+        if restored:
+            self._save()
+        return restored
+
+    def create_reissue(self, coin_ids: list[str], denominations: list[int],
+                       recipient_address: str = "") -> dict:
+        """Signed split/merge request for the engine: retire coin_ids and
+        receive new coins of the given denominations on fresh keys of this
+        wallet. The denominations must add up to the value of the coins."""
+        entries = []
+        for coin_id in coin_ids:
+            entry = self._data["coins"].get(coin_id)
+            if entry is None:
+                raise ValueError(f"Coin {coin_id} niet in wallet")
+            entries.append(entry)
+        if not denominations or any(type(d) is not int or d <= 0 for d in denominations):
+            raise ValueError("Ongeldige coupures")
+        if sum(denominations) != sum(e["coin"]["waarde"] for e in entries):
+            raise ValueError("Coupures tellen niet op tot de waarde van de coins")
+
+        outputs = []
+        for waarde in denominations:
+            sk, pk = generate_keypair()
+            pk_hex = pk_to_hex(pk)
+            self._data["pending_keypairs"][pk_hex] = sk_to_hex(sk)
+            outputs.append({"waarde": waarde, "pk_owner": pk_hex})
+        self._save()
+
+        digest = reissue_digest(coin_ids, outputs)
+        inputs = [{
+            "coin_id": coin_id,
+            "signature": sign(sk_from_hex(entry["sk_current"]), build_payload("reissue", coin_id, digest)).hex(),
+        } for coin_id, entry in zip(coin_ids, entries)]
+        return {
+            "inputs": inputs,
+            "outputs": outputs,
+            "recipient_address": recipient_address or self.address,
+        }
+
+    def create_split(self, coin_id: str, denominations: list[int], recipient_address: str = "") -> dict:
+        return self.create_reissue([coin_id], denominations, recipient_address)
+
+    def create_merge(self, coin_ids: list[str], recipient_address: str = "") -> dict:
+        total = sum(self._data["coins"][c]["coin"]["waarde"] for c in coin_ids if c in self._data["coins"])
+        return self.create_reissue(coin_ids, [total], recipient_address)
+
+    def hold_for_reissue(self, coin_ids: list[str], outputs: list[dict] = None):
+        """Park the input coins of a sent split/merge until the engine
+        answers; they keep their keys but can no longer be spent. outputs
+        are the request's outputs, whose keys go if it is refused."""
+        output_pks = [o["pk_owner"] for o in outputs or []]
+        for coin_id in coin_ids:
+            entry = self._data["coins"].pop(coin_id, None)
+            if entry is not None:
+                self._data["pending_reissues"][coin_id] = {**entry, "output_pks": output_pks}
+        self._save()
+
+    def confirm_reissue(self, coin_ids: list[str]):
+        """The engine retired the inputs; the new coins arrive as "reissued"
+        deliveries."""
+        for coin_id in coin_ids:
+            entry = self._data["pending_reissues"].pop(coin_id, None)
+            if entry is None:
+                continue
+            self._log("ingewisseld", coin_id, waarde=entry["coin"]["waarde"], coin_data=entry["coin"])
+        self._save()
+
+    def cancel_reissue(self, coin_ids: list[str]) -> int:
+        """Put parked inputs back after a rejected or refused split/merge and
+        forget the keys of its outputs. Returns how many coins were restored."""
+        restored = 0
+        for coin_id in coin_ids:
+            entry = self._data["pending_reissues"].pop(coin_id, None)
+            if entry is not None:
+                # The new coins will never arrive: drop their keys
+                for pk_hex in entry.pop("output_pks", []):
+                    self._data["pending_keypairs"].pop(pk_hex, None)
+                self._data["coins"][coin_id] = entry
+                restored += 1
+        if restored:
+            self._save()
+        return restored
+
+    def held_coins(self, coin_ids: list[str]) -> dict[str, dict]:
+        """Coin data of the parked sends and split/merge inputs among coin_ids."""
+        held = {}
+        for coin_id in coin_ids:
+            entry = self._data["pending_sends"].get(coin_id) or self._data["pending_reissues"].get(coin_id)
+            if entry is not None:
+                held[coin_id] = entry["coin"]
+        return held
+
+    def receive_from_engine(self, delivery: dict, on_received=None):
+        """Apply one engine delivery. on_received(delivery) may update more
+        wallet state before the write."""
+        self._apply_delivery(delivery)
+        if on_received is not None:
+            on_received(delivery)
+        self._save()
+
+    def receive_batch_from_engine(self, deliveries: list[dict], on_received=None) -> list[str | None]:
+        """Apply several engine deliveries with a single wallet write.
+        on_received(delivery) runs for each accepted one before that write.
+        Returns, per delivery, None or the reason it was refused."""
+        errors = []
+        for delivery in deliveries:
+            try:
+                self._apply_delivery(delivery)
+                errors.append(None)
+            except (ValueError, KeyError, TypeError) as exc:
+                errors.append(str(exc))
+                continue
+            if on_received is not None:
+                on_received(delivery)
+        if any(e is None for e in errors):
+            self._save()
+        return errors
+
+    def _apply_delivery(self, delivery: dict):
         confirmation = delivery["confirmation"]
         coin_data = delivery["coin"]
         coin_id = coin_data["coin_id"]
@@ -126,10 +289,9 @@ class Wallet:
         status = confirmation["status"]
 
         engine_payload = build_payload(coin_id, pk_current, status)
-        pk_engine_hex = confirmation["pk_engine"]
-        engine_sig_hex = confirmation["engine_signature"]
-
-        if not verify(bytes.fromhex(pk_engine_hex), engine_payload, bytes.fromhex(engine_sig_hex)):
+        if "merkle_root" in confirmation:
+            self._verify_merkle_confirmation(confirmation, engine_payload)
+        elif not verify_hex(confirmation["pk_engine"], engine_payload, confirmation["engine_signature"]):
             raise ValueError("Ongeldige engine signature op bevestiging")
 
         sk_hex = self._data["pending_keypairs"].pop(pk_current, None)
@@ -141,18 +303,39 @@ class Wallet:
             "sk_current": sk_hex,
         }
 
-        action = "ontvangen van bank" if status == "issued" else "betaling ontvangen"
+        action = {"issued": "ontvangen van bank", "reissued": "omgewisseld"}.get(status, "betaling ontvangen")
         counterparty = delivery.get("sender_dest", "")
         description = delivery.get("description")
         self._log(action, coin_id, waarde=coin_data.get("waarde"),
                   counterparty=counterparty, coin_data=coin_data,
                   description=description)
-        self._save()
 
-    def validate_coin(self, coin: Coin, trusted_issuers: list[str]) -> bool:
+    def _verify_merkle_confirmation(self, confirmation: dict, engine_payload: bytes):
+        """Check the leaf's inclusion path, then the engine signature on the
+        root unless that root was verified before."""
+        root_hex = confirmation["merkle_root"]
+        try:
+            included = merkle_root_from_path(engine_payload, confirmation["merkle_path"]).hex() == root_hex
+        except (TypeError, ValueError):
+            included = False
+        if not included:
+            raise ValueError("Bevestiging hoort niet bij de Merkle root")
+
+        key = (confirmation["pk_engine"], root_hex)
+        if key in self._verified_roots:
+            return
+        if not verify_hex(confirmation["pk_engine"], build_payload("merkle", root_hex),
+                          confirmation["engine_signature"]):
+            raise ValueError("Ongeldige engine signature op Merkle root")
+        self._verified_roots[key] = None
+        if len(self._verified_roots) > VERIFIED_ROOTS_MAX:
+            del self._verified_roots[next(iter(self._verified_roots))]
+
+    def validate_coin(self, coin: Coin, trusted_issuers: list[str],
+                      trusted_engines: list[str] = ()) -> bool:
         if coin.pk_issuer not in trusted_issuers:
             return False
-        return coin.verify_issuer()
+        return coin.verify_origin(trusted_engines)
 
     def get_transaction_log(self) -> list[dict]:
         return list(reversed(self._data.get("transaction_log", [])))
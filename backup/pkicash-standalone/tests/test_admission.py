@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+from src.admission import IngressQueue, TokenBucket
+from src.delivery_coalescer import DeliveryCoalescer
+from src.engine import StateEngine
+from tests.test_pipeline import _HeldPipeline, _Outbox
+
+
+class _Held:
+    """Handler that blocks on its first message until released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.handled = []
+        self.done = threading.Condition()
+
+    def __call__(self, message):
+        self.started.set()
+        self.release.wait(5)
+        with self.done:
+            self.handled.append(message["type"])
+            self.done.notify_all()
+
+    def wait_for(self, n):
+        with self.done:
+            return self.done.wait_for(lambda: len(self.handled) >= n, 5)
+
+
+def _msg(msg_type, sender="peer"):
+    return {"type": msg_type, "from_hash": sender, "payload": {}}
+
+
+@pytest.fixture
+def held():
+    handler = _Held()
+    shed = []
+    queue = IngressQueue(handler, lambda m, reason: shed.append((m["type"], reason)),
+                         max_size=3, rate=0)
+    # Occupy the single worker so the following messages stay queued
+    queue.offer(_msg("register_issuer"))
+    assert handler.started.wait(5)
+    yield queue, handler, shed
+    handler.release.set()
+    queue.shutdown()
+
+
+def test_transactions_jump_the_queue(held):
+    queue, handler, _ = held
+    for msg_type in ("register_issuer", "register_coin", "transaction"):
+        assert queue.offer(_msg(msg_type))
+    handler.release.set()
+    assert handler.wait_for(4)
+    assert handler.handled == ["register_issuer", "transaction", "register_coin", "register_issuer"]
+
+
+def test_full_queue_sheds_lowest_priority_first(held):
+    queue, handler, shed = held
+    for msg_type in ("register_issuer", "register_coin", "register_coin"):
+        assert queue.offer(_msg(msg_type))
+
+    assert queue.offer(_msg("transaction"))
+    assert shed == [("register_issuer", "full")]
+    assert queue.offer(_msg("transaction"))
+    assert shed[-1] == ("register_coin", "full")
+    # Nothing lower left to push out
+    assert not queue.offer(_msg("register_coin"))
+    assert shed[-1] == ("register_coin", "full")
+    assert queue.stats()["evicted"] == 2
+
+
+def test_rate_limit_is_per_sender():
+    shed = []
+    queue = IngressQueue(lambda m: None, lambda m, reason: shed.append((m["from_hash"], reason)),
+                         rate=1, burst=2)
+    assert queue.offer(_msg("transaction", "a"))
+    assert queue.offer(_msg("transaction", "a"))
+    assert not queue.offer(_msg("transaction", "a"))
+    assert queue.offer(_msg("transaction", "b"))
+    assert shed == [("a", "rate")]
+    assert 0 < queue.retry_after_s("a") <= 1
+    queue.shutdown()
+
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(rate=2, burst=1)
+    now = bucket.updated
+    assert bucket.take(now)
+    assert not bucket.take(now + 0.1)
+    assert bucket.take(now + 0.6)
+
+
+def test_transactions_keep_priority_in_front_of_the_pipeline():
+    # The default actor setup: ingress workers wait for room in the pipeline
+    engine = StateEngine()
+    outbox = _Outbox()
+    coalescer = DeliveryCoalescer(engine, outbox.send)
+    pipeline = _HeldPipeline(engine, outbox.send, coalescer, queue_size=1)
+    done = []
+    arrived = threading.Condition()
+
+    def finished(tag):
+        with arrived:
+            done.append(tag)
+            arrived.notify_all()
+
+    def handle(message):
+        tag = message["payload"]["tag"]
+        assert pipeline.submit(message["type"], message["payload"], "peer", "wallet",
+                               on_done=lambda: finished(tag), wait_s=5)
+
+    queue = IngressQueue(handle, rate=0)
+    try:
+        for i in range(3):
+            queue.offer({"type": "register_coin_batch", "from_hash": "peer", "payload": {"tag": f"fill{i}"}})
+        # Decode holds one, its queue one, and the ingress worker waits with the third
+        deadline = time.monotonic() + 5
+        while (queue.stats()["queued"] or pipeline.stats()["ingest"]["accepted"] < 2) \
+                and time.monotonic() < deadline:
+            time.sleep(0.01)
+        queue.offer({"type": "register_coin_batch", "from_hash": "peer", "payload": {"tag": "registration"}})
+        queue.offer({"type": "transaction", "from_hash": "peer", "payload": {"tag": "transaction"}})
+        assert queue.stats()["queued"] == 2
+
+        pipeline.gate.set()
+        with arrived:
+            assert arrived.wait_for(lambda: len(done) == 5, 5)
+        assert done[3:] == ["transaction", "registration"]
+    finally:
+        pipeline.gate.set()
+        queue.shutdown()
+        pipeline.shutdown()
+        coalescer.close()
+        engine.close()
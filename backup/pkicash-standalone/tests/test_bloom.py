@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from src.bloom import BloomFilter
+from src.engine import DoubleSpendError, StateEngine
+from src.issuer import Issuer
+from tests.test_engine import _issue, _tx
+
+
+def test_false_positive_rate_near_target():
+    bloom = BloomFilter(10000, fp_rate=0.01)
+    for _ in range(10000):
+        bloom.add(os.urandom(48))
+    hits = sum(os.urandom(48) in bloom for _ in range(20000))
+    assert hits / 20000 < 0.02
+
+
+def _claimed(engine, coin, sk):
+    tx, sk_next = _tx(coin.coin_id, sk)
+    tx["pk_current"] = engine.get_coin_state(coin.coin_id)["pk_current"]
+    return tx, sk_next
+
+
+@pytest.fixture
+def spent_engine(tmp_path):
+    issuer = Issuer()
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"), spent_filter_fp=1e-6)
+    engine.register_issuer(issuer.pk_hex)
+    yield issuer, engine
+    engine.close()
+
+
+def test_replay_rejected_without_signature_check(spent_engine, monkeypatch):
+    issuer, engine = spent_engine
+    coin, sk = _issue(issuer, engine)
+    replay, _ = _claimed(engine, coin, sk)
+    engine.process_transaction(_claimed(engine, coin, sk)[0])
+
+    checked = []
+    monkeypatch.setattr(engine, "_check_signatures", lambda triples: checked.extend(triples) or [])
+    with pytest.raises(DoubleSpendError):
+        engine.process_transaction(replay)
+    [result] = engine.process_transactions([replay])
+    assert not result["ok"]
+    assert checked == []
+    assert engine.connection_stats()["spent_filter"]["rejected"] == 2
+
+
+def test_filter_is_opt_in():
+    engine = StateEngine()
+    assert engine.connection_stats()["spent_filter"] is None
+    engine.close()
+
+
+def test_full_filter_starts_over():
+    issuer = Issuer()
+    engine = StateEngine(spent_filter_fp=1e-6, spent_filter_capacity=2)
+    engine.register_issuer(issuer.pk_hex)
+    for _ in range(3):
+        coin, sk = _issue(issuer, engine)
+        engine.process_transaction(_claimed(engine, coin, sk)[0])
+    stats = engine.connection_stats()["spent_filter"]
+    assert stats["capacity"] == 4 and stats["items"] == 0
+    engine.close()
+
+
+def test_false_positive_confirmed_by_cache(spent_engine):
+    issuer, engine = spent_engine
+    coin, sk = _issue(issuer, engine)
+    tx, _ = _claimed(engine, coin, sk)
+    # Force a filter hit for the current (unspent) owner key
+    engine._spent.add(bytes.fromhex(coin.coin_id.replace("-", "")) + bytes.fromhex(tx["pk_current"]))
+
+    assert engine.process_transaction(tx)["status"] == "confirmed"
+    assert engine.connection_stats()["spent_filter"]["false_positives"] == 1
+
@@ -0,0 +1,44 @@
+import base64
+import uuid
+
+import pytest
+
+from src.coin_status import (
+    STATUS_BATCH_MAX, decode_request, decode_status, encode_request, encode_status, fingerprint,
+)
+from src.engine import StateEngine
+from src.issuer import Issuer
+from tests.test_engine import _issue, _tx
+
+
+def test_round_trip_through_engine_read_path():
+    issuer = Issuer()
+    engine = StateEngine()
+    engine.register_issuer(issuer.pk_hex)
+    coins = [_issue(issuer, engine) for _ in range(10)]
+    moved_tx, _ = _tx(coins[3][0].coin_id, coins[3][1])
+    engine.process_transaction(moved_tx)
+    engine._owners.clear()  # half from the cache, half from the database
+    for coin, _ in coins[:5]:
+        engine.get_coin_state(coin.coin_id)
+
+    coin_ids = [c.coin_id for c, _ in coins] + [str(uuid.uuid4())]
+    keys = decode_request(encode_request(coin_ids))
+    blob = encode_status(keys, engine.coin_owners(keys))
+    # 2 bytes count, 2 bytes bitmap, 8 bytes per known coin
+    assert len(base64.b64decode(blob)) == 2 + 2 + 8 * 10
+
+    prints = decode_status(blob, coin_ids)
+    assert prints[coin_ids[-1]] is None
+    assert prints[coins[3][0].coin_id] == fingerprint(bytes.fromhex(moved_tx["pk_next"]))
+    for coin_id in coin_ids[:10]:
+        state = engine.get_coin_state(coin_id)
+        assert prints[coin_id] == fingerprint(bytes.fromhex(state["pk_current"]))
+    engine.close()
+
+
+def test_request_size_is_bounded():
+    with pytest.raises(ValueError):
+        encode_request([str(uuid.uuid4()) for _ in range(STATUS_BATCH_MAX + 1)])
+    with pytest.raises(ValueError):
+        decode_request("AAAA")
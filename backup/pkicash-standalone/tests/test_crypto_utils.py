@@ -0,0 +1,38 @@
+from src.crypto_utils import (
+    generate_keypair, sign, verify, verify_hex, verify_key, verify_key_cache_info,
+    verify_key_hex, pk_to_hex,
+    build_payload,
+)
+
+
+def test_verify_hex_matches_verify():
+    sk, pk = generate_keypair()
+    msg = build_payload("coin", "pk")
+    sig = sign(sk, msg)
+
+    assert verify(pk.encode(), msg, sig)
+    assert verify_hex(pk_to_hex(pk), msg, sig.hex())
+    assert not verify_hex(pk_to_hex(pk), build_payload("coin", "other"), sig.hex())
+
+
+def test_verify_key_is_cached():
+    sk, pk = generate_keypair()
+    msg = b"payload"
+    sig = sign(sk, msg)
+
+    before = verify_key.cache_info()
+    for _ in range(5):
+        assert verify(pk.encode(), msg, sig)
+    after = verify_key.cache_info()
+    assert after.misses - before.misses == 1
+    assert after.hits - before.hits == 4
+
+
+def test_hex_lookups_count_in_the_cache_info():
+    _, pk = generate_keypair()
+    before = verify_key_cache_info()
+    verify_key_hex(pk_to_hex(pk))
+    verify_key(pk.encode())
+    after = verify_key_cache_info()
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 1
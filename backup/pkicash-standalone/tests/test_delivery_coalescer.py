@@ -0,0 +1,73 @@
+import pytest
+
+from src.delivery_coalescer import PACK_TYPE, DeliveryCoalescer, pack_deliveries, unpack_deliveries
+from src.engine import StateEngine
+from src.engine_pipeline import EnginePipeline
+from src.issuer import Issuer
+from tests.test_engine import _issue, _tx
+from tests.test_pipeline import _Outbox, _batch_payload
+
+
+@pytest.fixture(params=[False, True], ids=["signed", "merkle"])
+def engine(request):
+    issuer = Issuer()
+    e = StateEngine(merkle_confirmations=request.param)
+    e.register_issuer(issuer.pk_hex)
+    yield e, issuer
+    e.close()
+
+
+def _paid(e, issuer, n):
+    coins = [_issue(issuer, e) for _ in range(n)]
+    e.get_pending_deliveries("wallet_a")
+    return [_tx(coin.coin_id, sk)[0] for coin, sk in coins]
+
+
+def test_pack_round_trip(engine):
+    e, issuer = engine
+    e.process_transactions(_paid(e, issuer, 5))
+    deliveries = e.get_pending_deliveries("wallet_b")
+    for i, d in enumerate(deliveries):
+        d["sender_dest"] = "payer"
+        if i % 2:
+            d["description"] = "koffie"
+
+    packed = pack_deliveries(deliveries)
+    assert unpack_deliveries(packed) == deliveries
+    assert packed["shared"]["coin"]["pk_issuer"] == issuer.pk_hex
+    assert packed["shared"]["extra"] == {"sender_dest": "payer"}
+    assert "pk_next" not in packed["items"][0]["confirmation"]
+
+
+def test_twenty_coins_arrive_as_one_message(engine):
+    e, issuer = engine
+    outbox = _Outbox()
+    coalescer = DeliveryCoalescer(e, outbox.send, window_s=0.2)
+    try:
+        for tx in _paid(e, issuer, 20):
+            e.process_transaction(tx)
+            coalescer.schedule("wallet_b", [tx["coin_id"]], "lunch", "payer")
+        assert outbox.wait_for("wallet_b", PACK_TYPE)
+    finally:
+        coalescer.close()
+    [(dest, msg_type, payload)] = outbox.sent
+    deliveries = unpack_deliveries(payload)
+    assert len(deliveries) == 20
+    assert all(d["description"] == "lunch" and d["sender_dest"] == "payer" for d in deliveries)
+    assert coalescer.stats()["messages"] == 1
+
+
+def test_pipeline_hands_recipients_to_the_coalescer(engine):
+    e, issuer = engine
+    outbox = _Outbox()
+    coalescer = DeliveryCoalescer(e, outbox.send, window_s=0.01)
+    pipeline = EnginePipeline(e, outbox.send, coalescer=coalescer)
+    try:
+        assert pipeline.submit("transaction_batch", _batch_payload(_paid(e, issuer, 20)), "payer", "wallet")
+        assert pipeline.wait_idle(timeout=5)
+        assert outbox.wait_for("wallet_b", PACK_TYPE)
+    finally:
+        pipeline.shutdown()
+        coalescer.close()
+    assert [t for _, t, _ in outbox.sent] == ["tx_batch_confirmed", PACK_TYPE]
+    assert len(unpack_deliveries(outbox.sent[1][2])) == 20
@@ -0,0 +1,457 @@
+import pytest
+from src.crypto_utils import generate_keypair, pk_to_hex, sign, build_payload
+from src.issuer import Issuer
+from src.coin import Coin, reissue_digest
+from src.engine import (
+    StateEngine, InvalidSignatureError, DoubleSpendError,
+    UnknownCoinError, UntrustedIssuerError,
+)
+
+
+def _issue(issuer, engine, recipient="wallet_a", waarde=1):
+    sk_owner, pk_owner = generate_keypair()
+    coin, transfer_info = issuer.issue_coin(
+        waarde, pk_to_hex(pk_owner), "engine_dest", engine.pk_hex,
+    )
+    engine.register_coin(coin, recipient, transfer_info["pk_next"],
+                         transfer_info["transfer_signature"])
+    return coin, sk_owner
+
+
+def _tx(coin_id, sk_owner, recipient="wallet_b"):
+    sk_next, pk_next = generate_keypair()
+    pk_next_hex = pk_to_hex(pk_next)
+    sig = sign(sk_owner, build_payload(coin_id, pk_next_hex))
+    return {
+        "coin_id": coin_id,
+        "pk_current": pk_to_hex(sk_owner.verify_key),
+        "pk_next": pk_next_hex,
+        "recipient_address": recipient,
+        "signature": sig.hex(),
+    }, sk_next
+
+
+def _reissue(coins, denominations, recipient="wallet_a"):
+    """Split/merge request for (coin, sk_owner) pairs; returns it with the output keys."""
+    keys = [generate_keypair() for _ in denominations]
+    outputs = [{"waarde": w, "pk_owner": pk_to_hex(pk)} for w, (_, pk) in zip(denominations, keys)]
+    digest = reissue_digest([c.coin_id for c, _ in coins], outputs)
+    inputs = [{"coin_id": c.coin_id, "signature": sign(sk, build_payload("reissue", c.coin_id, digest)).hex()}
+              for c, sk in coins]
+    return {"inputs": inputs, "outputs": outputs, "recipient_address": recipient}, [sk for sk, _ in keys]
+
+
+@pytest.fixture
+def setup():
+    issuer = Issuer()
+    engine = StateEngine()
+    engine.register_issuer(issuer.pk_hex)
+    coin, sk_owner = _issue(issuer, engine)
+    return {"issuer": issuer, "engine": engine, "coin": coin, "sk_owner": sk_owner}
+
+
+def test_register_coin_untrusted_issuer():
+    engine = StateEngine()
+    issuer = Issuer()
+    with pytest.raises(UntrustedIssuerError):
+        _issue(issuer, engine)
+
+
+def test_valid_transaction(setup):
+    engine = setup["engine"]
+    coin = setup["coin"]
+    tx, _ = _tx(coin.coin_id, setup["sk_owner"])
+
+    confirmation = engine.process_transaction(tx)
+    assert confirmation["status"] == "confirmed"
+    assert engine.get_coin_state(coin.coin_id)["pk_current"] == tx["pk_next"]
+
+
+def test_unknown_coin():
+    engine = StateEngine()
+    tx = {
+        "coin_id": "nonexistent",
+        "pk_current": "bb" * 32,
+        "pk_next": "aa" * 32,
+        "recipient_address": "wallet_b",
+        "signature": "00" * 64,
+    }
+    with pytest.raises(UnknownCoinError):
+        engine.process_transaction(tx)
+
+
+def test_process_transactions_batch(setup):
+    engine = setup["engine"]
+    issuer = setup["issuer"]
+    coins = [(setup["coin"], setup["sk_owner"])]
+    coins += [_issue(issuer, engine) for _ in range(3)]
+    engine.get_pending_deliveries("wallet_a")
+
+    txs = [_tx(c.coin_id, sk)[0] for c, sk in coins]
+    txs.append({**txs[0], "recipient_address": "wallet_c"})  # replay in same batch
+
+    results = engine.process_transactions(txs)
+    # The replay gets the first answer; the coin is not sent a second time
+    assert [r["ok"] for r in results] == [True] * 5
+    assert results[4]["confirmation"] == results[0]["confirmation"]
+    for tx in txs[:4]:
+        assert engine.get_coin_state(tx["coin_id"])["pk_current"] == tx["pk_next"]
+    assert len(engine.get_pending_deliveries("wallet_b")) == 4
+    assert engine.get_pending_deliveries("wallet_c") == []
+
+
+def test_malformed_signature_only_fails_its_own_item(setup):
+    engine, issuer = setup["engine"], setup["issuer"]
+    other, other_sk = _issue(issuer, engine)
+    good, _ = _tx(other.coin_id, other_sk)
+    bad, _ = _tx(setup["coin"].coin_id, setup["sk_owner"])
+    bad["signature"] = "abcd"
+
+    results = engine.process_transactions([good, bad])
+    assert [r["ok"] for r in results] == [True, False]
+    with pytest.raises(InvalidSignatureError):
+        engine.process_transaction(bad)
+
+    sk, pk = generate_keypair()
+    coin, info = issuer.issue_coin(1, pk_to_hex(pk), "engine_dest", engine.pk_hex)
+    items = [{"coin": coin, **info}, {"coin": coin, **info, "transfer_signature": "ab"}]
+    assert [r["ok"] for r in engine.register_coins(items[::-1], "wallet_a")] == [False, True]
+
+
+def test_register_coins_batch():
+    issuer = Issuer()
+    engine = StateEngine()
+    engine.register_issuer(issuer.pk_hex)
+
+    items = []
+    for _ in range(3):
+        _, pk_owner = generate_keypair()
+        coin, transfer_info = issuer.issue_coin(1, pk_to_hex(pk_owner), "engine_dest", engine.pk_hex)
+        items.append({"coin": coin, **transfer_info})
+    items[1]["transfer_signature"] = "00" * 64  # tampered
+
+    results = engine.register_coins(items, "wallet_a")
+    assert [r["ok"] for r in results] == [True, False, True]
+    assert engine.get_coin_state(items[1]["coin"].coin_id) is None
+    deliveries = engine.get_pending_deliveries("wallet_a")
+    assert {d["coin"]["coin_id"] for d in deliveries} == {items[0]["coin"].coin_id, items[2]["coin"].coin_id}
+
+
+def test_connection_stats_and_close(setup):
+    engine = setup["engine"]
+    stats = engine.connection_stats()
+    assert stats["open"] is True
+    assert stats["connections_opened"] == 1
+    assert stats["commits"] >= 2
+
+    engine.close()
+    assert engine.connection_stats()["open"] is False
+
+
+def test_pooled_readers_on_file_db(tmp_path):
+    import threading
+
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"), max_readers=4, cache_max_bytes=0)
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    coin, sk_owner = _issue(issuer, engine)
+    tx, _ = _tx(coin.coin_id, sk_owner)
+
+    errors = []
+
+    def read():
+        try:
+            for _ in range(50):
+                assert engine.get_coin_state(coin.coin_id) is not None
+                assert engine.list_issuers() == [issuer.pk_hex]
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=read) for _ in range(6)]
+    for t in threads:
+        t.start()
+    engine.process_transaction(tx)
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert engine.get_coin_state(coin.coin_id)["pk_current"] == tx["pk_next"]
+    stats = engine.connection_stats()
+    assert stats["wal"] is True and stats["pooled_readers"] is True
+    # Overlapping reads use the pool, lone ones may go through the idle writer
+    assert stats["readers_open"] <= 4
+    assert stats["reader_checkouts"] + stats["writer_reads"] >= 6 * 50
+    engine.close()
+
+
+def test_lone_reader_bypasses_the_pool(tmp_path):
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"), cache_max_bytes=0)
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    coin, _ = _issue(issuer, engine)
+    assert engine.get_coin_state(coin.coin_id) is not None
+    stats = engine.connection_stats()
+    assert stats["readers_open"] == 0 and stats["writer_reads"] >= 1
+
+    # Inside the writer's own transaction a read still sees committed state only
+    with engine._write_lock:
+        engine._conn.execute("DELETE FROM coin_owner")
+        assert engine.get_coin_state(coin.coin_id) is not None
+        engine._conn.rollback()
+    assert engine.connection_stats()["readers_open"] == 1
+    engine.close()
+
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"), max_readers=0)
+    stats = engine.connection_stats()
+    assert stats["wal"] is True and stats["pooled_readers"] is False
+    engine.close()
+
+
+def test_concurrent_double_spend_raises(setup):
+    engine = setup["engine"]
+    coin = setup["coin"]
+    tx1, _ = _tx(coin.coin_id, setup["sk_owner"], "wallet_b")
+    tx2, _ = _tx(coin.coin_id, setup["sk_owner"], "wallet_c")
+
+    # Both spends pass verification against the same committed owner
+    v1 = engine._verify_transaction(tx1)
+    v2 = engine._verify_transaction(tx2)
+
+    engine._rotate_owner(v1)
+    with pytest.raises(DoubleSpendError):
+        engine._rotate_owner(v2)
+    assert engine.get_coin_state(coin.coin_id)["pk_current"] == tx1["pk_next"]
+
+
+def test_sequential_double_spend(setup):
+    engine = setup["engine"]
+    coin = setup["coin"]
+    tx1, _ = _tx(coin.coin_id, setup["sk_owner"], "wallet_b")
+    tx2, _ = _tx(coin.coin_id, setup["sk_owner"], "wallet_c")
+
+    engine.process_transaction(tx1)
+    with pytest.raises(DoubleSpendError):
+        engine.process_transaction(tx2)
+    # Leaving out pk_current does not skip the check
+    del tx2["pk_current"]
+    with pytest.raises(ValueError):
+        engine.process_transaction(tx2)
+
+
+def test_migrates_legacy_coins_table(tmp_path):
+    import json
+    import sqlite3
+
+    issuer = Issuer()
+    _, pk_owner = generate_keypair()
+    coin, _ = issuer.issue_coin(1, pk_to_hex(pk_owner), "engine_dest", "aa" * 32)
+    coin_data = {**coin.to_dict(), "pk_current": pk_to_hex(pk_owner)}
+
+    db_path = str(tmp_path / "engine.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE coins (coin_id TEXT PRIMARY KEY, pk_current TEXT NOT NULL, coin_data TEXT NOT NULL)")
+    conn.execute("INSERT INTO coins VALUES (?, ?, ?)",
+                 (coin.coin_id, coin_data["pk_current"], json.dumps(coin_data)))
+    conn.commit()
+    conn.close()
+
+    engine = StateEngine(db_path=db_path)
+    assert engine.get_coin_state(coin.coin_id)["pk_current"] == coin_data["pk_current"]
+    assert engine.list_coins()[0]["coin_data"] == coin_data
+    engine.close()
+
+
+def test_delivery_queue_stats_and_compaction(setup):
+    engine = setup["engine"]
+    tx, _ = _tx(setup["coin"].coin_id, setup["sk_owner"])
+    engine.process_transaction(tx)
+
+    stats = engine.delivery_queue_stats()
+    assert stats["pending"] == 2
+    assert stats["recipients_waiting"] == 2
+
+    engine.get_pending_deliveries("wallet_a")
+    assert engine.compact_deliveries(retention_s=3600) == 0
+    assert engine.compact_deliveries(retention_s=-1) == 1
+
+    stats = engine.delivery_queue_stats()
+    assert stats["pending"] == 1
+    assert stats["delivered_retained"] == 0
+
+    plan = engine._conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM pending_deliveries WHERE recipient_address = ? AND delivered = 0",
+        ("wallet_b",),
+    ).fetchall()
+    assert "idx_deliveries_recipient" in " ".join(r["detail"] for r in plan)
+
+
+def test_trusted_issuers_resident_with_change_hook(tmp_path):
+    db_path = str(tmp_path / "engine.db")
+    engine = StateEngine(db_path=db_path)
+    events = []
+    engine.on_issuer_change(lambda event, pk: events.append((event, pk)))
+
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    engine.register_issuer(issuer.pk_hex)  # no change, no event
+    assert events == [("added", issuer.pk_hex)]
+    engine.close()
+
+    reopened = StateEngine(db_path=db_path)
+    assert reopened.is_trusted_issuer(issuer.pk_hex)
+    assert reopened.list_issuers() == [issuer.pk_hex]
+    reopened.close()
+
+
+def test_list_coins_pages_and_filters(setup):
+    engine, issuer = setup["engine"], setup["issuer"]
+    for _ in range(4):
+        _issue(issuer, engine)
+    other = Issuer()
+    engine.register_issuer(other.pk_hex)
+    _issue(other, engine)
+
+    everything = engine.list_coins()
+    assert [c["coin_id"] for c in everything] == sorted(c["coin_id"] for c in everything)
+    pages, after = [], None
+    while True:
+        page = engine.list_coins(limit=2, after=after)
+        pages += page
+        if len(page) < 2:
+            break
+        after = page[-1]["coin_id"]
+    assert pages == everything == list(engine.iter_coins(page_size=2))
+    assert engine.count_coins() == 6
+
+    assert len(engine.list_coins(issuer=other.pk_hex)) == 1
+    owner = everything[3]["pk_current"]
+    assert [c["pk_current"] for c in engine.list_coins(owner_prefix=owner[:7])] == [owner]
+
+
+def test_stats_follow_issuance_and_transfers(tmp_path):
+    issuer = Issuer()
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"))
+    engine.register_issuer(issuer.pk_hex)
+    coins = [_issue(issuer, engine) for _ in range(3)]
+    engine.process_transactions([_tx(c.coin_id, sk)[0] for c, sk in coins[:2]])
+    # A copy of a request in the same batch is not counted twice
+    engine.process_transactions([_tx(coins[2][0].coin_id, coins[2][1])[0]] * 2)
+
+    stats = engine.stats()
+    assert stats["coins"] == 3
+    assert stats["outstanding_value"] == 3
+    assert stats["transfers"] == 3
+    assert stats["issuers"][issuer.pk_hex] == {"coins": 3, "value": 3, "transfers": 3}
+    assert sum(n for _, n in stats["transfers_per_minute"]) == 3
+    engine.close()
+
+    # Counters live in the database, not in memory
+    assert StateEngine(db_path=str(tmp_path / "engine.db")).stats()["transfers"] == 3
+
+
+def test_retransmission_returns_stored_confirmation(setup, monkeypatch):
+    engine, issuer = setup["engine"], setup["issuer"]
+    tx, _ = _tx(setup["coin"].coin_id, setup["sk_owner"])
+    confirmation = engine.process_transaction(tx)
+
+    sk_owner, pk_owner = generate_keypair()
+    coin, info = issuer.issue_coin(1, pk_to_hex(pk_owner), "engine_dest", engine.pk_hex)
+    item = {"coin": coin, **info}
+    [registered] = engine.register_coins([item], "wallet_a")
+
+    # Resends are answered from the replay cache without verifying anything
+    checked = []
+    monkeypatch.setattr(engine, "_check_signatures", lambda triples: checked.extend(triples) or [])
+    assert engine.process_transaction(tx) == confirmation
+    assert engine.process_transactions([tx])[0]["confirmation"] == confirmation
+    [again] = engine.register_coins([item], "wallet_a")
+    assert again["ok"] and again["confirmation"]["status"] == "issued"
+    engine.register_coin(coin, "wallet_a", info["pk_next"], info["transfer_signature"])
+    assert engine.get_coin_state(setup["coin"].coin_id)["pk_current"] == tx["pk_next"]
+    assert engine.stats()["transfers"] == 1
+    assert engine.connection_stats()["replay_cache"]["hits"] == 4
+    assert checked == []
+    monkeypatch.undo()
+
+    # A different transfer signed by the old key is still a double spend
+    with pytest.raises((DoubleSpendError, InvalidSignatureError)):
+        engine.process_transaction(_tx(setup["coin"].coin_id, setup["sk_owner"])[0])
+
+
+def test_copies_in_one_batch_share_a_confirmation(setup):
+    engine = setup["engine"]
+    tx, _ = _tx(setup["coin"].coin_id, setup["sk_owner"])
+    first, second = engine.process_transactions([tx, dict(tx)])
+    assert first["ok"] and second["ok"]
+    assert second["confirmation"] == first["confirmation"]
+    assert engine.stats()["transfers"] == 1
+
+
+def test_retry_verified_before_the_original_commits(setup):
+    engine = setup["engine"]
+    tx, _ = _tx(setup["coin"].coin_id, setup["sk_owner"])
+    # Both copies pass verification before either one is committed
+    checks = [engine.verify_transactions([tx]), engine.verify_transactions([dict(tx)])]
+    [first] = engine.commit_transactions([tx], checks[0])
+    [second] = engine.commit_transactions([dict(tx)], checks[1])
+    assert first["ok"] and second["ok"]
+    assert second["confirmation"] == first["confirmation"]
+    assert engine.get_coin_state(setup["coin"].coin_id)["pk_current"] == tx["pk_next"]
+
+    # A competing transfer verified at the same time still loses
+    tx_b, _ = _tx(setup["coin"].coin_id, setup["sk_owner"])
+    assert not engine.process_transactions([tx_b])[0]["ok"]
+
+
+def test_split_and_merge_keep_value_and_issuer(tmp_path):
+    issuer = Issuer()
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"))
+    engine.register_issuer(issuer.pk_hex)
+    coin, sk = _issue(issuer, engine, waarde=10)
+
+    request, sks = _reissue([(coin, sk)], [5, 3, 2])
+    confirmations = engine.process_reissue(request)
+    assert [c["status"] for c in confirmations] == ["reissued"] * 3
+    assert engine.get_coin_state(coin.coin_id) is None
+    deliveries = engine.get_pending_deliveries("wallet_a")
+    parts = [Coin.from_dict(d["coin"]) for d in deliveries if d["confirmation"]["status"] == "reissued"]
+    assert sorted(c.waarde for c in parts) == [2, 3, 5]
+    assert all(c.pk_issuer == issuer.pk_hex and c.verify_origin([engine.pk_hex]) and not c.verify_issuer()
+               for c in parts)
+    # A retransmission gets the same answer
+    assert engine.process_reissue(request) == confirmations
+
+    # Merge the three parts back into one coin
+    merged, _ = _reissue([(Coin.from_dict(d["coin"]), s) for d, s in zip(deliveries[1:], sks)], [10])
+    [confirmation] = engine.process_reissue(merged)
+    assert engine.count_coins() == 1
+    assert engine.stats()["issuers"][issuer.pk_hex]["value"] == 10
+    assert engine.get_coin_state(confirmation["coin_id"])["pk_current"] == merged["outputs"][0]["pk_owner"]
+
+
+def test_reissue_rejects_bad_requests(setup, monkeypatch):
+    engine, issuer = setup["engine"], setup["issuer"]
+    coin, sk = setup["coin"], setup["sk_owner"]
+    other, other_sk = _issue(issuer, engine)
+
+    with pytest.raises(ValueError):
+        engine.process_reissue(_reissue([(coin, sk)], [2])[0])
+    with pytest.raises(InvalidSignatureError):
+        engine.process_reissue(_reissue([(coin, sk), (other, sk)], [2])[0])
+    for pk_owner in ("ab" * 16, "zz" * 32, None):
+        request, _ = _reissue([(coin, sk), (other, other_sk)], [1, 1])
+        request["outputs"][0]["pk_owner"] = pk_owner
+        with pytest.raises(ValueError):
+            engine.process_reissue(request)
+
+    # The second input is spent after the request was verified: the CAS
+    # fails and nothing is retired or created
+    request, _ = _reissue([(coin, sk), (other, other_sk)], [2])
+    loaded = {c.coin_id: engine._load_coin(c.coin_id) for c in (coin, other)}
+    engine.process_transaction(_tx(other.coin_id, other_sk)[0])
+    monkeypatch.setattr(engine, "_load_coin", loaded.get)
+    with pytest.raises(DoubleSpendError):
+        engine.process_reissue(request)
+    assert engine.get_coin_state(coin.coin_id) is not None
+    assert engine.count_coins() == 2
+    assert engine.stats()["outstanding_value"] == 2
@@ -0,0 +1,65 @@
+import threading
+
+from src.ingress_log import IngressLog
+
+
+def _consume(log, ack=lambda seq: True):
+    seen = []
+    arrived = threading.Condition()
+
+    def handler(seq, message):
+        with arrived:
+            seen.append((seq, message))
+            arrived.notify_all()
+        if ack(seq):
+            log.ack(seq)
+
+    log.start(handler)
+    return seen, arrived
+
+
+def test_unacked_messages_are_replayed(tmp_path):
+    log = IngressLog(str(tmp_path))
+    seen, arrived = _consume(log, ack=lambda seq: seq != 2)
+    for i in range(3):
+        log.append(f"msg{i}".encode())
+    with arrived:
+        assert arrived.wait_for(lambda: len(seen) == 3, 5)
+    log.close()
+    # 1 and 3 are done, but the checkpoint stops before the unfinished 2
+    assert log.checkpoint == 1
+
+    reopened = IngressLog(str(tmp_path))
+    seen, arrived = _consume(reopened)
+    with arrived:
+        assert arrived.wait_for(lambda: len(seen) == 2, 5)
+    assert seen == [(2, b"msg1"), (3, b"msg2")]
+    assert reopened.append(b"next") == 4
+    reopened.close()
+
+
+def test_torn_tail_is_cut_off(tmp_path):
+    log = IngressLog(str(tmp_path))
+    log.append(b"first")
+    log.append(b"second")
+    log.close()
+    [segment] = tmp_path.glob("ingress-*.log")
+    segment.write_bytes(segment.read_bytes()[:-3])
+
+    reopened = IngressLog(str(tmp_path))
+    assert reopened.seq == 1
+    assert reopened.stats()["queued"] == 1
+    reopened.close()
+
+
+def test_checkpointed_segments_are_removed(tmp_path):
+    log = IngressLog(str(tmp_path), segment_bytes=64)
+    for i in range(10):
+        log.append(b"x" * 40)
+    assert log.stats()["segments"] > 5
+    for seq in range(1, 11):
+        log.ack(seq)
+    log.flush_checkpoint()
+    assert log.stats()["segments"] == 1
+    assert log.stats()["unacked"] == 0
+    log.close()
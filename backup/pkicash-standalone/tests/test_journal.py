@@ -0,0 +1,119 @@
+import uuid
+
+from src.engine import StateEngine
+from src.issuer import Issuer
+from src.journal import TRANSFER, Journal, read_records, recover
+from tests.test_engine import _issue, _tx
+
+
+def _journaled(tmp_path, **kwargs):
+    issuer = Issuer()
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"),
+                         journal_dir=str(tmp_path / "journal"), **kwargs)
+    engine.register_issuer(issuer.pk_hex)
+    return issuer, engine
+
+
+def _owners(engine):
+    return {c["coin_id"]: c["pk_current"] for c in engine.list_coins()}
+
+
+def test_recover_matches_engine_state(tmp_path):
+    issuer, engine = _journaled(tmp_path)
+    coins = [_issue(issuer, engine) for _ in range(3)]
+    tx, sk_next = _tx(coins[0][0].coin_id, coins[0][1])
+    engine.process_transaction(tx)
+    engine.process_transaction(_tx(coins[0][0].coin_id, sk_next)[0])
+
+    seq, state = recover(str(tmp_path / "journal"))
+    assert seq == 5
+    assert {str(uuid.UUID(bytes=k)): c[0].hex() for k, c in state.items()} == _owners(engine)
+    engine.close()
+
+
+def test_failed_transfer_is_not_journaled(tmp_path):
+    issuer, engine = _journaled(tmp_path)
+    coin, sk = _issue(issuer, engine)
+    # Two spends of the same coin in one batch: the second loses the CAS
+    results = engine.process_transactions([_tx(coin.coin_id, sk)[0], _tx(coin.coin_id, sk)[0]])
+    assert [r["ok"] for r in results] == [True, False]
+
+    transfers = [r for r in read_records(str(tmp_path / "journal")) if r[0] == TRANSFER]
+    assert len(transfers) == 1
+    engine.close()
+
+
+def test_rebuild_from_snapshot_and_tail(tmp_path):
+    issuer, engine = _journaled(tmp_path, snapshot_every=4)
+    coins = [_issue(issuer, engine) for _ in range(5)]
+    for coin, sk in coins[:3]:
+        engine.process_transaction(_tx(coin.coin_id, sk)[0])
+    expected = _owners(engine)
+    stats = engine.connection_stats()["journal"]
+    assert stats["snapshots"] == 2 and stats["seq"] == 8
+    engine.close()
+
+    # Same journal, empty database
+    (tmp_path / "engine.db").unlink()
+    for suffix in ("-wal", "-shm"):
+        (tmp_path / f"engine.db{suffix}").unlink(missing_ok=True)
+    fresh = StateEngine(db_path=str(tmp_path / "engine.db"), journal_dir=str(tmp_path / "journal"))
+    assert fresh.list_coins() == []
+    assert fresh.rebuild_from_journal() == 5
+    assert _owners(fresh) == expected
+    fresh.close()
+
+
+def test_existing_database_starts_with_snapshot(tmp_path):
+    issuer = Issuer()
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"))
+    engine.register_issuer(issuer.pk_hex)
+    _issue(issuer, engine)
+    engine.close()
+
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"), journal_dir=str(tmp_path / "journal"))
+    assert list((tmp_path / "journal").glob("snapshot-*.bin"))
+    assert len(recover(str(tmp_path / "journal"))[1]) == 1
+    engine.close()
+
+
+def test_torn_tail_is_cut_off(tmp_path):
+    issuer, engine = _journaled(tmp_path)
+    _issue(issuer, engine)
+    _issue(issuer, engine)
+    engine.close()
+    [segment] = (tmp_path / "journal").glob("journal-*.bin")
+    data = segment.read_bytes()
+    segment.write_bytes(data[:-10])
+
+    journal = Journal(str(tmp_path / "journal"))
+    assert journal.seq == 1
+    journal.close()
+    assert len(recover(str(tmp_path / "journal"))[1]) == 1
+
+
+def test_journal_behind_database_gets_a_snapshot(tmp_path):
+    issuer, engine = _journaled(tmp_path)
+    coin, sk = _issue(issuer, engine)
+    engine.close()
+    # A commit whose journal record was lost (crash before the append)
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"))
+    engine.process_transaction(_tx(coin.coin_id, sk)[0])
+    expected = _owners(engine)
+    engine.close()
+
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"), journal_dir=str(tmp_path / "journal"),
+                         journal_recover=True)
+    assert engine.connection_stats()["journal"]["snapshots"] == 0
+    engine.close()
+
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"), journal_dir=str(tmp_path / "journal"))
+    assert engine.connection_stats()["journal"]["snapshots"] == 1
+    _, state = recover(str(tmp_path / "journal"))
+    assert {str(uuid.UUID(bytes=k)): c[0].hex() for k, c in state.items()} == expected
+    engine.close()
+
+    # In step again: no further snapshot
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"), journal_dir=str(tmp_path / "journal"))
+    assert engine.connection_stats()["journal"]["snapshots"] == 0
+    engine.close()
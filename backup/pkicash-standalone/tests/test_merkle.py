@@ -0,0 +1,84 @@
+import pytest
+
+from src.crypto_utils import build_payload
+from src.engine import StateEngine
+from src.issuer import Issuer
+from src.merkle import merkle_root_from_path, merkle_tree
+from src.wallet import Wallet
+from tests.test_engine import _issue, _tx
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 5, 8, 9])
+def test_every_leaf_proves_the_root(n):
+    payloads = [f"leaf-{i}".encode() for i in range(n)]
+    root, paths = merkle_tree(payloads)
+    for payload, path in zip(payloads, paths):
+        assert merkle_root_from_path(payload, path) == root
+    assert merkle_root_from_path(b"other", paths[0]) != root
+
+
+@pytest.fixture
+def merkle_setup(tmp_path):
+    issuer = Issuer()
+    engine = StateEngine(merkle_confirmations=True)
+    engine.register_issuer(issuer.pk_hex)
+    wallet = Wallet(str(tmp_path / "wallet.json"))
+    yield issuer, engine, wallet
+    engine.close()
+
+
+def _register_batch(issuer, engine, wallet, n):
+    items = []
+    for _ in range(n):
+        coin, info = issuer.issue_coin(1, wallet.generate_receive_keypair(), "engine_dest", engine.pk_hex)
+        items.append({"coin": coin, **info})
+    assert all(r["ok"] for r in engine.register_coins(items, "wallet_a"))
+    return engine.get_pending_deliveries("wallet_a")
+
+
+def test_batch_shares_one_signed_root(merkle_setup):
+    issuer, engine, wallet = merkle_setup
+    deliveries = _register_batch(issuer, engine, wallet, 5)
+
+    roots = {d["confirmation"]["merkle_root"] for d in deliveries}
+    assert len(roots) == 1
+    for d in deliveries:
+        wallet.receive_from_engine(d)
+    assert wallet.get_balance() == 5
+    assert len(wallet._verified_roots) == 1
+
+
+def test_wallet_rejects_leaf_outside_root(merkle_setup):
+    issuer, engine, wallet = merkle_setup
+    first, second = _register_batch(issuer, engine, wallet, 2)
+    wallet.receive_from_engine(first)
+
+    # A valid root and path, but for a different coin
+    second["confirmation"]["merkle_path"] = first["confirmation"]["merkle_path"]
+    with pytest.raises(ValueError):
+        wallet.receive_from_engine(second)
+
+
+def test_wallet_rejects_forged_root(merkle_setup):
+    issuer, engine, wallet = merkle_setup
+    [delivery] = _register_batch(issuer, engine, wallet, 1)
+    confirmation = delivery["confirmation"]
+    coin = delivery["coin"]
+    confirmation["merkle_root"] = merkle_tree(
+        [build_payload(coin["coin_id"], coin["pk_current"], "issued")])[0].hex()
+    confirmation["engine_signature"] = "00" * 64
+    with pytest.raises(ValueError):
+        wallet.receive_from_engine(delivery)
+
+
+def test_transactions_confirmed_with_merkle_paths(merkle_setup):
+    issuer, engine, wallet = merkle_setup
+    coins = [_issue(issuer, engine) for _ in range(3)]
+    txs = [_tx(c.coin_id, sk)[0] for c, sk in coins]
+    results = engine.process_transactions(txs)
+    assert all(r["ok"] for r in results)
+    assert len({r["confirmation"]["merkle_root"] for r in results}) == 1
+    for tx, r in zip(txs, results):
+        leaf = build_payload(tx["coin_id"], tx["pk_next"], "confirmed")
+        assert merkle_root_from_path(leaf, r["confirmation"]["merkle_path"]).hex() == \
+            r["confirmation"]["merkle_root"]
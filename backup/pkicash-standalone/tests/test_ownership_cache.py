@@ -0,0 +1,67 @@
+from src.ownership_cache import OwnershipCache
+from src.engine import StateEngine
+from src.issuer import Issuer
+from tests.test_engine import _issue, _tx
+
+
+def test_lru_eviction_respects_memory_ceiling():
+    cache = OwnershipCache(max_bytes=3000)
+    for i in range(20):
+        cache.put(f"coin-{i}", bytes(32), {"coin_id": f"coin-{i}", "waarde": 1})
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 3000
+    assert stats["evictions"] > 0
+    assert cache.get("coin-19") is not None
+    assert cache.get("coin-0") is None
+
+
+def test_engine_validates_hot_coin_from_cache():
+    engine = StateEngine()
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    coin, sk = _issue(issuer, engine)
+
+    for _ in range(5):
+        tx, sk = _tx(coin.coin_id, sk)
+        engine.process_transaction(tx)
+
+    stats = engine.connection_stats()["ownership_cache"]
+    assert stats["hits"] == 5
+    assert stats["misses"] == 0
+    assert engine.get_coin_state(coin.coin_id)["pk_current"] == tx["pk_next"]
+
+
+def test_engine_cache_disabled():
+    engine = StateEngine(cache_max_bytes=0)
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    coin, sk = _issue(issuer, engine)
+    tx, _ = _tx(coin.coin_id, sk)
+    engine.process_transaction(tx)
+
+    assert engine.connection_stats()["ownership_cache"]["entries"] == 0
+    assert engine.get_coin_state(coin.coin_id)["pk_current"] == tx["pk_next"]
+
+
+def test_fill_never_replaces_a_committed_owner():
+    cache = OwnershipCache()
+    cache.put("coin", b"\x02" * 32, {"coin_id": "coin"})
+    cache.fill("coin", b"\x01" * 32, {"coin_id": "coin"})
+    assert cache.get("coin")[0] == b"\x02" * 32
+
+
+def test_stale_cache_entry_does_not_block_the_owner():
+    engine = StateEngine()
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    coin, sk = _issue(issuer, engine)
+    stale = engine._owners.get(coin.coin_id)
+    tx, sk = _tx(coin.coin_id, sk)
+    engine.process_transaction(tx)
+    # A write-through that lost the race would leave the previous owner cached
+    engine._owners.put(coin.coin_id, *stale)
+
+    tx, _ = _tx(coin.coin_id, sk)
+    engine.process_transaction(tx)
+    assert engine.get_coin_state(coin.coin_id)["pk_current"] == tx["pk_next"]
@@ -0,0 +1,169 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from src.crypto_utils import generate_keypair, pk_to_hex
+from src.delivery_coalescer import PACK_TYPE, DeliveryCoalescer, unpack_deliveries
+from src.engine import StateEngine
+from src.engine_pipeline import EnginePipeline
+from src.issuer import Issuer
+from tests.test_engine import _issue, _tx
+
+
+class _Outbox:
+    def __init__(self, blocked=()):
+        self.sent = []
+        self.release = threading.Event()
+        self._blocked = set(blocked)
+        self._lock = threading.Lock()
+        self.arrived = threading.Condition(self._lock)
+
+    def send(self, dest, role, msg_type, payload):
+        if dest in self._blocked:
+            self.release.wait(10)
+        with self._lock:
+            self.sent.append((dest, msg_type, payload))
+            self.arrived.notify_all()
+
+    def wait_for(self, dest, msg_type, timeout=5):
+        with self._lock:
+            return self.arrived.wait_for(
+                lambda: any(d == dest and t == msg_type for d, t, _ in self.sent), timeout)
+
+
+@pytest.fixture
+def engine():
+    issuer = Issuer()
+    e = StateEngine()
+    e.register_issuer(issuer.pk_hex)
+    yield e, issuer
+    e.close()
+
+
+@contextmanager
+def _running(e, outbox, cls=EnginePipeline, **kwargs):
+    coalescer = DeliveryCoalescer(e, outbox.send, window_s=0.01, send_workers=2)
+    pipeline = cls(e, outbox.send, coalescer, **kwargs)
+    try:
+        yield pipeline
+    finally:
+        outbox.release.set()
+        pipeline.shutdown()
+        coalescer.close()
+
+
+def _packs(outbox, dest):
+    return [d for dest_, t, p in outbox.sent if dest_ == dest and t == PACK_TYPE
+            for d in unpack_deliveries(p)]
+
+
+def _batch_payload(txs):
+    return {"transactions": [{
+        "coin_id": tx["coin_id"], "pk_current": tx["pk_current"], "pk_next": tx["pk_next"],
+        "recipient_dest": tx["recipient_address"], "signature": tx["signature"],
+    } for tx in txs]}
+
+
+def test_transaction_batch_through_pipeline(engine):
+    e, issuer = engine
+    outbox = _Outbox()
+    with _running(e, outbox) as pipeline:
+        c1, sk1 = _issue(issuer, e)
+        c2, _ = _issue(issuer, e)
+        e.get_pending_deliveries("wallet_a")
+        tx1, _ = _tx(c1.coin_id, sk1)
+        tx2, _ = _tx(c2.coin_id, sk1)  # wrong owner key
+
+        done = []
+        assert pipeline.submit("transaction_batch", _batch_payload([tx1, tx2]), "payer", "wallet",
+                               on_done=lambda: done.append("batch"))
+        # Dropped in decode (nothing to process) still counts as done
+        assert pipeline.submit("transaction", {}, "payer", "wallet",
+                               on_done=lambda: done.append("empty"))
+        assert pipeline.wait_idle(timeout=5)
+        assert sorted(done) == ["batch", "empty"]
+
+        replies = [p for d, t, p in outbox.sent if t == "tx_batch_confirmed"]
+        assert replies == [{"results": [
+            {"coin_id": c1.coin_id, "status": "confirmed"},
+            {"coin_id": c2.coin_id, "status": "rejected"},
+        ]}]
+        assert outbox.wait_for("wallet_b", PACK_TYPE)
+        transfers = _packs(outbox, "wallet_b")
+        assert [t["coin"]["coin_id"] for t in transfers] == [c1.coin_id]
+        assert transfers[0]["confirmation"]["status"] == "confirmed"
+        assert e.get_coin_state(c1.coin_id)["pk_current"] == tx1["pk_next"]
+
+        stats = pipeline.stats()
+        assert stats["ingest"]["accepted"] == 2
+        assert stats["stages"]["commit"]["processed"] == 1
+        assert all(s["queue_depth"] == 0 for s in stats["stages"].values())
+
+
+def test_register_coin_batch_through_pipeline(engine):
+    e, issuer = engine
+    outbox = _Outbox()
+    with _running(e, outbox) as pipeline:
+        coins = []
+        for _ in range(3):
+            _, pk_owner = generate_keypair()
+            coin, info = issuer.issue_coin(1, pk_to_hex(pk_owner), "engine_dest", e.pk_hex)
+            coins.append({"coin": coin.to_dict(), **info})
+        payload = {"coins": coins, "recipient_dest": "wallet_a", "description": "opname"}
+
+        assert pipeline.submit("register_coin_batch", payload, "bank", "bank")
+        assert pipeline.wait_idle(timeout=5)
+
+        assert outbox.wait_for("wallet_a", PACK_TYPE)
+        [(dest, msg_type, _)] = outbox.sent
+        deliveries = _packs(outbox, "wallet_a")
+        assert len(deliveries) == 3
+        assert all(d["description"] == "opname" for d in deliveries)
+        assert len(e.list_coins()) == 3
+
+
+def test_slow_recipient_does_not_stall_others(engine):
+    e, issuer = engine
+    outbox = _Outbox(blocked={"slow_wallet"})
+    with _running(e, outbox, deliver_workers=2) as pipeline:
+        c1, sk1 = _issue(issuer, e)
+        c2, sk2 = _issue(issuer, e)
+        tx_slow, _ = _tx(c1.coin_id, sk1, recipient="slow_wallet")
+        tx_fast, _ = _tx(c2.coin_id, sk2, recipient="fast_wallet")
+
+        pipeline.submit("transaction_batch", _batch_payload([tx_slow]), "payer", "wallet")
+        pipeline.submit("transaction_batch", _batch_payload([tx_fast]), "payer", "wallet")
+        assert outbox.wait_for("fast_wallet", PACK_TYPE)
+        assert not any(d == "slow_wallet" for d, _, _ in outbox.sent)
+
+        outbox.release.set()
+        assert pipeline.wait_idle(timeout=5)
+        assert outbox.wait_for("slow_wallet", PACK_TYPE)
+
+
+class _HeldPipeline(EnginePipeline):
+    """Decode waits for a gate, so the ingest queue fills up."""
+
+    def __init__(self, *args, **kwargs):
+        self.gate = threading.Event()
+        super().__init__(*args, **kwargs)
+
+    async def _decode(self, message):
+        await self._loop.run_in_executor(None, self.gate.wait, 10)
+        return await super()._decode(message)
+
+
+def test_submit_refuses_when_ingest_queue_full(engine):
+    e, _ = engine
+    with _running(e, _Outbox(), _HeldPipeline, queue_size=1) as pipeline:
+        submit = lambda i: pipeline.submit("transaction", {"coin_id": f"c{i}"}, "payer", "wallet")
+        assert submit(0)
+        deadline = time.monotonic() + 5
+        while pipeline.stats()["stages"]["decode"]["busy"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # One message held by the decode worker, one waiting in the queue
+        assert [submit(i) for i in range(1, 4)] == [True, False, False]
+        assert pipeline.stats()["ingest"] == {"accepted": 2, "rejected": 2}
+        pipeline.gate.set()
@@ -0,0 +1,177 @@
+import pytest
+
+from src.engine import StateEngine
+from src.issuer import Issuer
+from src.replica import EngineReplica, ShardedReplica, serve_pull
+from src.sharded_engine import ShardedStateEngine
+from src.journal import recover
+from tests.test_engine import _issue, _reissue, _tx
+
+
+@pytest.fixture
+def primary(tmp_path):
+    issuer = Issuer()
+    engine = StateEngine(db_path=str(tmp_path / "primary.db"),
+                         journal_dir=str(tmp_path / "primary-journal"), snapshot_every=4)
+    engine.register_issuer(issuer.pk_hex)
+    yield issuer, engine
+    engine.close()
+
+
+def _sync(replica, engine, batch=2):
+    """Ship pulls and replies in-process until the replica is caught up."""
+    for _ in range(100):
+        request = {**replica.pull_request(), "max": batch}
+        if not replica.apply(serve_pull(engine, request)):
+            return
+    raise AssertionError("replica haalt de primary niet in")
+
+
+def _transfer_some(issuer, engine, n_coins=3):
+    coins = [_issue(issuer, engine) for _ in range(n_coins)]
+    for coin, sk in coins[:2]:
+        engine.process_transaction(_tx(coin.coin_id, sk)[0])
+    return coins
+
+
+def test_replica_follows_primary(primary, tmp_path):
+    issuer, engine = primary
+    replica = EngineReplica(str(tmp_path / "replica"))
+    coins = _transfer_some(issuer, engine)
+    _sync(replica, engine)
+
+    status = replica.status()
+    assert status["seq"] == engine.journal_position()["seq"] == 5
+    assert status["lag_records"] == 0
+    assert status["digest_check"]["ok"] is True
+    for coin, _ in coins:
+        assert replica.coin_state(coin.coin_id)["pk_current"] == \
+            engine.get_coin_state(coin.coin_id)["pk_current"]
+
+    # New writes on the primary show up as lag until they are pulled
+    _issue(issuer, engine)
+    _issue(issuer, engine)
+    assert replica.apply(serve_pull(engine, {"after_seq": replica.seq, "max": 1}))
+    assert replica.status()["lag_records"] == 1
+    _sync(replica, engine)
+    assert replica.status()["lag_records"] == 0
+    replica.close()
+
+
+def test_fresh_replica_bootstraps_from_snapshot(primary, tmp_path):
+    issuer, engine = primary
+    _transfer_some(issuer, engine, n_coins=5)
+    assert engine.connection_stats()["journal"]["snapshot_seq"] > 0
+
+    replica = EngineReplica(str(tmp_path / "replica"))
+    assert "snapshot_offset" in replica.pull_request()
+    _sync(replica, engine)
+    assert replica.status()["coins"] == 5
+    assert replica.status()["digest"] == engine.journal_position()["digest"]
+    replica.close()
+
+
+def test_replica_comes_up_warm(primary, tmp_path):
+    issuer, engine = primary
+    coins = _transfer_some(issuer, engine)
+    replica = EngineReplica(str(tmp_path / "replica"))
+    _sync(replica, engine)
+    digest = replica.status()["digest"]
+    replica.close()
+
+    restarted = EngineReplica(str(tmp_path / "replica"))
+    assert restarted.seq == engine.journal_position()["seq"]
+    assert restarted.status()["digest"] == digest
+    assert restarted.coin_state(coins[0][0].coin_id) is not None
+    restarted.close()
+
+
+def test_digest_mismatch_is_reported(primary, tmp_path):
+    issuer, engine = primary
+    _issue(issuer, engine)
+    replica = EngineReplica(str(tmp_path / "replica"))
+    replica.apply(serve_pull(engine, replica.pull_request()))
+
+    reply = serve_pull(engine, replica.pull_request())
+    reply["digest"] = "00" * 32
+    replica.apply(reply)
+    assert replica.status()["digest_check"]["ok"] is False
+    replica.close()
+
+
+def test_replica_follows_split(primary, tmp_path):
+    issuer, engine = primary
+    coin, sk = _issue(issuer, engine, waarde=4)
+    replica = EngineReplica(str(tmp_path / "replica"))
+    _sync(replica, engine)
+
+    confirmations = engine.process_reissue(_reissue([(coin, sk)], [1, 3])[0])
+    _sync(replica, engine)
+    assert replica.coin_state(coin.coin_id) is None
+    assert all(replica.coin_state(c["coin_id"]) is not None for c in confirmations)
+    assert replica.status()["digest"] == engine.journal_position()["digest"]
+    replica.close()
+
+    _, state = recover(engine.journal_dir)
+    assert len(state) == 2 == engine.count_coins()
+
+
+def test_replica_reloads_after_primary_resync(primary, tmp_path):
+    issuer, engine = primary
+    replica = EngineReplica(str(tmp_path / "replica"))
+    coins = _transfer_some(issuer, engine)
+    _sync(replica, engine)
+    seq = replica.seq
+    engine.close()
+
+    # A transfer that reached the database but not the journal
+    unjournaled = StateEngine(db_path=str(tmp_path / "primary.db"))
+    coin, sk = coins[2]
+    unjournaled.process_transaction(_tx(coin.coin_id, sk)[0])
+    unjournaled.close()
+
+    engine = StateEngine(db_path=str(tmp_path / "primary.db"),
+                         journal_dir=str(tmp_path / "primary-journal"))
+    assert engine.journal_position()["seq"] == seq + 1
+    assert serve_pull(engine, {"after_seq": seq})["kind"] == "resync"
+    _issue(issuer, engine)
+    _sync(replica, engine)
+
+    status = replica.status()
+    assert status["seq"] == seq + 2 and status["digest_check"]["ok"] is True
+    assert replica.coin_state(coin.coin_id)["pk_current"] == \
+        engine.get_coin_state(coin.coin_id)["pk_current"]
+    replica.close()
+    engine.close()
+
+
+def test_replica_of_sharded_primary(tmp_path):
+    issuer = Issuer()
+    engine = ShardedStateEngine(str(tmp_path), n_shards=3,
+                                journal_dir=str(tmp_path / "primary-journal"), snapshot_every=4)
+    engine.register_issuer(issuer.pk_hex)
+    coins = _transfer_some(issuer, engine, n_coins=8)
+    replica = ShardedReplica(str(tmp_path / "replica"), n_shards=3)
+    for _ in range(100):
+        pulls = [{**p, "max": 2} for p in replica.pull_requests()]
+        if not any([replica.apply(serve_pull(engine, p)) for p in pulls]):
+            break
+
+    status = replica.status()
+    assert status["lag_records"] == 0 and status["digests_ok"] is True
+    assert status["coins"] == 8
+    for coin, _ in coins:
+        assert replica.coin_state(coin.coin_id)["pk_current"] == \
+            engine.get_coin_state(coin.coin_id)["pk_current"]
+
+    # A replica started with the wrong shard count says so instead of idling
+    single = ShardedReplica(str(tmp_path / "single"))
+    with pytest.raises(ValueError, match="--shards 3"):
+        single.apply(serve_pull(engine, single.pull_requests()[0]))
+    with pytest.raises(ValueError, match="geen shard"):
+        serve_pull(engine, {"shard": 3})
+    with pytest.raises(ValueError, match="primary weigert"):
+        single.apply({"kind": "error", "error": "Primary engine heeft geen journal"})
+    replica.close()
+    single.close()
+    engine.close()
@@ -0,0 +1,168 @@
+import pytest
+
+from src.crypto_utils import generate_keypair, pk_to_hex
+from src.issuer import Issuer
+from src.engine import DoubleSpendError, StateEngine
+from src.sharded_engine import ShardedStateEngine, count_coins, shard_index
+from tests.test_engine import _issue, _reissue, _tx
+
+
+@pytest.fixture(params=[False, True], ids=["threads", "processes"])
+def sharded(tmp_path, request):
+    engine = ShardedStateEngine(str(tmp_path), n_shards=3, processes=request.param)
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    yield engine, issuer
+    engine.close()
+
+
+def _issue_many(engine, issuer, n):
+    items, owners = [], {}
+    for _ in range(n):
+        sk, pk = generate_keypair()
+        coin, info = issuer.issue_coin(1, pk_to_hex(pk), "engine_dest", engine.pk_hex)
+        items.append({"coin": coin, **info})
+        owners[coin.coin_id] = sk
+    assert all(r["ok"] for r in engine.register_coins(items, "wallet_a"))
+    return owners
+
+
+def test_issuers_replicated_to_all_shards(sharded):
+    engine, issuer = sharded
+    assert all(s.is_trusted_issuer(issuer.pk_hex) for s in engine.shards)
+
+
+def test_coins_spread_and_transact(sharded):
+    engine, issuer = sharded
+    owners = _issue_many(engine, issuer, 12)
+
+    used = {shard_index(c, 3) for c in owners}
+    assert len(used) > 1
+    for coin_id in owners:
+        assert engine.shards[shard_index(coin_id, 3)].get_coin_state(coin_id) is not None
+
+    txs = [_tx(c, sk)[0] for c, sk in owners.items()]
+    results = engine.process_transactions(txs)
+    assert [r["coin_id"] for r in results] == [tx["coin_id"] for tx in txs]
+    assert all(r["ok"] for r in results)
+
+    assert len(engine.list_coins()) == 12
+    first = engine.list_coins(limit=5)
+    rest = engine.list_coins(limit=20, after=first[-1]["coin_id"])
+    assert [c["coin_id"] for c in first + rest] == sorted(owners)
+    assert list(engine.iter_coins(page_size=4)) == first + rest
+    assert len(engine.get_pending_deliveries("wallet_a")) == 12
+    assert len(engine.get_pending_deliveries("wallet_b")) == 12
+    assert engine.delivery_queue_stats()["pending"] == 0
+
+
+def test_shard_count_is_fixed(tmp_path):
+    ShardedStateEngine(str(tmp_path), n_shards=2).close()
+    with pytest.raises(ValueError):
+        ShardedStateEngine(str(tmp_path), n_shards=3)
+
+
+def test_split_outputs_stay_on_the_input_shard(sharded):
+    engine, issuer = sharded
+    coin, sk = _issue(issuer, engine, waarde=6)
+    confirmations = engine.process_reissue(_reissue([(coin, sk)], [1, 2, 3])[0])
+    assert {shard_index(c["coin_id"], 3) for c in confirmations} == {shard_index(coin.coin_id, 3)}
+    assert engine.stats()["outstanding_value"] == 6
+
+
+def _one_per_shard(engine, issuer, n_shards):
+    by_shard = {}
+    while len(by_shard) < n_shards:
+        coin, sk = _issue(issuer, engine)
+        by_shard.setdefault(shard_index(coin.coin_id, n_shards), (coin, sk))
+    return [by_shard[i] for i in range(n_shards)]
+
+
+def test_merge_across_shards(sharded):
+    engine, issuer = sharded
+    coins = _one_per_shard(engine, issuer, 3)
+    before = engine.count_coins()
+    request, _ = _reissue(coins, [3])
+    [confirmation] = engine.process_reissue(request)
+    assert shard_index(confirmation["coin_id"], 3) == shard_index(coins[0][0].coin_id, 3)
+    assert all(engine.get_coin_state(c.coin_id) is None for c, _ in coins)
+    assert engine.count_coins() == before - 2 and engine.stats()["outstanding_value"] == before
+    assert all(s.reissue_holds() == [] for s in engine.shards)
+    # A retransmission gets the same answer
+    assert engine.process_reissue(request) == [confirmation]
+    assert not engine.process_transactions([_tx(coins[1][0].coin_id, coins[1][1])[0]])[0]["ok"]
+
+
+def test_failed_merge_across_shards_restores_inputs(sharded):
+    engine, issuer = sharded
+    coins = _one_per_shard(engine, issuer, 3)
+    before = engine.count_coins()
+    # Outputs worth more than the inputs: refused after the other shards held theirs
+    with pytest.raises(ValueError, match="Waarde"):
+        engine.process_reissue(_reissue(coins, [5])[0])
+    assert all(s.reissue_holds() == [] for s in engine.shards)
+    assert engine.count_coins() == before and engine.stats()["outstanding_value"] == before
+    # Still spendable by their owners
+    results = engine.process_transactions([_tx(c.coin_id, sk)[0] for c, sk in coins])
+    assert all(r["ok"] for r in results)
+
+
+def test_holds_settled_at_start(tmp_path):
+    engine = ShardedStateEngine(str(tmp_path), n_shards=2)
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    (a, sk_a), (b, sk_b) = _one_per_shard(engine, issuer, 2)
+    before = engine.count_coins()
+    # Crash after shard 1 held its input, before shard 0 made the outputs
+    interrupted, _ = _reissue([(a, sk_a), (b, sk_b)], [2])
+    engine.shards[1].hold_reissue_inputs(interrupted, [b.coin_id])
+    engine.close()
+
+    engine = ShardedStateEngine(str(tmp_path), n_shards=2)
+    assert engine.get_coin_state(b.coin_id)["pk_current"] == pk_to_hex(sk_b.verify_key)
+    assert all(s.reissue_holds() == [] for s in engine.shards)
+    # Crash after the outputs were made, before the hold was dropped
+    done, _ = _reissue([(a, sk_a), (b, sk_b)], [2])
+    held = engine.shards[1].hold_reissue_inputs(done, [b.coin_id])
+    engine.shards[0].process_reissue(done, lambda coin_id: shard_index(coin_id, 2) == 0, held)
+    engine.close()
+
+    engine = ShardedStateEngine(str(tmp_path), n_shards=2)
+    assert engine.count_coins() == before - 1 and engine.stats()["outstanding_value"] == before
+    assert all(s.reissue_holds() == [] for s in engine.shards)
+    engine.close()
+
+
+def test_shard_processes(tmp_path):
+    engine = ShardedStateEngine(str(tmp_path), n_shards=2, processes=True)
+    events = []
+    engine.on_issuer_change(lambda event, pk: events.append(event))
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    engine.register_issuer(issuer.pk_hex)
+    assert events == ["added"]
+    assert all(s.is_trusted_issuer(issuer.pk_hex) for s in engine.shards)
+
+    coin, sk = _issue(issuer, engine)
+    tx, _ = _tx(coin.coin_id, sk)
+    engine.process_transaction(tx)
+    # Engine errors cross the pipe with their own type
+    with pytest.raises(DoubleSpendError):
+        engine.process_transaction(_tx(coin.coin_id, sk)[0])
+    engine.delivery_retention_s = 60
+    assert engine.delivery_queue_stats()["retention_s"] == 60
+    engine.close()
+
+    with pytest.raises(ValueError, match="niet 3"):
+        ShardedStateEngine(str(tmp_path), n_shards=3, processes=True)
+
+
+def test_refuses_data_dir_with_unsharded_coins(tmp_path):
+    engine = StateEngine(db_path=str(tmp_path / "engine.db"))
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    _issue(issuer, engine)
+    engine.close()
+    assert count_coins(str(tmp_path / "engine.db")) == 1
+    with pytest.raises(ValueError, match="zonder shards"):
+        ShardedStateEngine(str(tmp_path), n_shards=2)
@@ -0,0 +1,48 @@
+import pytest
+
+from src.crypto_utils import generate_keypair, sign
+from src.engine import StateEngine
+from src.issuer import Issuer
+from src.verifier import VerificationExecutor
+from tests.test_engine import _issue, _tx
+
+
+@pytest.fixture(scope="module")
+def verifier():
+    v = VerificationExecutor(workers=1, batch_size=4, max_latency_ms=5)
+    yield v
+    v.shutdown()
+
+
+def _triples(n, bad=()):
+    triples = []
+    for i in range(n):
+        sk, pk = generate_keypair()
+        msg = f"msg-{i}".encode()
+        sig = sign(sk, msg)
+        triples.append((pk.encode(), b"tampered" if i in bad else msg, sig))
+    return triples
+
+
+def test_verify_batch_in_process_pool(verifier):
+    results = verifier.verify_batch(_triples(10, bad={3, 7}))
+    assert results == [i not in (3, 7) for i in range(10)]
+
+
+def test_submit_is_micro_batched(verifier):
+    futures = [verifier.submit(*t) for t in _triples(4, bad={0})]
+    assert [f.result(timeout=10) for f in futures] == [False, True, True, True]
+    assert verifier.stats()["queued_batches"] >= 1
+
+
+def test_engine_uses_verifier(verifier):
+    engine = StateEngine(verifier=verifier)
+    issuer = Issuer()
+    engine.register_issuer(issuer.pk_hex)
+    coins = [_issue(issuer, engine) for _ in range(3)]
+
+    txs = [_tx(c.coin_id, sk)[0] for c, sk in coins]
+    txs[1]["signature"] = "00" * 64
+    results = engine.process_transactions(txs)
+    assert [r["ok"] for r in results] == [True, False, True]
+    assert engine.connection_stats()["verifier"]["verified"] > 0
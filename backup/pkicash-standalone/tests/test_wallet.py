@@ -0,0 +1,127 @@
+import uuid
+
+from src.admission import IngressQueue, busy_reply
+from src.coin import Coin
+from src.crypto_utils import generate_keypair, pk_to_hex, sign, sk_to_hex
+from src.engine import StateEngine
+from src.issuer import Issuer
+from src.wallet import Wallet
+from tests.test_engine import _issue
+
+
+def test_split_round_trip(tmp_path):
+    issuer = Issuer()
+    engine = StateEngine()
+    engine.register_issuer(issuer.pk_hex)
+    coin, sk = _issue(issuer, engine, waarde=7)
+    wallet = Wallet(str(tmp_path / "wallet.json"))
+    wallet.set_address("wallet_a")
+    coin.pk_current = engine.get_coin_state(coin.coin_id)["pk_current"]
+    wallet.add_coin_with_sk(coin, sk_to_hex(sk))
+
+    request = wallet.create_split(coin.coin_id, [4, 2, 1])
+    wallet.hold_for_reissue([coin.coin_id])
+    assert wallet.get_balance() == 0
+    engine.process_reissue(request)
+    wallet.confirm_reissue([coin.coin_id])
+    for delivery in engine.get_pending_deliveries("wallet_a"):
+        if delivery["confirmation"]["status"] == "reissued":
+            wallet.receive_from_engine(delivery)
+
+    assert sorted(c["waarde"] for c in wallet.list_coins()) == [1, 2, 4]
+    assert wallet.get_balance() == 7
+    assert all(wallet.validate_coin(wallet.get_coin(c["coin_id"]), [issuer.pk_hex], [engine.pk_hex])
+               for c in wallet.list_coins())
+    assert wallet.get_transaction_log()[0]["action"] == "omgewisseld"
+
+
+def test_batch_delivery_is_one_write(tmp_path, monkeypatch):
+    issuer = Issuer()
+    engine = StateEngine()
+    engine.register_issuer(issuer.pk_hex)
+    wallet = Wallet(str(tmp_path / "wallet.json"))
+    for _ in range(3):
+        coin, info = issuer.issue_coin(1, wallet.generate_receive_keypair(), "engine_dest", engine.pk_hex)
+        engine.register_coin(coin, "wallet_a", info["pk_next"], info["transfer_signature"])
+    deliveries = engine.get_pending_deliveries("wallet_a")
+    deliveries[1]["confirmation"]["status"] = "confirmed"
+
+    saves, matched = [], []
+    monkeypatch.setattr(wallet, "_save", lambda: saves.append(1))
+    errors = wallet.receive_batch_from_engine(deliveries, lambda d: matched.append(len(saves)))
+    assert [e is None for e in errors] == [True, False, True]
+    # Request matching runs per accepted coin, before the one write
+    assert matched == [0, 0]
+    assert len(saves) == 1
+    assert wallet.get_balance() == 2
+
+
+def test_derived_coin_needs_a_trusted_engine(tmp_path):
+    issuer = Issuer()
+    sk_forger, pk_forger = generate_keypair()
+    forged = Coin(coin_id=str(uuid.uuid4()), waarde=1_000_000, pk_current=pk_to_hex(pk_forger),
+                  pk_issuer=issuer.pk_hex, issuer_signature="", state_engine_endpoint="engine_dest",
+                  pk_engine=pk_to_hex(pk_forger))
+    forged.issuer_signature = sign(sk_forger, forged.derived_payload()).hex()
+    wallet = Wallet(str(tmp_path / "wallet.json"))
+
+    assert not wallet.validate_coin(forged, [issuer.pk_hex])
+    assert not wallet.validate_coin(forged, [issuer.pk_hex], [StateEngine().pk_hex])
+    assert wallet.validate_coin(forged, [issuer.pk_hex], [forged.pk_engine])
+
+
+def test_rejected_reissue_restores_inputs(tmp_path):
+    issuer = Issuer()
+    engine = StateEngine()
+    engine.register_issuer(issuer.pk_hex)
+    coin, sk = _issue(issuer, engine, waarde=3)
+    coin.pk_current = engine.get_coin_state(coin.coin_id)["pk_current"]
+    wallet = Wallet(str(tmp_path / "wallet.json"))
+    wallet.add_coin_with_sk(coin, sk_to_hex(sk))
+
+    request = wallet.create_split(coin.coin_id, [1, 2])
+    wallet.hold_for_reissue([coin.coin_id], request["outputs"])
+    assert wallet.get_coin(coin.coin_id) is None
+    assert list(wallet.held_coins([coin.coin_id, "other"])) == [coin.coin_id]
+    assert len(wallet._data["pending_keypairs"]) == 2
+    assert Wallet(str(tmp_path / "wallet.json")).cancel_reissue([coin.coin_id]) == 1
+    wallet = Wallet(str(tmp_path / "wallet.json"))
+    assert wallet.get_balance() == 3
+    # The refused outputs' keys are gone and the coin is spendable as before
+    assert wallet._data["pending_keypairs"] == {}
+    assert set(wallet._data["coins"][coin.coin_id]) == {"coin", "sk_current"}
+
+
+def test_shed_payment_keeps_the_coin(tmp_path):
+    issuer = Issuer()
+    engine = StateEngine()
+    engine.register_issuer(issuer.pk_hex)
+    coin, sk = _issue(issuer, engine, waarde=3)
+    coin.pk_current = engine.get_coin_state(coin.coin_id)["pk_current"]
+    wallet = Wallet(str(tmp_path / "wallet.json"))
+    wallet.add_coin_with_sk(coin, sk_to_hex(sk))
+    _, pk_next = generate_keypair()
+    tx = wallet.create_transaction(coin.coin_id, pk_to_hex(pk_next), "wallet_b")
+    wallet.hold_for_send([coin.coin_id], "wallet_b", "koffie")
+    assert wallet.get_balance() == 0
+
+    # The engine's rate limit refuses the payment and answers busy
+    busy = []
+    q = IngressQueue(lambda m: None, lambda m, reason: busy.append(busy_reply(m, reason, 1.0)),
+                     rate=0.001, burst=1)
+    assert q.offer({"type": "transaction", "payload": {}, "from_hash": "payer"})
+    assert not q.offer({"type": "transaction", "payload": tx, "from_hash": "payer"})
+    q.shutdown()
+    assert busy[0]["coin_ids"] == [coin.coin_id]
+    assert Wallet(str(tmp_path / "wallet.json")).cancel_send(busy[0]["coin_ids"]) == 1
+    wallet = Wallet(str(tmp_path / "wallet.json"))
+    assert wallet.get_balance() == 3 and wallet.get_transaction_log() == []
+
+    # Sent again and confirmed: only now is it logged as sent
+    engine.process_transaction(tx)
+    wallet.hold_for_send([coin.coin_id], "wallet_b", "koffie")
+    assert wallet.confirm_sent([coin.coin_id]) == 1
+    assert wallet.confirm_sent([coin.coin_id]) == 0
+    assert wallet.get_balance() == 0
+    [entry] = wallet.get_transaction_log()
+    assert entry["action"] == "verstuurd" and entry["counterparty"] == "wallet_b"